@@ -0,0 +1,320 @@
+"""
+Synthetic Turbomole outputs for the benchmarks
+
+The layout of each block follows real escf, egrad (with $nacme), ricc2 and
+exspectrum outputs closely enough for the tpatools parsers, with random values.
+File size is set through the number of states (and MO contributions per state)
+"""
+import random
+import argparse
+from pathlib import Path
+
+
+def _energy(i, rng):
+    # spread out the excitations a little so that no E_J/2 - E_K is exactly zero in the GFSM
+    return 0.1 + 0.01 * i + rng.uniform(0, 0.004)
+
+
+def escf(nstates=10, seed=0, tpa=True, ncont=3, homo=35):
+    rng = random.Random(seed)
+    energies = [_energy(i, rng) for i in range(1, nstates + 1)]
+    out = []
+    out.append('''
+                                  e s c f
+
+                                (bench) : TURBOMOLE rev. V7.7.1
+
+          number of occupied orbitals :   %d
+''' % homo)
+    out.append('''
+ ------------------------------------------------------------------------------
+                                  Ground state
+ ------------------------------------------------------------------------------
+
+ Total energy:                           -384.1234567890000
+
+ Electric dipole moment:
+
+                  nuc           elec       ->  total
+   x      0.00000000     -0.00000000      0.00000000     Norm:              %.8f
+   y      0.00000000      0.00000000     %.8f
+   z      1.23456789     -0.93456789     %.8f     Norm / debye:      %.6f
+''' % (rng.random(), rng.uniform(-1, 1), rng.uniform(-1, 1), rng.random() * 3))
+    for i, e in enumerate(energies, start=1):
+        out.append('''
+ ==============================================================================
+
+                              %d singlet a excitation
+
+ ==============================================================================
+
+
+ Total energy:                           -384.0000000000000
+
+ Excitation energy:                      %.16f
+
+ Excitation energy / eV:                  %.6f
+
+ Excitation energy / nm:                  %.4f
+
+ Excitation energy / cm^(-1):             %.2f
+
+
+ Oscillator strength:
+
+    velocity representation:             %.7f
+
+    length representation:               %.7f
+
+    mixed representation:                %.7f
+
+
+ Rotatory strength:
+
+    velocity representation:             0.000000
+
+    length representation:               0.000000
+
+
+ Dominant contributions:
+
+     occ. orbital   energy / eV   virt. orbital     energy / eV   |coeff.|^2*100
+''' % (i, e, e * 27.2114, 45.5634 / e, e * 219474.63, rng.random(), rng.random(), rng.random()))
+        for c in range(ncont):
+            out.append('       %d a             -%.2f        %d a              -%.2f          %.1f\n'
+                       % (homo - c % homo, rng.uniform(5, 7), homo + 1 + (i + c) % 40, rng.uniform(0, 2), rng.uniform(0, 99)))
+        out.append('''
+
+ Change of electron number for this excitation:
+
+  number of electrons in initial state:   %.1f
+
+
+ Electric transition dipole moment (velocity rep.):
+
+ x         0.01234567   Norm:           0.2345
+ y         0.23456789
+ z         0.03456789   Norm / debye:   0.5961
+
+ Electric transition dipole moment (length rep.):
+
+ x        %.8f   Norm:           1.2345
+ y         %.8f
+ z         %.8f   Norm / debye:   %.4f
+
+
+ Magnetic transition dipole moment / i:
+
+ x         0.00000000   Norm:           0.0000
+ y         0.00000000
+ z         0.00000000
+''' % (2 * homo, rng.uniform(-1, 1), rng.uniform(-1, 1), rng.uniform(-1, 1), rng.random() * 4))
+    if tpa:
+        for i, e in enumerate(energies, start=1):
+            suf = {1: 'st', 2: 'nd', 3: 'rd'}.get(i if i < 20 else i % 10, 'th')
+            out.append('''
+ ------------------------------------------------------------------------------
+
+  Two-photon absorption amplitudes for transition to the     %d%s    excitation in symmetry   a
+
+   Exc. energy:      %.8f Hartree,    %.4f eV
+
+   omega_1          %.8f Hartree,    %.4f eV
+   omega_2          %.8f Hartree,    %.4f eV
+
+  Component ab has frequencies omega_a = omega_1, omega_b = omega_2
+
+''' % (i, suf, e, e * 27.2114, e / 2, e * 13.6057, e / 2, e * 13.6057))
+            for row in 'xyz':
+                out.append('    ' + '   '.join('%s%s  %12.6f' % (row, col, rng.uniform(-50, 50)) for col in 'xyz') + '\n')
+            out.append('''
+   transition strength [a.u.]:      %.6f
+   transition strength [a.u.]:      %.6f (circular)
+''' % (rng.uniform(0, 5000), rng.uniform(0, 5000)))
+    out.append('\n    escf ended normally\n')
+    return ''.join(out)
+
+
+def egrad(nstates=4, seed=1, chosen=1, nacme=True, ncont=3):
+    """ escf-like excitation blocks, then the $nacme moments between all states and the relaxed dipole """
+    rng = random.Random(seed)
+    text = escf(nstates, seed=seed, tpa=False, ncont=ncont).replace('e s c f', 'e g r a d')
+    text = text.replace('\n    escf ended normally\n', '')
+    out = [text]
+    if nacme:
+        for k in range(0, nstates + 1):
+            for l in range(k, nstates + 1):
+                if k == 0 and l == 0:
+                    continue
+                if k == l:
+                    out.append('''
+  < %d| W | %d> - < 0|W|0> difference moments
+
+   Relaxed electric dipole moment (length rep.):
+
+ x        %.8f   Norm:           1.2345
+ y        %.8f
+ z        %.8f   Norm / debye:   3.1378
+''' % (k, l, rng.uniform(-1, 1), rng.uniform(-1, 1), rng.uniform(-1, 1)))
+                else:
+                    out.append('''
+  < %d| W | %d> transition moments
+
+   Relaxed electric transition dipole moment (length rep.):
+
+ x        %.8f   Norm:           1.2345
+ y        %.8f
+ z        %.8f   Norm / debye:   3.1378
+''' % (k, l, rng.uniform(-1, 1), rng.uniform(-1, 1), rng.uniform(-1, 1)))
+    out.append('''
+
+ Excited state no.    %d chosen for optimization
+
+ ------------------------------------------------------------------------------
+                              electrostatic moments
+ ------------------------------------------------------------------------------
+
+              charge
+
+              nuc           elec       ->  total
+             70.000000   -70.000000      0.000000
+
+                              dipole moment
+                          nuc             elec            total
+   x     0.00000000    -0.00000000     %.8f
+   y     0.00000000     0.00000000     %.8f
+   z     1.23456789    -0.93456789     %.8f
+
+   | dipole moment | =     0.5123 a.u. =     %.4f debye
+
+    egrad ended normally
+''' % (chosen, rng.uniform(-1, 1), rng.uniform(-1, 1), rng.uniform(-1, 1), rng.random() * 4))
+    return ''.join(out)
+
+
+def ricc2(nstates=4, seed=2, exprop=True):
+    rng = random.Random(seed)
+    energies = [_energy(i, rng) + 0.05 for i in range(1, nstates + 1)]
+
+    def dip():
+        return '''
+     dipole moment:
+
+                       x         %10.7f
+                       y         %10.7f
+                       z         %10.7f
+
+          | dipole moment | =     0.5123456 a.u. =     %.7f debye
+''' % (rng.uniform(-1, 1), rng.uniform(-1, 1), rng.uniform(-1, 1), rng.random() * 4)
+
+    out = ['''
+                         R I C C 2 - PROGRAM
+
+  *****************************************************
+  *        GROUND STATE FIRST-ORDER PROPERTIES        *
+  *****************************************************
+
+     Analysis of relaxed properties:
+''', dip(), '''
+     Analysis of unrelaxed properties:
+''', dip(), '''
+
+  *******************************************
+  *     ONE-PHOTON ABSORPTION STRENGTHS     *
+  *******************************************
+''']
+    for i, e in enumerate(energies, start=1):
+        out.append('''
+  +==========================================================================+
+        Transition model: CC2
+                 number, symmetry, multiplicity:   %d a    1
+                 frequency :        %.7f     a.u.         %.7f     e.V.
+
+      oscillator strength (length gauge)   :      %.8f
+      oscillator strength (velocity gauge) :      %.8f
+''' % (i, e, e * 27.2114, rng.random(), rng.random()))
+    out.append('\n  TWO-PHOTON ABSORPTION\n')
+    for i, e in enumerate(energies, start=1):
+        out.append('''
+      STATE NO.:    %d    SYMMETRY: a    MULTIPLICITY:  1
+      EXCI. ENERGY:    %.8f a.u.
+      1ST PHOTON:      %.8f a.u.
+      2ND PHOTON:      %.8f a.u.
+
+      ROTATIONALLY AVERAGED VALUES:
+        Linear:      %.4f     Circular:  %.4f
+''' % (i, e, e / 2, e / 2, rng.uniform(0, 5000), rng.uniform(0, 5000)))
+    if exprop:
+        for i, e in enumerate(energies, start=1):
+            out.append('''
+     Excited state reached by transition:
+        model: CC2
+        number, symmetry, multiplicity:   %d a    1
+        frequency :        %.7f     a.u.
+
+     Analysis of relaxed properties:
+''' % (i, e))
+            out.append(dip())
+            out.append('''
+     Analysis of unrelaxed properties:
+''')
+            out.append(dip())
+    out.append('\n  ricc2 : all done\n')
+    return ''.join(out)
+
+
+def exspectrum(nstates=10, seed=3):
+    rng = random.Random(seed)
+    out = ['''#  Excitation spectrum
+#  number  symmetry  energy/hartree  energy/eV  energy/cm^(-1)  energy/nm  osc(vel)  osc(len)
+''']
+    for i in range(1, nstates + 1):
+        e = _energy(i, rng)
+        out.append('    %d    a    %.8f    %.5f    %.5fD+05    %.2f    %.6f    %.6f\n'
+                   % (i, e, e * 27.2114, e * 2.1947463, 45.5634 / e, rng.random(), rng.random()))
+    out.append('$end\n')
+    return ''.join(out)
+
+
+def tree(basedir, nmolecules=20, nstates=10, egrad_every=3, ncont=3, seed=0):
+    """
+    Write a directory tree like a screening campaign: one escf.out per molecule
+    directory, with an egrad.out next to every egrad_every-th one
+    """
+    basedir = Path(basedir)
+    for i in range(nmolecules):
+        moldir = basedir / f'mol{i:04d}'
+        moldir.mkdir(parents=True, exist_ok=True)
+        (moldir / 'escf.out').write_text(escf(nstates, seed=seed + i, ncont=ncont))
+        if egrad_every and i % egrad_every == 0:
+            (moldir / 'egrad.out').write_text(egrad(nstates, seed=seed + i, chosen=1, ncont=ncont))
+    return basedir
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Write synthetic Turbomole outputs')
+    parser.add_argument('kind', choices=['escf', 'egrad', 'ricc2', 'exspectrum', 'tree'])
+    parser.add_argument('output', help='output file (or base directory for tree)')
+    parser.add_argument('-n', '--nstates', type=int, default=10)
+    parser.add_argument('-c', '--ncont', type=int, default=3, help='MO contributions per state (escf/egrad)')
+    parser.add_argument('-m', '--molecules', type=int, default=20, help='molecule directories (tree)')
+    parser.add_argument('-s', '--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    if args.kind == 'tree':
+        tree(args.output, args.molecules, args.nstates, ncont=args.ncont, seed=args.seed)
+        return
+
+    if args.kind == 'escf':
+        text = escf(args.nstates, seed=args.seed, ncont=args.ncont)
+    elif args.kind == 'egrad':
+        text = egrad(args.nstates, seed=args.seed, ncont=args.ncont)
+    elif args.kind == 'ricc2':
+        text = ricc2(args.nstates, seed=args.seed)
+    else:
+        text = exspectrum(args.nstates, seed=args.seed)
+    Path(args.output).write_text(text)
+
+
+if __name__ == '__main__':
+    main()
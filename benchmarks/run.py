@@ -0,0 +1,207 @@
+"""
+Time the main tpatools code paths on synthetic outputs
+
+    python benchmarks/run.py -o results.json
+    python benchmarks/run.py -o new.json --compare results.json
+
+Every case is run --repeat times for the timings, then once more under
+tracemalloc for the peak memory (which includes NumPy buffers). Results are
+written to JSON together with the versions they were measured with
+"""
+import os
+import sys
+import io
+import json
+import time
+import platform
+import argparse
+import tempfile
+import tracemalloc
+import contextlib
+import warnings
+from datetime import datetime, timezone
+from pathlib import Path
+
+os.environ.setdefault('MPLBACKEND', 'Agg')
+
+# benchmark the checkout this file belongs to, rather than an installed copy
+_src = Path(__file__).resolve().parents[1] / 'src'
+if _src.is_dir():
+    sys.path.insert(0, str(_src))
+
+import numpy as np
+import pandas as pd
+import tpatools
+from tpatools.parse import parse_escf, parse_ricc2, parse_exspec, tpa_table, gather_state_data
+from tpatools.gfsm import extract_gfsm_dipole_data, gfsm, gfsm_all
+from tpatools.plot import tpabroaden
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+import generate
+
+
+def cases(workdir, nstates, molecules):
+    """
+    (name, parameters, callable) for every benchmark at one problem size
+    """
+    workdir = Path(workdir) / f'n{nstates}'
+    workdir.mkdir(parents=True, exist_ok=True)
+
+    escf = workdir / 'escf.out'
+    escf.write_text(generate.escf(nstates, ncont=10))
+    ricc2 = workdir / 'ricc2.out'
+    ricc2.write_text(generate.ricc2(nstates))
+    egrad = workdir / 'egrad_nacme.out'
+    egrad.write_text(generate.egrad(nstates))
+    exspectrum = workdir / 'exspectrum'
+    exspectrum.write_text(generate.exspectrum(nstates))
+    tree = generate.tree(workdir / 'tree', molecules, nstates)
+
+    params = {'nstates' : nstates}
+    gfsm_data = extract_gfsm_dipole_data(egrad)
+    table = tpa_table(escf, cache=False)
+    energies = table['Excitation Energy /eV'].to_numpy()
+    cross_sections = table['Cross Section /GM'].to_numpy()
+
+    yield 'parse_escf', {**params, 'bytes' : escf.stat().st_size}, lambda: parse_escf(escf, search_for_egrad=False)
+    yield 'parse_escf', {**params, 'bytes' : escf.stat().st_size, 'lazy' : True}, lambda: parse_escf(escf, search_for_egrad=False, lazy=True)
+    yield 'parse_ricc2', {**params, 'bytes' : ricc2.stat().st_size}, lambda: parse_ricc2(ricc2)
+    yield 'parse_exspec', {**params, 'bytes' : exspectrum.stat().st_size}, lambda: parse_exspec(exspectrum)
+    yield 'parse_exspec', {**params, 'bytes' : exspectrum.stat().st_size, 'output' : 'array'}, lambda: parse_exspec(exspectrum, output='array')
+    yield 'extract_gfsm_dipole_data', {**params, 'bytes' : egrad.stat().st_size}, lambda: extract_gfsm_dipole_data(egrad)
+    yield 'gfsm', params, lambda: gfsm(gfsm_data, list(range(nstates + 1)))
+    yield 'gfsm_all', {**params, 'max_intermediates' : 1}, lambda: gfsm_all(gfsm_data, max_intermediates=1)
+    yield 'tpabroaden', {**params, 'lineshape' : 'lorentzian'}, lambda: tpabroaden(energies, cross_sections, rng=(2, 7))
+    yield 'tpabroaden', {**params, 'lineshape' : 'gaussian'}, lambda: tpabroaden(energies, cross_sections, rng=(2, 7), lineshape='gaussian')
+    yield 'tpabroaden', {**params, 'lineshape' : 'lorentzian', 'tol' : 1e-3}, lambda: tpabroaden(energies, cross_sections, rng=(2, 7), tol=1e-3)
+    yield 'tpabroaden', {**params, 'lineshape' : 'gaussian', 'cutoff' : 5}, lambda: tpabroaden(energies, cross_sections, rng=(2, 7), lineshape='gaussian', cutoff=5)
+    yield 'tpa_table', params, lambda: tpa_table(escf, cache=False)
+    yield 'gather_state_data', {**params, 'molecules' : molecules}, lambda: gather_state_data(tree, suppress_egrad_notification=True, cache=False)
+    yield 'gather_state_data', {**params, 'molecules' : molecules, 'prefetch' : 4}, lambda: gather_state_data(tree, suppress_egrad_notification=True, cache=False, prefetch=4)
+
+
+def measure(func, repeat):
+    # the parsers like to print, keep that out of the way (and the timings)
+    with contextlib.redirect_stdout(io.StringIO()), warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        times = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            func()
+            times.append(time.perf_counter() - start)
+
+        tracemalloc.start()
+        try:
+            func()
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+    return {
+        'time_min' : min(times),
+        'time_mean' : sum(times) / len(times),
+        'repeat' : repeat,
+        'peak_bytes' : peak,
+    }
+
+
+def metadata():
+    return {
+        'date' : datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'tpatools' : tpatools.__version__,
+        'python' : platform.python_version(),
+        'numpy' : np.__version__,
+        'pandas' : pd.__version__,
+        'platform' : platform.platform(),
+        'cpus' : os.cpu_count(),
+    }
+
+
+def _case_id(result):
+    return (result['name'], json.dumps(result['params'], sort_keys=True))
+
+
+def compare(results, reference):
+    """
+    Print the ratio new/reference of the best times and peak memory of the cases both files have
+    """
+    reference = {_case_id(x) : x for x in reference['results']}
+    print(f'\n{"case":<50} {"time ratio":>10} {"memory ratio":>13}')
+    for result in results['results']:
+        old = reference.get(_case_id(result))
+        if old is None:
+            continue
+        label = f'{result["name"]} {result["params"]}'
+        time_ratio = result['time_min'] / old['time_min'] if old['time_min'] else float('nan')
+        mem_ratio = result['peak_bytes'] / old['peak_bytes'] if old['peak_bytes'] else float('nan')
+        print(f'{label:<50} {time_ratio:>10.2f} {mem_ratio:>13.2f}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run the tpatools benchmarks')
+    parser.add_argument(
+        '-n',
+        '--nstates',
+        nargs='+',
+        type=int,
+        default=[10, 50],
+        help='Number of excited states in the synthetic outputs. Defaults to 10 50',
+    )
+    parser.add_argument(
+        '-m',
+        '--molecules',
+        type=int,
+        default=50,
+        help='Number of molecule directories for gather_state_data. Defaults to 50',
+    )
+    parser.add_argument(
+        '-r',
+        '--repeat',
+        type=int,
+        default=5,
+        help='Timed repetitions per case. Defaults to 5',
+    )
+    parser.add_argument(
+        '-k',
+        '--filter',
+        default=None,
+        help='Only run the cases whose name contains this string',
+    )
+    parser.add_argument(
+        '-o',
+        '--output',
+        default='benchmark_results.json',
+        help='JSON file for the results. Defaults to benchmark_results.json',
+    )
+    parser.add_argument(
+        '-c',
+        '--compare',
+        default=None,
+        help='Earlier results JSON to compare against',
+    )
+    args = parser.parse_args()
+
+    results = {'meta' : metadata(), 'results' : []}
+    with tempfile.TemporaryDirectory(prefix='tpabench') as workdir:
+        for nstates in args.nstates:
+            for name, params, func in cases(workdir, nstates, args.molecules):
+                if args.filter is not None and args.filter not in name:
+                    continue
+                result = {'name' : name, 'params' : params, **measure(func, args.repeat)}
+                results['results'].append(result)
+                print(
+                    f'{name:<26} {json.dumps(params):<45} '
+                    f'{result["time_min"] * 1e3:10.2f} ms {result["peak_bytes"] / 1024**2:9.2f} MiB'
+                )
+
+    with open(args.output, 'w') as outfile:
+        json.dump(results, outfile, indent=2)
+    print(f'\nresults written to {args.output}')
+
+    if args.compare is not None:
+        with open(args.compare) as reference:
+            compare(results, json.load(reference))
+
+
+if __name__ == '__main__':
+    main()
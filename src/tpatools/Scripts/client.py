@@ -0,0 +1,19 @@
+"""
+Entry points of the tpa, tpaplot, recurtpa and gfsm scripts.
+
+They only import the script itself when it runs in this process; with TPATOOLS_SERVER
+set, calls are sent to a running tpaserver instead (see tpatools.server)
+"""
+from tpatools.server import run_client
+
+def tpa():
+    run_client('tpa')
+
+def tpaplot():
+    run_client('tpaplot')
+
+def recurtpa():
+    run_client('recurtpa')
+
+def gfsm():
+    run_client('gfsm')
@@ -1,6 +1,6 @@
 from pathlib import Path
 import pandas as pd
-from tpatools.gfsm import gfsm, extract_gfsm_dipole_data
+from tpatools.gfsm import gfsm, gfsm_all, extract_gfsm_dipole_data
 import sys
 import argparse
 import numpy as np
@@ -44,6 +44,33 @@ def main():
         action='store_false',
         help='Suppress creation of the excel sheet',
     )
+    parser.add_argument(
+        '-a',
+        '--all',
+        action='store_true',
+        help=(
+            'Evaluate the GFSM for every excited state (or those given with --targets)'
+            + ' instead of the single model given by --states'
+        ),
+    )
+    parser.add_argument(
+        '-k',
+        '--subsets',
+        type=int,
+        default=0,
+        help=(
+            'With --all, also evaluate every model with up to this many intermediate states'
+            + ' between the ground state and the state of interest. Defaults to 0 (two state models only)'
+        ),
+    )
+    parser.add_argument(
+        '-t',
+        '--targets',
+        nargs='+',
+        type=int,
+        default=None,
+        help='With --all, only evaluate models for these states of interest',
+    )
     args = parser.parse_args()
     
     basedir = Path(args.basedir)
@@ -53,6 +80,10 @@ def main():
         filepath,
     )
     
+
+    if args.all:
+        batch(parsed_data, args)
+        return
     
     if len(args.states) < 2:
         print(
@@ -114,3 +145,23 @@ def main():
     print(f'Excitation Energy /a.u.: {parsed_data['excitations'][int(args.states[-1])]:.6f}')
     print(f'delta_TPA /a.u.: {delta_gfsm:.2f}')
     print(f'sigma_TPA /a.u.: {sigma_gfsm:.2f}')
+
+
+def batch(parsed_data, args):
+    models = gfsm_all(
+        parsed_data,
+        targets = args.targets,
+        max_intermediates = args.subsets,
+    )
+
+    if args.noexcel:
+        with pd.ExcelWriter(args.excelname, engine='openpyxl') as writer:
+            models.to_excel(writer, sheet_name='GFSM models', index=False)
+
+    # the model with the largest delta_TPA for each state of interest
+    best = (
+        models.sort_values('delta_TPA /a.u.', ascending=False)
+        .drop_duplicates('State of interest')
+        .sort_values('State of interest')
+    )
+    print(best.to_string(index=False))
@@ -2,7 +2,9 @@ import tpatools
 import argparse
 from pathlib import Path
 import sys
-from tpatools.parse import gather_state_data
+import time
+from tpatools.parse import gather_state_data, StateDataWatcher
+from tpatools.export import export_states
 
 def main():
     parser = argparse.ArgumentParser()
@@ -59,9 +61,12 @@ def main():
     parser.add_argument(
         '-n',
         '--stateno',
-        type=int,
-        default=1,
-        help='excited state number'
+        nargs='+',
+        default=['1'],
+        help=(
+            'excited state number. Several numbers, ranges (e.g. 1-10) or "all" give one row'
+            + ' per file and state, with each file parsed only once'
+        ),
     )
     parser.add_argument(
         '-sort',
@@ -93,6 +98,52 @@ def main():
             action='store_false',
             help='disable searching for egrad output',
     )
+    parser.add_argument(
+        '-j',
+        '--jobs',
+        type=int,
+        default=1,
+        help='number of processes used to parse the output files (0 to use every core) - default is 1',
+    )
+    parser.add_argument(
+        '--prefetch',
+        type=int,
+        default=0,
+        help='number of output files (up to 16 MiB each) read ahead in the background while parsing with a single process, helps on network filesystems - disabled (0) by default',
+    )
+    parser.add_argument(
+        '--index',
+        default=None,
+        help='JSON file to keep an index of the directory tree in. It is created on the first run and afterwards only the directories that changed are listed again',
+    )
+    parser.add_argument(
+        '--no-cache',
+        dest='cache',
+        action='store_false',
+        help='parse the output files again instead of reusing cached results',
+    )
+    parser.add_argument(
+        '--parquet',
+        default=None,
+        help='An output filename to write every excited state of every file to (parquet format, needs pyarrow)',
+    )
+    parser.add_argument(
+        '--feather',
+        default=None,
+        help='An output filename to write every excited state of every file to (arrow feather format, needs pyarrow)',
+    )
+    parser.add_argument(
+        '--watch',
+        type=float,
+        nargs='?',
+        const=30,
+        default=None,
+        metavar='SECONDS',
+        help=(
+            'keep running and check the directory for new or modified output files every SECONDS'
+            + ' (default 30), updating the table and any csv/excel output. Only changed files are parsed again'
+        ),
+    )
     args = parser.parse_args()
 
     if args.sortlist is not None:
@@ -101,6 +152,39 @@ def main():
     else:
         orderedkeys = None
 
+    try:
+        args.stateno = state_selection(args.stateno)
+    except ValueError:
+        print('--stateno takes state numbers, ranges of state numbers (e.g. 1-10) or "all"')
+        sys.exit()
+    lowest = min(args.stateno, default=1) if isinstance(args.stateno, list) else args.stateno
+    if args.stateno != 'all' and lowest < 1:
+        print("NOTE: Excited state numbering starts at 1 here (for your convenience). Retry with a value over 1")
+        sys.exit()
+
+    for exportfile, fileformat in [(args.parquet, 'parquet'), (args.feather, 'feather')]:
+        if exportfile is not None:
+            try:
+                nrows = export_states(
+                    args.basedir,
+                    exportfile,
+                    fileformat = fileformat,
+                    outfilename = args.escfname,
+                    egradoutname = args.egradname,
+                    search_for_egrad = args.noegrad,
+                    workers = args.jobs,
+                    cache = args.cache,
+                )
+            except ImportError as error:
+                # pyarrow is an optional dependency, the message has the install hint
+                print(error)
+                sys.exit()
+            print(f'{nrows} states written to {exportfile}')
+
+    if args.watch is not None:
+        watch(args, orderedkeys)
+        return
+
     df = gather_state_data(
         args.basedir,
         outfilename = args.escfname,
@@ -115,8 +199,32 @@ def main():
         compactnames=args.compactnames,
         orderedkeys=orderedkeys,
         search_for_egrad=args.noegrad,
+        workers=args.jobs,
+        prefetch=args.prefetch,
+        index=args.index,
+        cache=args.cache,
     )
 
+    write_table(df, args)
+
+
+def state_selection(values):
+    """ the state argument for gather_state_data from the --stateno values """
+    if values == ['all']:
+        return 'all'
+    if len(values) == 1 and '-' not in values[0].lstrip('-'):
+        return int(values[0])
+    numbers = []
+    for value in values:
+        first, sep, last = value.partition('-')
+        if sep and first:
+            numbers.extend(range(int(first), int(last) + 1))
+        else:
+            numbers.append(int(value))
+    return numbers
+
+
+def write_table(df, args):
     if args.writefile is not None:
         df.to_csv(
             args.writefile,
@@ -140,3 +248,33 @@ def main():
                 float_format=f'%.{args.round}f',
             )
         )
+
+
+def watch(args, orderedkeys):
+    watcher = StateDataWatcher(
+        args.basedir,
+        outfilename = args.escfname,
+        egradoutname = args.egradname,
+        state=args.stateno,
+        fulldirnames = args.fullnames,
+        osc = args.removeosc,
+        suppress_egrad_notification = True,
+        latexnames=args.latexnames,
+        compactnames=args.compactnames,
+        orderedkeys=orderedkeys,
+        search_for_egrad=args.noegrad,
+        workers=args.jobs,
+        prefetch=args.prefetch,
+        index=args.index,
+        cache=args.cache,
+    )
+
+    try:
+        while True:
+            changed = watcher.refresh()
+            if changed:
+                print(f'\n[{time.strftime("%H:%M:%S")}] {len(changed)} new or modified output file(s)')
+                write_table(watcher.data(tabulate=True), args)
+            time.sleep(args.watch)
+    except KeyboardInterrupt:
+        pass
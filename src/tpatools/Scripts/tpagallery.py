@@ -0,0 +1,142 @@
+from tpatools.gallery import render_gallery
+import argparse
+import time
+from pathlib import Path
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Write a simulated 2PA spectrum for every output file in a directory tree, without opening any windows',
+    )
+    parser.add_argument(
+        'basedir',
+        default='.',
+        nargs='?',
+        help='Directory to search (recursively) for output files. Defaults to the current directory',
+    )
+    parser.add_argument(
+        '-d',
+        '--outdir',
+        default='spectra',
+        help='Directory the figures are written to. Defaults to spectra',
+    )
+    parser.add_argument(
+        '-o',
+        '--escfname',
+        default=None,
+        help='name of the output file(s), by default escf.out, bse.out, tpa.out, td-dft.out and ricc2.out are searched for',
+    )
+    parser.add_argument(
+        '-e',
+        '--format',
+        default='png',
+        help='Figure file format (png, pdf, svg, ...). Defaults to png',
+    )
+    parser.add_argument(
+        '-b',
+        '--broadening',
+        default=0.1,
+        type=float,
+        help='Lifetime broadening (in eV) for simulated spectrum. Default 0.1',
+    )
+    parser.add_argument(
+        '-f',
+        '--xmin',
+        default=None,
+        type=float,
+        help='Minimum value on x axis (in eV)',
+    )
+    parser.add_argument(
+        '-t',
+        '--xmax',
+        default=None,
+        type=float,
+        help='Maximum value on x axis (in eV)',
+    )
+    parser.add_argument(
+        '-n',
+        '--nm',
+        default=False,
+        action='store_true',
+        help='Whether to convert units from eV to nm (false by default)',
+    )
+    parser.add_argument(
+        '-i',
+        '--noirrep',
+        action='store_false',
+        help="whether or not to include the irreducible representation in state labels (enabled by default)",
+    )
+    parser.add_argument(
+        '-m',
+        '--mult',
+        action='store_true',
+        help="whether or not to include the multiplicity in labels (ex S1) - disabled by default",
+    )
+    parser.add_argument(
+        '-l',
+        '--labels',
+        action = 'store_true',
+        help="include labelled state names + sticks"
+    )
+    parser.add_argument(
+        '-c',
+        '--labelcutoff',
+        type=float,
+        default=None,
+        help = 'only display labels with cross section over a specific value',
+    )
+    parser.add_argument(
+        '--size',
+        nargs=2,
+        type=float,
+        default=[6, 6],
+        metavar=('WIDTH', 'HEIGHT'),
+        help='Figure size in inches. Defaults to 6 6',
+    )
+    parser.add_argument(
+        '--dpi',
+        type=float,
+        default=150,
+        help='Resolution of raster formats. Defaults to 150',
+    )
+    parser.add_argument(
+        '--notitle',
+        dest='title',
+        action='store_false',
+        help='leave out the directory name as the title of each figure',
+    )
+    parser.add_argument(
+        '-j',
+        '--jobs',
+        type=int,
+        default=0,
+        help='number of processes used to render the figures (0 to use every core) - default is 0',
+    )
+    parser.add_argument(
+        '--no-cache',
+        dest='cache',
+        action='store_false',
+        help='parse the output files again instead of reusing cached results',
+    )
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    figures = render_gallery(
+        Path(args.basedir),
+        outdir = args.outdir,
+        outfilename = args.escfname,
+        fileformat = args.format,
+        figure_size = tuple(args.size),
+        dpi = args.dpi,
+        title = args.title,
+        irrep = args.noirrep,
+        mult = args.mult,
+        workers = args.jobs,
+        cache = args.cache,
+        width = args.broadening,
+        xmin = args.xmin,
+        xmax = args.xmax,
+        nm = args.nm,
+        labels = args.labels,
+        labelcutoff = args.labelcutoff,
+    )
+    print(f'{len(figures)} spectra written to {args.outdir} in {time.perf_counter() - start:.1f} s')
@@ -74,6 +74,12 @@ def main():
         default=None,
         help = 'only display labels with cross section over a specific value',
     )
+    parser.add_argument(
+        '--no-cache',
+        dest='cache',
+        action='store_false',
+        help='parse the output files again instead of reusing cached results',
+    )
     args = parser.parse_args()
  
     filepath = filepath_searcher(args.filepath)
@@ -81,6 +87,7 @@ def main():
         filepath,
         irrep = args.noirrep,
         mult = args.mult,
+        cache = args.cache,
     )
 
     #if args.xmin is None:
@@ -0,0 +1,25 @@
+from tpatools.server import serve, default_socket_path
+import argparse
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Keep the tpatools scripts loaded in a server on a Unix socket. Set TPATOOLS_SERVER=1 (or to the socket path) for tpa, tpaplot, recurtpa and gfsm to run through it',
+    )
+    parser.add_argument(
+        '-S',
+        '--socket',
+        default=None,
+        help=f'Path of the socket to listen on. Defaults to {default_socket_path()}',
+    )
+    parser.add_argument(
+        '--no-preload',
+        dest='preload',
+        action='store_false',
+        help='import the scripts on the first request instead of at start up',
+    )
+    args = parser.parse_args()
+
+    try:
+        serve(args.socket, preload=args.preload)
+    except (RuntimeError, PermissionError) as error:
+        print(f'ERROR: {error}')
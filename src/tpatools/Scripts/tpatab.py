@@ -50,11 +50,17 @@ def main():
         action='store_true',
         help="whether or not to include the multiplicity in labels (ex S1) - disabled by default",
     )
+    parser.add_argument(
+        '--no-cache',
+        dest='cache',
+        action='store_false',
+        help='parse the output files again instead of reusing cached results',
+    )
 
     args = parser.parse_args()
 
     filepath = filepath_searcher(args.filepath)
-    df = tpa_table(filepath, irrep=args.noirrep, mult=args.mult, compact=args.compact)
+    df = tpa_table(filepath, irrep=args.noirrep, mult=args.mult, compact=args.compact, cache=args.cache)
     if args.verbose == False:
         df.drop(
             columns=['Excitation Energy /eV', '2PA Strength /a.u.'],
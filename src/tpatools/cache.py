@@ -0,0 +1,194 @@
+import os
+import pickle
+import hashlib
+import tempfile
+from pathlib import Path
+import tpatools
+
+class ParseCache():
+    """
+    On-disk cache of parsed output files.
+
+    Entries are keyed by the resolved path, size and modification time of the
+    output (and of any companion file that went into the result, such as the
+    egrad output next to an escf file), the parser version and the parser
+    options. Changing a file therefore changes its key, and the stale entry is
+    eventually dropped by the least-recently-used eviction once the cache grows
+    past max_bytes.
+
+    Entries are pickles, and loading a pickle can run code, so the cache directory
+    is created private (mode 0o700) and not used at all if it belongs to another
+    user or others can write to it.
+    """
+
+    def __init__(self, directory=None, max_bytes=512 * 1024**2):
+        if directory is None:
+            directory = default_cache_dir()
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self._size = None
+        self._private = None
+
+    def key(self, filepath, options=(), companions=(), version=None):
+        """
+        Build the cache key of a file from its stat and the parser options
+        """
+        parts = [tpatools.__version__, version, tuple(options)]
+        for path in [filepath, *companions]:
+            path = Path(path)
+            try:
+                stat = path.stat()
+            except OSError:
+                # missing companions are part of the key too
+                parts.append((str(path.absolute()), None, None))
+                continue
+            parts.append((str(path.resolve()), stat.st_size, stat.st_mtime_ns))
+        return hashlib.sha256(repr(parts).encode()).hexdigest()
+
+    def _entry(self, key):
+        return self.directory / f'{key}.pkl'
+
+    def _usable(self):
+        """
+        Whether the cache directory is private to this user, creating it if needed
+        """
+        if self._private is None:
+            try:
+                self.directory.mkdir(mode=0o700, parents=True, exist_ok=True)
+                stat = self.directory.stat()
+            except OSError:
+                # a cache that can't be written to is simply not used
+                return False
+            owner = os.getuid() if hasattr(os, 'getuid') else stat.st_uid
+            self._private = stat.st_uid == owner and not stat.st_mode & 0o022
+            if not self._private:
+                print(f'NOTE: not using the cache in {self.directory}, it belongs to another user or others can write to it')
+        return self._private
+
+    def get(self, key):
+        """
+        Return the cached value for key, or None on a miss
+        """
+        if not self._usable():
+            return None
+        entry = self._entry(key)
+        try:
+            with entry.open('rb') as cachefile:
+                value = pickle.load(cachefile)
+        except FileNotFoundError:
+            return None
+        except Exception:
+            # unreadable or truncated entry, treat as a miss
+            entry.unlink(missing_ok=True)
+            return None
+
+        # mark as recently used
+        try:
+            os.utime(entry)
+        except OSError:
+            pass
+        return value
+
+    def has(self, key):
+        """
+        Whether there is an entry for key, without loading it
+        """
+        return self._usable() and self._entry(key).is_file()
+
+    def set(self, key, value):
+        """
+        Store a value, evicting the least recently used entries if needed
+        """
+        if not self._usable():
+            return
+        try:
+            handle, tmpname = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        except OSError:
+            return
+
+        try:
+            with os.fdopen(handle, 'wb') as cachefile:
+                pickle.dump(value, cachefile, protocol=pickle.HIGHEST_PROTOCOL)
+            # an entry that is overwritten no longer counts towards the size
+            try:
+                replaced = self._entry(key).stat().st_size
+            except FileNotFoundError:
+                replaced = 0
+            os.replace(tmpname, self._entry(key))
+            size = self._entry(key).stat().st_size - replaced
+        except (OSError, pickle.PicklingError):
+            Path(tmpname).unlink(missing_ok=True)
+            return
+
+        if self._size is None:
+            self._size = self.size()
+        else:
+            self._size += size
+
+        if self._size > self.max_bytes:
+            self.evict()
+
+    def _entries(self):
+        try:
+            return [
+                x for x in os.scandir(self.directory)
+                if x.name.endswith('.pkl') and x.is_file()
+            ]
+        except FileNotFoundError:
+            return []
+
+    def size(self):
+        """
+        Total size of the cache entries in bytes
+        """
+        return sum(x.stat().st_size for x in self._entries())
+
+    def evict(self, target=None):
+        """
+        Remove least recently used entries until the cache is below target
+        bytes (by default 90% of max_bytes)
+        """
+        if target is None:
+            target = 0.9 * self.max_bytes
+        # os.DirEntry keeps its stat result, so sizes stay known after unlinking
+        entries = sorted(self._entries(), key=lambda x: x.stat().st_mtime_ns)
+        size = sum(x.stat().st_size for x in entries)
+        for entry in entries:
+            if size <= target:
+                break
+            try:
+                os.unlink(entry.path)
+            except OSError:
+                continue
+            size -= entry.stat().st_size
+        self._size = size
+
+    def clear(self):
+        """
+        Remove every entry in the cache
+        """
+        self.evict(target=0)
+
+
+def default_cache_dir():
+    """
+    Cache location: $TPATOOLS_CACHE_DIR if set, otherwise tpatools/ in the
+    user cache directory ($XDG_CACHE_HOME or ~/.cache). Only a directory of the
+    current user that others can't write to is used (see ParseCache)
+    """
+    if os.environ.get('TPATOOLS_CACHE_DIR'):
+        return Path(os.environ['TPATOOLS_CACHE_DIR'])
+    base = os.environ.get('XDG_CACHE_HOME') or Path.home() / '.cache'
+    return Path(base) / 'tpatools'
+
+
+_default_cache = None
+
+def default_cache():
+    """
+    The shared ParseCache used by parse_results with cache=True
+    """
+    global _default_cache
+    if _default_cache is None:
+        _default_cache = ParseCache()
+    return _default_cache
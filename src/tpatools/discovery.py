@@ -0,0 +1,211 @@
+"""
+Index of the output files in a directory tree, built with a single walk
+
+Looking for several output names with one rglob each walks the tree once per name,
+and checking for the egrad output next to every escf output adds a stat per
+directory. An OutputIndex lists every directory once, keeps the names that matter
+(the outputs and their egrad companions) per directory and answers both questions
+from memory. It can be saved to JSON and reloaded; update() then only lists the
+directories whose modification time changed (which happens whenever a file or
+subdirectory is added, removed or renamed), so a reloaded index is brought up to
+date with one stat per directory instead of a full listing. Directories modified
+within a couple of seconds of being listed are listed again by the next update,
+since a file added in the same timestamp tick would not change their mtime
+"""
+import os
+import json
+import time
+from pathlib import Path
+
+# outputs searched for by default, by gather_state_data and filepath_searcher
+output_names = ('escf.out', 'bse.out', 'tpa.out', 'td-dft.out', 'tddft.out', 'ricc2.out')
+companion_names = ('egrad.out',)
+
+_index_version = 1
+
+# directory mtimes closer than this to the time of listing can't be trusted: a file
+# created in the same timestamp tick right after the listing leaves the mtime as it
+# was. Generous, to cover coarse timestamps (NFS, FAT) and some clock skew
+_mtime_granule_ns = 2 * 10**9
+
+
+class OutputIndex():
+    """
+    directory -> tracked files index of the tree below basedir.
+
+    Only files with one of the given names (by default output_names and
+    companion_names) are recorded. Directories are walked like os.walk does:
+    symbolic links to directories are not followed and unreadable directories are
+    skipped. With recursive=False only basedir itself is listed
+    """
+
+    def __init__(self, basedir, names=None, recursive=True):
+        self.basedir = Path(basedir)
+        if names is None:
+            names = (*output_names, *companion_names)
+        # a dict keeps the order of the names without duplicates
+        self.names = list(dict.fromkeys(names))
+        self.recursive = recursive
+        # relative directory ('.' for basedir) -> [mtime_ns, files, subdirectories]
+        self.directories = {}
+
+    def _list(self, relative, mtime):
+        """
+        List one directory, whose mtime (taken before listing) is mtime. Returns the
+        names of its subdirectories
+        """
+        files = []
+        subdirs = []
+        tracked = set(self.names)
+        try:
+            with os.scandir(self.basedir / relative) as entries:
+                for entry in entries:
+                    try:
+                        if entry.is_dir():
+                            if not entry.is_symlink():
+                                subdirs.append(entry.name)
+                        elif entry.name in tracked:
+                            files.append(entry.name)
+                    except OSError:
+                        continue
+        except OSError:
+            # unreadable, retried by the next update
+            mtime = None
+        if mtime is not None and time.time_ns() - mtime < _mtime_granule_ns:
+            # modified too recently to tell whether the listing saw everything,
+            # listed again by the next update
+            mtime = None
+        self.directories[relative] = [mtime, files, subdirs]
+        return subdirs
+
+    def _walk(self, relist):
+        """
+        Visit every directory in os.walk (top down) order, listing those for which
+        relist(relative, mtime) is true. Returns the number of directories listed
+        """
+        listed = 0
+        seen = set()
+        stack = ['.']
+        while stack:
+            relative = stack.pop()
+            try:
+                mtime = os.stat(self.basedir / relative).st_mtime_ns
+            except OSError:
+                # removed since it was listed
+                continue
+            seen.add(relative)
+            if relist(relative, mtime):
+                subdirs = self._list(relative, mtime)
+                listed += 1
+            else:
+                subdirs = self.directories[relative][2]
+            if self.recursive:
+                stack.extend(
+                    x if relative == '.' else f'{relative}/{x}'
+                    for x in reversed(subdirs)
+                )
+
+        for relative in set(self.directories) - seen:
+            del self.directories[relative]
+        return listed
+
+    def scan(self):
+        """ (Re)build the index from scratch, returns the index itself """
+        self.directories = {}
+        self._walk(lambda relative, mtime: True)
+        return self
+
+    def update(self):
+        """
+        Bring the index up to date, listing only the directories that are new or have
+        been modified since they were last listed. Returns the number of directories
+        that were listed
+        """
+        def changed(relative, mtime):
+            record = self.directories.get(relative)
+            return record is None or record[0] is None or record[0] != mtime
+
+        return self._walk(changed)
+
+    def _ordered(self):
+        """ The (relative directory, record) pairs in walk order """
+        stack = ['.']
+        while stack:
+            relative = stack.pop()
+            record = self.directories.get(relative)
+            if record is None:
+                continue
+            yield relative, record
+            if self.recursive:
+                stack.extend(
+                    x if relative == '.' else f'{relative}/{x}'
+                    for x in reversed(record[2])
+                )
+
+    def outputs(self, names=None):
+        """
+        Paths of the files with the given names (by default output_names), grouped by
+        name in the order of names and in walk order within a name, like one rglob
+        per name would give them
+        """
+        if names is None:
+            names = output_names
+        missing = [x for x in names if x not in self.names]
+        if missing:
+            raise ValueError(f'The index of {self.basedir} does not track {", ".join(missing)}, scan it again with these names')
+
+        found = {name : [] for name in names}
+        for relative, record in self._ordered():
+            for filename in record[1]:
+                if filename in found:
+                    found[filename].append(self.basedir / relative / filename)
+        return [x for name in names for x in found[name]]
+
+    def exists(self, filepath):
+        """
+        Whether the index has filepath (a path below basedir, as returned by outputs).
+        None if the index can't tell: the name isn't tracked or the directory isn't indexed
+        """
+        filepath = Path(filepath)
+        if filepath.name not in self.names:
+            return None
+        try:
+            relative = filepath.parent.relative_to(self.basedir).as_posix()
+        except ValueError:
+            return None
+        record = self.directories.get(relative)
+        if record is None:
+            return None
+        return filepath.name in record[1]
+
+    def save(self, path):
+        """ Write the index to a JSON file """
+        with open(path, 'w') as indexfile:
+            json.dump(
+                {
+                    'version' : _index_version,
+                    'basedir' : str(self.basedir),
+                    'names' : self.names,
+                    'recursive' : self.recursive,
+                    'directories' : self.directories,
+                },
+                indexfile,
+            )
+
+    @classmethod
+    def load(cls, path, basedir=None):
+        """
+        Read an index written by save. basedir replaces the saved base directory,
+        e.g. when the tree has been moved or is reached through another mount
+        """
+        with open(path) as indexfile:
+            saved = json.load(indexfile)
+        if saved.get('version') != _index_version:
+            raise ValueError(f'{path} was written by an incompatible version of tpatools, scan the tree again')
+        index = cls(
+            saved['basedir'] if basedir is None else basedir,
+            names = saved['names'],
+            recursive = saved['recursive'],
+        )
+        index.directories = saved['directories']
+        return index
@@ -0,0 +1,233 @@
+"""
+Export of every parsed excited state in a directory tree to Parquet or Arrow Feather
+
+Needs pyarrow, which is optional (pip install tpatools[export])
+"""
+import numpy as np
+from pathlib import Path
+from tpatools.parse import parse_results, _find_outputs, _map_files
+
+hartree_to_ev = 27.2114
+
+# (name, type, unit) of every column. The type names are pyarrow factory functions,
+# 'vector3' and 'tensor9' are fixed size lists of float64 (tensor9 is the 3x3 TPA
+# tensor flattened row by row: xx, xy, xz, yx, ...)
+_schema = [
+    ('file', 'string', None),
+    ('directory', 'string', None),
+    ('program', 'string', None),
+    ('state_index', 'int32', None),
+    ('number', 'int32', None),
+    ('irrep', 'string', None),
+    ('multiplicity', 'string', None),
+    ('excitation_energy', 'float64', 'hartree'),
+    ('excitation_energy_ev', 'float64', 'eV'),
+    ('photon_1', 'float64', 'hartree'),
+    ('photon_2', 'float64', 'hartree'),
+    ('transition_strength', 'float64', 'a.u.'),
+    ('cross_section', 'float64', 'GM'),
+    ('oscillator_strength', 'float64', None),
+    ('transition_dipole_norm', 'float64', 'debye'),
+    ('transition_dipole', 'vector3', 'debye'),
+    ('permanent_dipole_norm', 'float64', 'debye'),
+    ('permanent_dipole', 'vector3', 'debye'),
+    ('ground_dipole_norm', 'float64', 'debye'),
+    ('ground_dipole', 'vector3', 'debye'),
+    ('tpa_tensor', 'tensor9', 'a.u.'),
+    ('homo', 'int32', None),
+]
+
+
+def _pyarrow():
+    try:
+        import pyarrow
+    except ImportError:
+        raise ImportError(
+            'Exporting to parquet or feather needs pyarrow, install it with: pip install "tpatools[export]"'
+        ) from None
+    return pyarrow
+
+
+def state_schema():
+    """
+    The pyarrow schema of exported state data. Units are stored in the field metadata
+    """
+    pa = _pyarrow()
+    types = {
+        'string' : pa.string(),
+        'int32' : pa.int32(),
+        'float64' : pa.float64(),
+        'vector3' : pa.list_(pa.float64(), 3),
+        'tensor9' : pa.list_(pa.float64(), 9),
+    }
+    return pa.schema([
+        pa.field(name, types[kind], metadata=None if unit is None else {'unit' : unit})
+        for name, kind, unit in _schema
+    ])
+
+
+def _state_columns(
+        logfile,
+        basedir,
+        egradoutname = 'egrad.out',
+        search_for_egrad = True,
+        cache = False,
+    ):
+    """
+    Parse one output into a dict of NumPy columns following _schema (None if skipped)
+    """
+    try:
+        parsed_data = parse_results(
+            logfile,
+            egradoutname = egradoutname,
+            search_for_egrad = search_for_egrad,
+            suppress_egrad_notification = True,
+            cache = cache,
+            table = True,
+        )
+        states = parsed_data['states']
+    except:
+        print(f'Error parsing output file {logfile.resolve()}, check for issues')
+        return None
+
+    nstates = len(states)
+    ground = parsed_data['mu_00']
+    ground_vector = [ground.get(x, np.nan) for x in 'xyz']
+    homo = parsed_data.get('homo')
+
+    return {
+        'file' : [str(logfile.relative_to(basedir))] * nstates,
+        'directory' : [str(logfile.relative_to(basedir).parent)] * nstates,
+        'program' : [parsed_data['program']] * nstates,
+        'state_index' : np.arange(nstates, dtype=np.int32),
+        'number' : states.number.astype(np.int32),
+        'irrep' : list(states.irrep),
+        'multiplicity' : list(states.mult),
+        'excitation_energy' : states.excitation_energy,
+        'excitation_energy_ev' : states.excitation_energy * hartree_to_ev,
+        'photon_1' : states.photon_energies[:, 0],
+        'photon_2' : states.photon_energies[:, 1],
+        'transition_strength' : states.transition_strength,
+        'cross_section' : np.asarray(states.cross_section(), dtype=np.float64),
+        'oscillator_strength' : states.oscillator_strength,
+        'transition_dipole_norm' : states.transition_dipole[:, 0],
+        'transition_dipole' : states.transition_dipole[:, 1:],
+        'permanent_dipole_norm' : states.permanent_dipole[:, 0],
+        'permanent_dipole' : states.permanent_dipole[:, 1:],
+        'ground_dipole_norm' : np.full(nstates, ground.get('norm', np.nan)),
+        'ground_dipole' : np.tile(np.asarray(ground_vector, dtype=np.float64), (nstates, 1)),
+        'tpa_tensor' : states.tpa_tensor.reshape(nstates, 9),
+        'homo' : [homo] * nstates,
+    }
+
+
+def _record_batch(columns, schema):
+    pa = _pyarrow()
+    arrays = []
+    for field in schema:
+        values = columns[field.name]
+        if pa.types.is_fixed_size_list(field.type):
+            values = np.ascontiguousarray(values, dtype=np.float64)
+            arrays.append(
+                pa.FixedSizeListArray.from_arrays(
+                    pa.array(values.ravel(), from_pandas=False),
+                    field.type.list_size,
+                )
+            )
+        else:
+            arrays.append(pa.array(values, type=field.type))
+    return pa.RecordBatch.from_arrays(arrays, schema=schema)
+
+
+class _Writer():
+    """ Same interface for the parquet and feather (arrow IPC file) writers """
+
+    def __init__(self, path, schema, fileformat, compression):
+        pa = _pyarrow()
+        self.fileformat = fileformat
+        if fileformat == 'parquet':
+            import pyarrow.parquet as pq
+            self.writer = pq.ParquetWriter(path, schema, compression=compression)
+        elif fileformat == 'feather':
+            self.writer = pa.ipc.new_file(
+                str(path),
+                schema,
+                options = pa.ipc.IpcWriteOptions(compression=compression),
+            )
+        else:
+            raise ValueError(f'Unknown export format {fileformat}, use parquet or feather')
+
+    def write(self, batches):
+        pa = _pyarrow()
+        table = pa.Table.from_batches(batches)
+        if self.fileformat == 'parquet':
+            # one row group per flush
+            self.writer.write_table(table, row_group_size=table.num_rows)
+        else:
+            self.writer.write_table(table)
+
+    def close(self):
+        self.writer.close()
+
+
+def export_states(
+        basedir,
+        path,
+        fileformat = None,
+        outfilename = None,
+        egradoutname = 'egrad.out',
+        search_for_egrad = True,
+        row_group_size = 65536,
+        compression = 'zstd',
+        workers = 1,
+        cache = False,
+    ):
+    """
+        Write every excited state of every output file below basedir to a Parquet or
+        Arrow Feather file, one row per state (see state_schema for the columns).
+
+        Files are parsed one at a time (or by workers processes) and the rows are
+        written out in row groups of about row_group_size, so memory use does not
+        grow with the size of the tree. fileformat is 'parquet' or 'feather'; by default
+        it is taken from the extension of path.
+        Returns the number of states written
+    """
+    basedir = Path(basedir)
+    path = Path(path)
+    if fileformat is None:
+        fileformat = 'feather' if path.suffix in ('.feather', '.arrow', '.ipc') else 'parquet'
+
+    schema = state_schema()
+    filelist = _find_outputs(basedir, outfilename=outfilename, fulldirnames=True)
+
+    writer = _Writer(path, schema, fileformat, compression)
+    batches = []
+    buffered = 0
+    written = 0
+    try:
+        for columns in _map_files(
+                _state_columns,
+                filelist,
+                workers = workers,
+                basedir = basedir,
+                egradoutname = egradoutname,
+                search_for_egrad = search_for_egrad,
+                cache = cache,
+            ):
+            if columns is None or len(columns['number']) == 0:
+                continue
+            batches.append(_record_batch(columns, schema))
+            buffered += batches[-1].num_rows
+            if buffered >= row_group_size:
+                writer.write(batches)
+                written += buffered
+                batches = []
+                buffered = 0
+
+        if batches:
+            writer.write(batches)
+            written += buffered
+    finally:
+        writer.close()
+
+    return written
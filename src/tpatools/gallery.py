@@ -0,0 +1,133 @@
+"""
+Headless rendering of one simulated 2PA spectrum per output file in a directory tree,
+e.g. for the spectrum galleries of an SI
+
+Figures are drawn with the Agg canvas directly (pyplot is never involved, so nothing
+blocks on a window), and every process reuses a single figure for all of its files
+"""
+from pathlib import Path
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from tpatools.parse import tpa_table, _find_outputs, _map_files
+from tpatools.plot import draw_tpa
+
+# the figure reused by this process, rebuilt only when the size or resolution changes
+_figure = None
+
+def _gallery_axes(figure_size, dpi):
+    """ The emptied axes of the reused figure of this process """
+    global _figure
+    if (
+            _figure is None
+            or tuple(_figure.get_size_inches()) != tuple(figure_size)
+            or _figure.get_dpi() != dpi
+        ):
+        _figure = Figure(figsize=figure_size, dpi=dpi)
+        FigureCanvasAgg(_figure)
+        _figure.add_subplot()
+        return _figure, _figure.axes[0]
+
+    # only drop what draw_tpa adds, ax.clear() would rebuild all the tick artists too
+    ax = _figure.axes[0]
+    for artist in [*ax.lines, *ax.texts, *ax.collections, *ax.patches]:
+        artist.remove()
+    ax.set_prop_cycle(None)
+    ax.set_title('')
+    ax.relim()
+    ax.autoscale()
+    return _figure, ax
+
+
+def _gallery_names(filelist, basedir):
+    """
+        Figure names from the directories of the outputs relative to basedir
+        ('set1/mol3/escf.out' gives 'set1_mol3'), with the output name added
+        where a directory holds several outputs
+    """
+    names = [
+        '_'.join(x.relative_to(basedir).parent.parts) or basedir.resolve().name
+        for x in filelist
+    ]
+    return [
+        f'{name}_{x.stem}' if names.count(name) > 1 else name
+        for x, name in zip(filelist, names)
+    ]
+
+
+def _render_file(
+        job,
+        outdir,
+        fileformat = 'png',
+        figure_size = (6,6),
+        dpi = 150,
+        title = True,
+        irrep = True,
+        mult = False,
+        cache = False,
+        **plotoptions,
+    ):
+    """
+        Render the spectrum of one (output file, name) job, returns the path of the
+        figure (None if it could not be made)
+    """
+    logfile, name = job
+    try:
+        tab = tpa_table(logfile, irrep=irrep, mult=mult, cache=cache)
+        fig, ax = _gallery_axes(figure_size, dpi)
+        draw_tpa(ax, tab, **plotoptions)
+        if title:
+            ax.set_title(name)
+        fig.tight_layout()
+        figpath = Path(outdir) / f'{name}.{fileformat}'
+        fig.savefig(figpath, format=fileformat)
+    except:
+        print(f'Error rendering the spectrum of {logfile.resolve()}, check for issues')
+        return None
+    return figpath
+
+
+def render_gallery(
+        basedir,
+        outdir = 'spectra',
+        outfilename = None,
+        fileformat = 'png',
+        figure_size = (6,6),
+        dpi = 150,
+        title = True,
+        irrep = True,
+        mult = False,
+        workers = 1,
+        cache = False,
+        **plotoptions,
+    ):
+    """
+        Write one spectrum figure per output file below basedir into outdir, named
+        after the directory of the output (see _gallery_names).
+
+        plotoptions (width, xmin, xmax, nm, labels, labelcutoff, lineshape, ...) are
+        passed on to draw_tpa. With more than one worker the files are rendered by a
+        process pool (0 or None for every core). Returns the paths of the figures
+        written, in the order of the output files
+    """
+    basedir = Path(basedir)
+    outdir = Path(outdir)
+    outdir.mkdir(parents=True, exist_ok=True)
+
+    filelist = _find_outputs(basedir, outfilename=outfilename, fulldirnames=True)
+    jobs = list(zip(filelist, _gallery_names(filelist, basedir)))
+
+    figures = _map_files(
+        _render_file,
+        jobs,
+        workers = workers,
+        outdir = outdir,
+        fileformat = fileformat,
+        figure_size = figure_size,
+        dpi = dpi,
+        title = title,
+        irrep = irrep,
+        mult = mult,
+        cache = cache,
+        **plotoptions,
+    )
+    return [x for x in figures if x is not None]
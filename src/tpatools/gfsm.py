@@ -2,6 +2,8 @@ import numpy as np
 import pandas as pd
 from pathlib import Path
 import re
+import itertools
+from tpatools.tools import mapped
 
 def get_cos(
     a,
@@ -66,6 +68,69 @@ def au_to_GM(
 
 
 
+# regexes for the egrad output, compiled once. Each has a str and a bytes form so
+# that the output can be scanned straight from a memory map
+_float_number_all_re = r"[+-]?[0-9]*[.]?[0-9]+(?:[ED][+-]\d{2})?"
+_irrep_re_group = r"\w'\""
+
+_r_excited_state = (
+    r'(?P<stateno>[0-9]+)\s+[\w]+\s(?P<irrep>['
+    + _irrep_re_group + r']+)\s+excitation.*?'
+    + r'Excitation energy:\s+(?P<ex_energy>'
+    + _float_number_all_re
+    + r').*?Electric transition dipole moment'
+    + r' \(length rep.\):\s+x\s+(?P<mu_x>'
+    + _float_number_all_re
+    + r').*?y\s+(?P<mu_y>'
+    + _float_number_all_re
+    + r')\s+z\s+(?P<mu_z>'
+    + _float_number_all_re + r')'
+)
+_r_gs_dip = (
+    r'Ground state.*?'
+    + r'Electric dipole moment:.*?('
+    + _float_number_all_re
+    + r')\s+Norm:.*?('
+    + _float_number_all_re
+    + r')\s+z.*?('
+    + _float_number_all_re
+    + r')\s+Norm / debye'
+)
+# state-to-state transition dipoles
+_r_betweenstate_transition_moment = (
+    r'<\s+([0-9]+)\|\s+W\s+\|\s+([0-9]+)>\s+transition moments'
+    + r'.*?Relaxed electric transition dipole moment \(length rep.\):\s+x\s+('
+    + _float_number_all_re + r').*?y\s+(' + _float_number_all_re + r')\s+z\s+('
+    + _float_number_all_re + r')'
+)
+_r_difference_moments = (
+    r'<\s+([0-9]+)\|\s+W\s+\|\s+([0-9]+)>\s+'
+    + r'-\s+<\s*[0-9]+\s*\|\s*W\s*\|[0-9]+>'
+    + r'\s+difference moments'
+    + r'.*?Relaxed electric dipole moment \(length rep.\):\s+x\s+('
+    + _float_number_all_re + r').*?y\s+(' + _float_number_all_re + r')\s+z\s+('
+    + _float_number_all_re + r')'
+)
+
+def _compile(pattern):
+    """ str and bytes versions of a DOTALL regex """
+    return {
+        str : re.compile(pattern, re.DOTALL),
+        bytes : re.compile(pattern.encode(), re.DOTALL),
+    }
+
+_regex_excited_state = _compile(_r_excited_state)
+_regex_gs_dip = _compile(_r_gs_dip)
+_regex_betweenstate_transition_moment = _compile(_r_betweenstate_transition_moment)
+_regex_difference_moments = _compile(_r_difference_moments)
+
+
+def _text(group):
+    if isinstance(group, str):
+        return group
+    return group.decode()
+
+
 def _parse_exenergy(
     logstring,
 ):
@@ -73,39 +138,22 @@ def _parse_exenergy(
     Parse the single excitation portions of the egrad output file
 
     Args:
-        logstring (string): text of the output file
+        logstring (str, bytes or mmap): text of the output file
     Returns:
         list of excitation energies, dict of transition dipole moments
     """
     excitations = []
     dipoles = {}
-    irrep_re_group = r"\w'\""
-    float_number_all_re = r"[+-]?[0-9]*[.]?[0-9]+(?:[ED][+-]\d{2})?"
-    r_excited_state = (
-        r'(?P<stateno>[0-9]+)\s+[\w]+\s(?P<irrep>['
-        + irrep_re_group + r']+)\s+excitation.*?'
-        + r'Excitation energy:\s+(?P<ex_energy>'
-        + float_number_all_re
-        + r').*?Electric transition dipole moment'
-        + r' \(length rep.\):\s+x\s+(?P<mu_x>'
-        + float_number_all_re
-        + r').*?y\s+(?P<mu_y>'
-        + float_number_all_re
-        + r')\s+z\s+(?P<mu_z>'
-        + float_number_all_re + r')'
-    )
-    regex_excited_state = re.compile(r_excited_state, re.DOTALL)
-    match = regex_excited_state.finditer(logstring)
-    if match:
-        for block in match:
-            params = block.groupdict()
-            excitations.append(
-                float(params['ex_energy'])
-            )
-            dipname = f'mu_0{params['stateno']}'
-            dipoles[dipname] = [
-                float(params[f'mu_{ax}']) for ax in 'xyz'
-            ]
+    kind = str if isinstance(logstring, str) else bytes
+    for block in _regex_excited_state[kind].finditer(logstring):
+        params = block.groupdict()
+        excitations.append(
+            float(params['ex_energy'])
+        )
+        dipname = f'mu_0{_text(params['stateno'])}'
+        dipoles[dipname] = [
+            float(params[f'mu_{ax}']) for ax in 'xyz'
+        ]
 
     return excitations, dipoles
 
@@ -119,73 +167,31 @@ def extract_gfsm_dipole_data(
     Args:
         egrad_output (str or Path): path to file containing egrad results
             with $nacme block to get state-to-state transition dipoles.
+            The file is memory mapped and scanned as bytes
     Returns:
         a dictionary containing excitation energies and dipole moments
     """
     dipoles = {}
     excitations = [0]
 
+    if egrad_output is not None:
+        with mapped(egrad_output) as egrad_log:
+            match = _regex_gs_dip[bytes].search(egrad_log)
+            if match:
+                # add gs dipole data
+                dipoles['mu_00'] = [float(x) for x in match.groups()]
 
-    # Setup regex for ground state (may be used by either condition,
-    # better to set here
-    float_number_all_re = r"[+-]?[0-9]*[.]?[0-9]+(?:[ED][+-]\d{2})?"
-    irrep_re_group = r"\w'\""
-
-    regex_gs_dip = re.compile(
-        (
-            r'Ground state.*?'
-            + r'Electric dipole moment:.*?('
-            + float_number_all_re
-            + r')\s+Norm:.*?('
-            + float_number_all_re
-            + r')\s+z.*?('
-            + float_number_all_re
-            + r')\s+Norm / debye'
-        ),
-        re.DOTALL
-    )
+            for block in _regex_betweenstate_transition_moment[bytes].finditer(egrad_log):
+                dipname = f'mu_{_text(block.group(1))}{_text(block.group(2))}'
+                dipoles[dipname] = [float(x) for x in block.groups()[2:]]
 
-    if egrad_output is not None:
-        egrad_output = Path(egrad_output)
-        with egrad_output.open() as file:
-            egrad_output = file.read()
-
-        match = regex_gs_dip.search(egrad_output)
-        if match:
-            # add gs dipole data
-            dipoles['mu_00'] = [float(x) for x in match.groups()]
-        
-        # regex to find state-to-state transition dipoles
-        r_betweenstate_transition_moment = (
-            r'<\s+([0-9]+)\|\s+W\s+\|\s+([0-9]+)>\s+transition moments'
-            + r'.*?Relaxed electric transition dipole moment \(length rep.\):\s+x\s+('
-            + float_number_all_re + r').*?y\s+(' + float_number_all_re + r')\s+z\s+('
-            + float_number_all_re + r')'
-        )
-        regex_betweenstate_transition_moment = re.compile(r_betweenstate_transition_moment, re.DOTALL)
-        match = regex_betweenstate_transition_moment.finditer(egrad_output)
-        for block in match:
-            dipname = f'mu_{block.group(1)}{block.group(2)}'
-            dipoles[dipname] = [float(x) for x in block.groups()[2:]]
-
-        parsed_ex, parsed_mu0x = _parse_exenergy(egrad_output)
-        
-
-        r_difference_moments = (
-            r'<\s+([0-9]+)\|\s+W\s+\|\s+([0-9]+)>\s+'
-            + r'-\s+<\s*[0-9]+\s*\|\s*W\s*\|[0-9]+>'
-            + r'\s+difference moments'
-            + r'.*?Relaxed electric dipole moment \(length rep.\):\s+x\s+('
-            + float_number_all_re + r').*?y\s+(' + float_number_all_re + r')\s+z\s+('
-            + float_number_all_re + r')'
-        )
-        regex_difference_moments = re.compile(r_difference_moments, re.DOTALL)
-        match = regex_difference_moments.finditer(egrad_output)
-        for block in match:
-            dipname = f'mu_{block.group(1)}{block.group(2)}'
-            mu_to_gs_diff = [float(x) for x in block.groups()[2:]]
-            perm_dip = np.array(mu_to_gs_diff) + np.array(dipoles['mu_00'])
-            dipoles[dipname] = [round(float(x), 6) for x in perm_dip]
+            parsed_ex, parsed_mu0x = _parse_exenergy(egrad_log)
+
+            for block in _regex_difference_moments[bytes].finditer(egrad_log):
+                dipname = f'mu_{_text(block.group(1))}{_text(block.group(2))}'
+                mu_to_gs_diff = [float(x) for x in block.groups()[2:]]
+                perm_dip = np.array(mu_to_gs_diff) + np.array(dipoles['mu_00'])
+                dipoles[dipname] = [round(float(x), 6) for x in perm_dip]
 
         excitations.extend(parsed_ex)
         dipoles.update(parsed_mu0x)
@@ -197,31 +203,143 @@ def extract_gfsm_dipole_data(
         'dipoles' : dipoles,
         'excitations' : excitations
     }
-        
 
 
-def gfsm(
-    data,
-    states = [0, 1]
-): 
+def _term_matrices(
+    norm_0k,
+    unit_0k,
+    norm_kj,
+    unit_kj,
+    delta_e,
+    cos_0k_0l = None,
+):
     """
-    Perform a calculation of the TPA cross section using the GFSM (Generalized Few State
-        Model) equation
+    Evaluate every (K, L) term of the GFSM sum at once with NumPy broadcasting
 
     Args:
-        data: dictionary dipole moments and excitation energies, in the form output by the
-            extract_gfsm_dipole_data function
-        states: the states (including the ground state!!) to be considered within the GFSM
-            calculation. ex [0,1] for a two-state model to the first excited state,
-            [0,1,4] for a three-state model to the 4th excited state, etc.
+        norm_0k, unit_0k: norms and unit vectors of the mu_0K dipoles, one row per state K
+        norm_kj, unit_kj: norms and unit vectors of the mu_KJ dipoles
+        delta_e: E_J / 2 - E_K for every state K
+        cos_0k_0l: the mu_0K/mu_0L cosine matrix, if already known (it does not depend on J)
+    Returns:
+        dictionary of K x L matrices (and vectors over K) making up the term table
+    """
+    # pairwise cosines: cos_0k_0l[K, L] is the cosine between mu_0K and mu_0L etc.
+    if cos_0k_0l is None:
+        cos_0k_0l = unit_0k @ unit_0k.T
+    cos_kj_0k = np.einsum('ij,ij->i', unit_kj, unit_0k)
+    cos_kj_lj = unit_kj @ unit_kj.T
+    cos_0k_lj = unit_0k @ unit_kj.T
+
+    angle_term = (
+        np.outer(cos_kj_0k, cos_kj_0k)
+        + cos_0k_0l * cos_kj_lj
+        + cos_0k_lj * cos_0k_lj.T
+    )
+    dipole_prod_term = np.outer(norm_0k * norm_kj, norm_0k * norm_kj)
+    addition = (
+        (4 / (15 * np.outer(delta_e, delta_e)))
+        * dipole_prod_term
+        * angle_term
+    )
+
+    return {
+        'delta_e' : delta_e,
+        'norm_0k' : norm_0k,
+        'norm_kj' : norm_kj,
+        'dipole_prod_term' : dipole_prod_term,
+        'cos_kj_0k' : cos_kj_0k,
+        'cos_0k_0l' : cos_0k_0l,
+        'cos_kj_lj' : cos_kj_lj,
+        'cos_0k_lj' : cos_0k_lj,
+        'angle_term' : angle_term,
+        'addition' : addition,
+    }
+
+
+def _unit_vectors(vectors):
+    """ norms and unit vectors along the last axis (zero vectors give nan) """
+    norms = np.linalg.norm(vectors, axis=-1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        units = vectors / norms[..., None]
+    return norms, units
+
+
+def _gfsm_terms(
+    data,
+    states,
+):
+    """
+    Evaluate the GFSM terms of a single model
 
+    Args:
+        data: dictionary of dipole moments and excitation energies, in the form output
+            by the extract_gfsm_dipole_data function
+        states: the states (including the ground state) considered in the model
     Returns:
-        delta_tpa (calculated TPA transition moment), sigma_tpa (calculated TPA cross section)
-            and term_table (pandas dataframe containing the relevant values used in calculation
-            of each term within the GFSM calculation)
+        dictionary of the arrays making up the term table
     """
-    delta_gfsm = 0
-    term_table = pd.DataFrame(
+    j = states[-1]
+    max_state = data['excitations'][j]
+    dipoles = data['dipoles']
+
+    # dipole matrix, built once: row K holds mu_0K and mu_KJ
+    mu_0k = np.array([dipoles[_dip(0, k)] for k in states], dtype=float)
+    mu_kj = np.array([dipoles[_dip(k, j)] for k in states], dtype=float)
+
+    delta_e = max_state * 0.5 - np.array([data['excitations'][k] for k in states], dtype=float)
+
+    terms = _term_matrices(
+        *_unit_vectors(mu_0k),
+        *_unit_vectors(mu_kj),
+        delta_e,
+    )
+    terms['states'] = np.asarray(states)
+    terms['max_state'] = max_state
+    return terms
+
+
+def _term_table(terms):
+    """
+    Build the detailed GFSM term table (one column per (K, L) term) from the
+    arrays returned by _gfsm_terms
+    """
+    states = terms['states']
+    j = states[-1]
+    n = len(states)
+    k_idx, l_idx = np.meshgrid(np.arange(n), np.arange(n), indexing='ij')
+    k_idx = k_idx.ravel()
+    l_idx = l_idx.ravel()
+
+    rows = np.array([
+        states[k_idx],
+        states[l_idx],
+        terms['delta_e'][k_idx],
+        terms['delta_e'][l_idx],
+        terms['norm_0k'][k_idx],
+        terms['norm_0k'][l_idx],
+        terms['norm_kj'][k_idx],
+        terms['norm_kj'][l_idx],
+        terms['dipole_prod_term'][k_idx, l_idx],
+        terms['cos_kj_0k'][k_idx],
+        terms['cos_kj_0k'][l_idx],
+        terms['cos_0k_0l'][k_idx, l_idx],
+        terms['cos_kj_lj'][k_idx, l_idx],
+        terms['cos_0k_lj'][k_idx, l_idx],
+        terms['cos_0k_lj'][l_idx, k_idx],
+        terms['angle_term'][k_idx, l_idx],
+        terms['addition'][k_idx, l_idx],
+        au_to_GM(terms['addition'][k_idx, l_idx], terms['max_state']),
+    ], dtype=float)
+
+    # names are ambiguous once state numbers have several digits; like column
+    # assignment, a repeated name keeps its first position and the last term
+    columns = {}
+    for i, (k, l) in enumerate(zip(k_idx, l_idx)):
+        columns[f'delta_0{j}{states[k]}{states[l]}'] = i
+
+    return pd.DataFrame(
+        rows[:, list(columns.values())],
         index = [
             'K',
             'L',
@@ -241,86 +359,147 @@ def gfsm(
             'angle term',
             'delta_TPA contribution /a.u.',
             'sigma_TPA contribution /GM'
-        ]
+        ],
+        columns = list(columns),
     )
-    j = states[-1]
-    max_state = data['excitations'][j]
-    dipoles = data['dipoles']
-    firstpass = True
-    for kno, k in enumerate(states):
-        for lno, l in enumerate(states):
-            gfsm_term_name = f'delta_0{j}{k}{l}'
-            delta_ek = max_state * 0.5 - data['excitations'][k]
-            delta_el = max_state * 0.5 - data['excitations'][l]
-            #print(delta_ek)
-
-            # Calculate the relevant cosines
-            dipole_norms = [
-                np.linalg.norm(dipoles[_dip(0, k)]),
-                np.linalg.norm(dipoles[_dip(0, l)]),
-                np.linalg.norm(dipoles[_dip(k, j)]),
-                np.linalg.norm(dipoles[_dip(l, j)]),
-            ]
-            dipole_prod_term = np.prod(dipole_norms)
-
-            cos_angle_vals = [
-                get_cos(
-                    dipoles[_dip(k, j)],
-                    dipoles[_dip(0, k)],
-                ),
-                get_cos(
-                    dipoles[_dip(l, j)],
-                    dipoles[_dip(0, l)],
-                ),
-                get_cos(
-                    dipoles[_dip(0, l)],
-                    dipoles[_dip(0, k)],
-                ),
-                get_cos(
-                    dipoles[_dip(l, j)],
-                    dipoles[_dip(k, j)],
-                ),
-                get_cos(
-                    dipoles[_dip(l, j)],
-                    dipoles[_dip(0, k)],
-                ),
-                get_cos(
-                    dipoles[_dip(k, j)],
-                    dipoles[_dip(0, l)],
-                ),       
-            ]
-            angle_term = (
-                cos_angle_vals[0] * cos_angle_vals[1]
-                + cos_angle_vals[2] * cos_angle_vals[3]
-                + cos_angle_vals[4] * cos_angle_vals[5]
-            )
-
-
-            addition = (
-                (4 / (15 * delta_ek * delta_el))
-                * dipole_prod_term
-                * angle_term
-            )
-            delta_gfsm += addition 
-
-            term_data = [
-                k,
-                l,
-                delta_ek,
-                delta_el,
-            ]
-            term_data.extend(dipole_norms)
-            term_data.append(dipole_prod_term)
-            term_data.extend(cos_angle_vals)
-            term_data.append(angle_term)
-            term_data.append(addition)
-            term_data.append(au_to_GM(addition, max_state))
-            term_table[gfsm_term_name] = term_data
-            
+
+
+def gfsm(
+    data,
+    states = [0, 1],
+    terms = True,
+): 
+    """
+    Perform a calculation of the TPA cross section using the GFSM (Generalized Few State
+        Model) equation
+
+    Args:
+        data: dictionary dipole moments and excitation energies, in the form output by the
+            extract_gfsm_dipole_data function
+        states: the states (including the ground state!!) to be considered within the GFSM
+            calculation. ex [0,1] for a two-state model to the first excited state,
+            [0,1,4] for a three-state model to the 4th excited state, etc.
+        terms: whether to build the detailed term table. Skip it (terms=False) when only
+            the totals are needed
+
+    Returns:
+        delta_tpa (calculated TPA transition moment), sigma_tpa (calculated TPA cross section)
+            and term_table (pandas dataframe containing the relevant values used in calculation
+            of each term within the GFSM calculation, None if terms=False)
+    """
+    gfsm_terms = _gfsm_terms(data, states)
+    delta_gfsm = float(gfsm_terms['addition'].sum())
 
     sigma_gfsm = au_to_GM(
         delta_gfsm,
-        max_state
+        gfsm_terms['max_state']
     )
 
+    if terms:
+        term_table = _term_table(gfsm_terms)
+    else:
+        term_table = None
+
     return delta_gfsm, sigma_gfsm, term_table
+
+
+def dipole_matrix(
+    data,
+):
+    """
+    Arrange the dipoles from extract_gfsm_dipole_data in a symmetric array
+
+    Args:
+        data: dictionary of dipole moments and excitation energies, in the form output
+            by the extract_gfsm_dipole_data function
+    Returns:
+        array of shape (n, n, 3), where n is the number of states including the ground
+            state. Element [k, l] is mu_kl (= mu_lk), nan where the dipole was not parsed
+    """
+    nstates = len(data['excitations'])
+    matrix = np.full((nstates, nstates, 3), np.nan)
+    for k in range(nstates):
+        for l in range(k, nstates):
+            dipole = data['dipoles'].get(_dip(k, l))
+            if dipole is not None:
+                matrix[k, l] = dipole
+                matrix[l, k] = dipole
+    return matrix
+
+
+def gfsm_all(
+    data,
+    targets = None,
+    max_intermediates = 0,
+    intermediates = None,
+):
+    """
+    Perform GFSM calculations for several final states and sets of intermediate states
+        at once. The dipole norms and cosines are computed a single time and shared by
+        every model
+
+    Args:
+        data: dictionary dipole moments and excitation energies, in the form output by the
+            extract_gfsm_dipole_data function
+        targets: the final states J to consider. By default every excited state
+        max_intermediates: largest number of intermediate states in a model. For every
+            target, models [0, *S, J] are evaluated for every subset S of the
+            intermediates with up to max_intermediates states. 0 gives the two-state
+            model of each target
+        intermediates: the states that may be used as intermediates. By default every
+            excited state other than the target
+
+    Returns:
+        pandas dataframe with one row per model
+    """
+    excitations = np.asarray(data['excitations'], dtype=float)
+    nstates = len(excitations)
+    if targets is None:
+        targets = range(1, nstates)
+    if intermediates is None:
+        intermediates = range(1, nstates)
+
+    norms, units = _unit_vectors(dipole_matrix(data))
+    cos_0k_0l = units[0] @ units[0].T
+
+    rows = []
+    for j in targets:
+        terms = _term_matrices(
+            norms[0],
+            units[0],
+            norms[:, j],
+            units[:, j],
+            excitations[j] * 0.5 - excitations,
+            cos_0k_0l = cos_0k_0l,
+        )
+        addition = terms['addition']
+        candidates = [k for k in intermediates if k != j and k != 0]
+
+        for size in range(min(max_intermediates, len(candidates)) + 1):
+            subsets = list(itertools.combinations(candidates, size))
+            models = np.array([[0, *x, j] for x in subsets], dtype=int).reshape(len(subsets), size + 2)
+            deltas = addition[models[:, :, None], models[:, None, :]].sum(axis=(1, 2))
+            for model, delta in zip(models, deltas):
+                rows.append([
+                    j,
+                    ' '.join(str(x) for x in model),
+                    size + 2,
+                    excitations[j],
+                    delta,
+                ])
+
+    table = pd.DataFrame(
+        rows,
+        columns = [
+            'State of interest',
+            'States used',
+            'Number of states in model',
+            'Excitation energy /a.u.',
+            'delta_TPA /a.u.',
+        ],
+    )
+    table['sigma_TPA /GM'] = au_to_GM(
+        table['delta_TPA /a.u.'],
+        table['Excitation energy /a.u.'],
+    )
+    return table
@@ -1,5 +1,4 @@
 import numpy as np
-import ipywidgets as widgets
 from tpatools.plot import tpaplot_multi
 
 def widgetplot(
@@ -15,6 +14,8 @@ def widgetplot(
         label_offset_x = 0,
         label_y_increment = 0,
         monocolour = None,
+        tol = None,
+        cutoff = None,
     ):
     """
     Create a jupyter notebook widget to interactively display tpa plots from
@@ -26,7 +27,14 @@ def widgetplot(
     :param list widthslide: list to determine linewidth slider range - format [min, max, step, value]
     :param list xoffslide: x axis offset (in eV) - format [min, max, step, value]
     :param list yoffslide: y axis offset (in GM) - format [min, max, step, value]
+    :param tol: accuracy of the broadened curves relative to the peak heights, sets the number of grid points (see tpabroaden); None for the fixed 5000 point grid
+    :type tol: float or None
+    :param cutoff: only broaden each band within this many linewidths of its centre (see tpabroaden), for large sets of transitions
+    :type cutoff: float or None
     """
+    # ipywidgets is only needed in a notebook, don't import it with the module
+    import ipywidgets as widgets
+
     widthwidget = widgets.FloatSlider(
         min=widthslide[0],
         max=widthslide[1], 
@@ -95,6 +103,8 @@ def widgetplot(
         title = widgets.fixed(None),
         show_x = showxbox,
         label_y_increment = widgets.fixed(label_y_increment),
+        tol = widgets.fixed(tol),
+        cutoff = widgets.fixed(cutoff),
     )
 
 def showtab(entryname, tabledict, roundto=3):
@@ -108,6 +118,8 @@ def showtab(entryname, tabledict, roundto=3):
     )
 
 def tpatabs(tabledict, roundto=3):
+    import ipywidgets as widgets
+
     entrydropdown = widgets.Dropdown(
         options = tabledict.keys(),
         description = 'System',
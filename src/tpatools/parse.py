@@ -1,9 +1,17 @@
 ## LEARN REGULAR EXPRESSIONS FOR REWRITE
 import re
+import os
+import io
+import contextlib
+import functools
+import collections
+import concurrent.futures
 import numpy as np
-import pandas as pd
 from pathlib import Path
-from tpatools.state import State
+from tpatools.state import State, LazyState, StateTable, StateIndex, ContributionMatrix, cross_section
+from tpatools.cache import default_cache
+from tpatools.discovery import OutputIndex, output_names, companion_names
+from tpatools.tools import mapped
 import itertools
 
 def _is_int(value):
@@ -61,134 +69,174 @@ def _parse_ricc2_name(statedat):
 def _osc_to_mu_01(osc_strength, e_hartree):
     return np.sqrt((3*osc_strength) / (2*e_hartree)) * 2.541746472
 
-def parse_ricc2(filepath):
-    filepath = Path(filepath)
-    with filepath.open() as logfile:
-        log = logfile.read()
+def _new_state(states, name, homo=None, lazy=False):
+    """
+        Add a new state to states, which is either a list of State objects or a StateTable
+        (in which case the returned StateView writes straight into a new table row)
+    """
+    if isinstance(states, StateTable):
+        return states.append(name)
+    state = LazyState(name, homo=homo) if lazy else State(name, homo=homo)
+    states.append(state)
+    return state
 
+_float_re = r'-?\d+\.\d+(?:[eE][+-]?\d+)?'
 
-    au_debye_convfactor = 2.541746472
+_ricc2_transition_model = re.compile(r'Transition\s+model:\sCC2')
+_ricc2_frequency = re.compile(r'frequency\s+:\s+(' + _float_re + r')\s+a\.u')
+_ricc2_symmetry = re.compile(r'number,\ssymmetry,\smultiplicity:\s+(\d+)\s+(\S+)\s+(\d)')
+_ricc2_oscillator = re.compile(r':\s+(' + _float_re + r')')
+_ricc2_photon = re.compile(r'PHOTON:\s+(' + _float_re + r')\sa\.u')
+_ricc2_linear = re.compile(r'Linear:\s+(' + _float_re + r')')
+_ricc2_dipole_norm = re.compile(r'.*=\s+(' + _float_re + r')\s+debye')
 
-    pattern_gs = re.compile(
-        r""" 
-            GROUND\sSTATE\sFIRST-ORDER\sPROPERTIES.*
-            Analysis\sof\srelaxed\sproperties:.*
-            dipole\smoment:.*
-            x\s+(?P<mu_00_x>-?\d+\.\d+(?:[eE][+-]?\d+)?)\s+
-            y\s+(?P<mu_00_y>-?\d+\.\d+(?:[eE][+-]?\d+)?)\s+
-            z\s+(?P<mu_00_z>-?\d+\.\d+(?:[eE][+-]?\d+)?)\s+
-            \|\sdipole\smoment\s\|.*=\s+
-            (?P<mu_00_norm>-?\d+\.\d+(?:[eE][+-]?\d+)?)
-            \s+debye
-            .*Analysis\sof\sunrelaxed\sproperties.*
-            ONE-PHOTON\sABSORPTION\sSTRENGTHS
-        """,
-        re.DOTALL | re.X
-    )
 
-    pattern_1PA = re.compile(
-        r"""Transition\s+model:\sCC2.*?
-            number,\ssymmetry,\smultiplicity:\s
-            +(?P<stateno>\d+)\s+
-            (?P<irrep>\S+)\s+
-            (?P<multiplicity>\d).*?
-            frequency\s+:\s+
-            (?P<excitation_energy>\d+\.\d+(?:[eE][+-]?\d+)?)
-            \s+a\.u.*?
-            oscillator\sstrength\s\(length\sgauge\)
-            \s+:\s+(?P<oscillator_strength>\d+\.\d+(?:[eE][+-]?\d+)?)
-        """,
-        re.DOTALL | re.X
-    )
+def _scan_ricc2(logfile):
+    """
+        Single pass over the lines of a ricc2 output.
 
-    pattern_2PA = re.compile(
-        r"""
-            STATE\sNO\.:\s+.*?
-            (?P<stateno>\d)\s*
-            SYMMETRY:\s
-            (?P<irrep>\S+)\s+
-            MULTIPLICITY:\s+
-            (?P<multiplicity>\d+).*?
-            EXCI\.\sENERGY:\s+
-            (?P<excitation_energy>\d+\.\d+(?:[eE][+-]?\d+)?)
-            \sa\.u.*?
-            1ST\sPHOTON:\s+
-            (?P<photon_1>\d+\.\d+(?:[eE][+-]?\d+)?)\sa\.u.*?
-            2ND\sPHOTON:\s+
-            (?P<photon_2>\d+\.\d+(?:[eE][+-]?\d+)?)\sa\.u.*?
-            ROTATIONALLY\sAVERAGED\sVALUES:.*?
-            Linear:\s+
-            (?P<tpa_strength>-?\d+\.\d+(?:[eE][+-]?\d+)?)
-        """,
-        re.DOTALL | re.X
-    )
+        Yields (kind, block) tuples as soon as each block is complete, where kind is one of
+        'ground' (relaxed ground state dipole), 'excitation' (one-photon block),
+        'tpa' (two-photon block) or 'exprop' (relaxed excited state dipole).
+        Values are left as the strings found in the output
+    """
+    region = None  # 'ground', 'excitation', 'tpa' or 'exprop'
+    block = {}
+    relaxed = False
+    dipole = None
+    ground = None
+
+    for line in logfile:
+        if 'GROUND STATE FIRST-ORDER PROPERTIES' in line:
+            region, block, relaxed, dipole = 'ground', {}, False, None
+            continue
 
-    pattern_exprop = re.compile(
-        r"""
-            Excited\sstate\sreached\sby\stransition:\s+
-            model:\sCC2.*?number,\ssymmetry,\smultiplicity:\s+
-            (?P<stateno>\d+)\s+
-            (?P<irrep>\S+)\s+
-            (?P<multiplicity>\d+).*?
-            frequency\s+:\s+
-            (?P<excitation_energy>\d+\.\d+(?:[eE][+-]?\d+)?).*?
-            Analysis\sof\srelaxed\sproperties:.*?
-            dipole\smoment:.*?
-            x\s+(?P<mu_11_x>-?\d+\.\d+(?:[eE][+-]?\d+)?)\s+
-            y\s+(?P<mu_11_y>-?\d+\.\d+(?:[eE][+-]?\d+)?)\s+
-            z\s+(?P<mu_11_z>-?\d+\.\d+(?:[eE][+-]?\d+)?)\s+
-            \|\sdipole\smoment\s\|.*?=\s+
-            (?P<mu_11_norm>-?\d+\.\d+(?:[eE][+-]?\d+)?)
-            \s+debye
-            .*?Analysis\sof\sunrelaxed\sproperties
-        """,
-        re.DOTALL | re.X
-    )
+        if 'ONE-PHOTON ABSORPTION STRENGTHS' in line:
+            if ground is not None:
+                yield 'ground', ground
+                ground = None
+            region = None
+            continue
 
-    data = {
-        'mu_00' : {},
-    }
-    try:
-        mu_00dat = pattern_gs.search(log).groupdict()
-        # Norm is parsed in debye: add to data
-        data['mu_00']['norm'] = float(mu_00dat['mu_00_norm'])
-    
-        # convert x,y,z components of mu_00 to debye
-        for vect in ['x', 'y', 'z']:
-            data['mu_00'][vect] = float(mu_00dat[f'mu_00_{vect}']) * au_debye_convfactor
-    except AttributeError:
-        print('ground state dipole not parsed')
-    
-    states = []
-    # following logic needed in case of for ex singlets and triplets in same calc
+        if 'model: CC2' in line and _ricc2_transition_model.search(line):
+            region, block = 'excitation', {}
+            continue
 
-    for i, match in enumerate(pattern_1PA.finditer(log)):
+        if 'STATE NO.:' in line:
+            region, block = 'tpa', {'averaged' : False}
+            continue
 
-        statedat = match.groupdict()
+        if 'Excited state reached by transition:' in line:
+            region, block, relaxed, dipole = 'exprop', {'model' : 'model: CC2' in line}, False, None
+            continue
 
-        states.append(
-            State(_parse_ricc2_name(statedat))
-        )
-        states[i].set_excitation_energy(
-            float(statedat['excitation_energy']),
-            degenerateTPA=False,
-        )
-        states[i].set_osc(
-            float(statedat['oscillator_strength'])
-        )
+        if region == 'excitation':
+            if 'number, symmetry, multiplicity:' in line:
+                match = _ricc2_symmetry.search(line)
+                if match:
+                    block['stateno'], block['irrep'], block['multiplicity'] = match.groups()
+            elif 'frequency' in line and 'excitation_energy' not in block:
+                match = _ricc2_frequency.search(line)
+                if match:
+                    block['excitation_energy'] = match.group(1)
+            elif 'oscillator strength (length gauge)' in line:
+                match = _ricc2_oscillator.search(line)
+                if match and 'stateno' in block and 'excitation_energy' in block:
+                    block['oscillator_strength'] = match.group(1)
+                    yield 'excitation', block
+                    region = None
+
+        elif region == 'tpa':
+            if '1ST PHOTON:' in line:
+                block['photon_1'] = _ricc2_photon.search(line).group(1)
+            elif '2ND PHOTON:' in line:
+                block['photon_2'] = _ricc2_photon.search(line).group(1)
+            elif 'ROTATIONALLY AVERAGED VALUES:' in line:
+                block['averaged'] = True
+            elif block['averaged'] and 'Linear:' in line:
+                block['tpa_strength'] = _ricc2_linear.search(line).group(1)
+                yield 'tpa', block
+                region = None
+
+        elif region in ('ground', 'exprop'):
+            if region == 'exprop' and 'model: CC2' in line:
+                block['model'] = True
+            elif 'Analysis of relaxed properties:' in line:
+                relaxed = True
+            elif 'Analysis of unrelaxed properties' in line:
+                relaxed = False
+                if region == 'ground' and dipole is not None and 'norm' in dipole:
+                    ground = dipole
+            elif relaxed and 'dipole moment:' in line:
+                dipole = {}
+            elif relaxed and dipole is not None and '| dipole moment |' in line:
+                match = _ricc2_dipole_norm.match(line)
+                if match and len(dipole) == 3:
+                    dipole['norm'] = match.group(1)
+                    if region == 'exprop':
+                        if block['model']:
+                            yield 'exprop', dipole
+                        region = None
+            elif relaxed and dipole is not None:
+                fields = line.split()
+                if len(fields) == 2 and fields[0] in ('x', 'y', 'z'):
+                    dipole[fields[0]] = fields[1]
+
+
+def parse_ricc2(
+        filepath,
+        table = False,
+        buffers = None,
+    ):
+    """
+        Parser for ricc2 OPA and TPA calculations.
+        With table=True the states are returned as a StateTable instead of a list of State objects
+    """
+    filepath = Path(filepath)
+    au_debye_convfactor = 2.541746472
 
-        states[i].set_transition_dipole(
-            _osc_to_mu_01(
-                states[i].oscillator_strength,
-                states[i].excitation_energy,
-            ),
-            *['NA', 'NA', 'NA']
-        )
+    data = {
+        'mu_00' : {},
+    }
+    states = StateTable() if table else []
+    tpa_blocks = []
+    exprop_blocks = []
+    # following logic needed in case of for ex singlets and triplets in same calc
+    with _open_log(filepath, buffers) as logfile:
+        for kind, statedat in _scan_ricc2(logfile):
+            if kind == 'ground':
+                # Norm is parsed in debye: add to data
+                data['mu_00']['norm'] = float(statedat['norm'])
+
+                # convert x,y,z components of mu_00 to debye
+                for vect in ['x', 'y', 'z']:
+                    data['mu_00'][vect] = float(statedat[vect]) * au_debye_convfactor
+
+            elif kind == 'excitation':
+                state = _new_state(states, _parse_ricc2_name(statedat))
+                state.set_excitation_energy(
+                    float(statedat['excitation_energy']),
+                    degenerateTPA=False,
+                )
+                state.set_osc(
+                    float(statedat['oscillator_strength'])
+                )
+                state.set_transition_dipole(
+                    _osc_to_mu_01(
+                        state.oscillator_strength,
+                        state.excitation_energy,
+                    ),
+                    *['NA', 'NA', 'NA']
+                )
 
+            elif kind == 'tpa':
+                tpa_blocks.append(statedat)
 
-    for i, match in enumerate(pattern_2PA.finditer(log)):
-        statedat = match.groupdict()
+            elif kind == 'exprop':
+                exprop_blocks.append(statedat)
 
+    # 2PA and excited state property blocks are matched to the 1PA states by order
+    for i, statedat in enumerate(tpa_blocks):
         states[i].set_photon_energies([
             float(statedat['photon_1']),
             float(statedat['photon_2']),
@@ -197,22 +245,232 @@ def parse_ricc2(filepath):
             float(statedat['tpa_strength'])
         )
 
-    for i, match in enumerate(pattern_exprop.finditer(log)):
-        statedat = match.groupdict()
-
+    for i, statedat in enumerate(exprop_blocks):
         permdip_axes = []
         for cart in ['x', 'y', 'z']:
             permdip_axes.append(
-                float(statedat[f'mu_11_{cart}']) * au_debye_convfactor
+                float(statedat[cart]) * au_debye_convfactor
             )
         states[i].set_permanent_dipole(
-            float(statedat['mu_11_norm']),
+            float(statedat['norm']),
             *permdip_axes
         )
 
+    if data['mu_00'] == {}:
+        print('ground state dipole not parsed')
+
     data['states'] = states
+    data['index'] = StateIndex(states)
     return data
 
+
+_escf_occupied = re.compile(r'number\sof\soccupied\sorbitals\s+:\s+(\d+)')
+_escf_excitation_name = re.compile(r'(?P<stateno>\d+)\s(?P<multiplicity_string>\S+)\s+(?P<irrep>\S+)\s+excitation')
+_escf_excitation_energy = re.compile(r'Excitation\senergy:\s+(' + _float_re + r')')
+_escf_length_rep = re.compile(r'length\srepresentation:\s+(' + _float_re + r')')
+_escf_contribution = re.compile(r'\s*\d+\s+\S+\s+-?[\d.]+\s+\d+\s+\S+\s+-?[\d.]+\s+[\d*.]*\s*')
+_escf_debye_norm = re.compile(r'Norm\s/\sdebye:\s+(' + _float_re + r')')
+_escf_omega = re.compile(r'omega_[12]\s+([+-]?[\d.]+(?:[eE][+-]?\d+)?)')
+_escf_tpa_strength = re.compile(r'transition\sstrength\s\[a\.u\.\]:\s+(' + _float_re + r')')
+_egrad_chosen = re.compile(r'Excited\sstate\sno\.\s+(\d+)\s+chosen\sfor\soptimization')
+_egrad_debye = re.compile(r'(' + _float_re + r')\sdebye')
+
+_tpa_components = ['xx', 'xy', 'xz', 'yx', 'yy', 'yz', 'zx', 'zy', 'zz']
+
+
+def _dipole_total(line):
+    """ the last value on a dipole component line, ignoring any trailing 'Norm' field """
+    return line.split('Norm')[0].split()[-1]
+
+
+class _OffsetLines():
+    """
+        Iterate over the lines of a file opened with _open_offsets, keeping the offset
+        of the start of the current line in position
+    """
+
+    def __init__(self, logfile):
+        self.logfile = logfile
+        self.position = logfile.tell()
+
+    def __iter__(self):
+        position = self.position
+        for line in self.logfile:
+            self.position = position
+            yield line
+            position += len(line)
+
+
+def _open_offsets(filepath):
+    # latin-1 without newline translation: one character per byte, so string lengths are byte offsets
+    return open(filepath, encoding='latin-1', newline='')
+
+
+def _open_log(filepath, buffers=None, offsets=False):
+    """
+        Open an output as text: from its contents in buffers (a {path : bytes} mapping,
+        see _prefetched) if they are there, otherwise from disk.
+        With offsets it is opened like _open_offsets
+    """
+    contents = None if buffers is None else buffers.get(filepath)
+    if contents is None:
+        return _open_offsets(filepath) if offsets else open(filepath)
+    if offsets:
+        return io.TextIOWrapper(io.BytesIO(contents), encoding='latin-1', newline='')
+    return io.TextIOWrapper(io.BytesIO(contents))
+
+
+def _is_file(filepath, buffers=None):
+    """ is_file() that trusts buffers, where files found missing are stored as None """
+    if buffers is not None and filepath in buffers:
+        return buffers[filepath] is not None
+    return filepath.is_file()
+
+
+def _scan_escf(logfile, contributions=True, tensors=True, offsets=None):
+    """
+        Single pass over the lines of an escf or egrad output.
+
+        Yields (kind, block) tuples as soon as each block is complete, where kind is one of
+        'ground' (occupied orbitals and ground state dipole), 'excitation' (a single
+        excitation block), 'tpa' (a two-photon amplitude block) or 'optimized' (the
+        state chosen for optimization in egrad, with its relaxed dipole).
+        Values are left as the strings found in the output
+
+        With tensors=False the TPA tensor components are skipped, and if offsets (an
+        _OffsetLines over logfile) is given, excitation and tpa blocks get the file
+        offset of their first line as 'offset'
+    """
+    section = None
+    block = {}
+    ground = {}
+    tensor_key = None
+    start = None
+
+    for line in logfile:
+        if section == 'contributions':
+            if _escf_contribution.fullmatch(line):
+                block['mo_contributions'].append(line.strip())
+                continue
+            if line.strip() == '' or block['mo_contributions'] == []:
+                continue
+            section = 'excitation'
+
+        if section == 'tensor':
+            # components are read as 'xx <value> xy <value> ...', however they are wrapped
+            for field in line.split():
+                if tensor_key is not None:
+                    block[tensor_key] = field
+                    tensor_key = None
+                elif len(block) < len(_tpa_components) + 2 and field == _tpa_components[len(block) - 2]:
+                    tensor_key = field
+            if len(block) == len(_tpa_components) + 2:
+                section = 'tpa strength'
+            continue
+
+        if section is None or section == 'ground':
+            if 'homo' not in ground and 'number of occupied orbitals' in line:
+                ground['homo'] = _escf_occupied.search(line).group(1)
+                continue
+            if 'mu_00_norm' not in ground:
+                if 'Ground state' in line:
+                    section = 'ground'
+                    continue
+                if section == 'ground' and 'Electric dipole moment:' in line:
+                    section = 'ground dipole'
+                    continue
+
+        if section == 'ground dipole':
+            fields = line.split()
+            if fields and fields[0] in ('x', 'y', 'z'):
+                ground[f'mu_00_{fields[0]}'] = _dipole_total(line)
+                if fields[0] == 'z':
+                    ground['mu_00_norm'] = _escf_debye_norm.search(line).group(1)
+                    section = None
+                    yield 'ground', ground
+            continue
+
+        if 'excitation' in line:
+            match = _escf_excitation_name.search(line)
+            if match:
+                section = 'excitation'
+                if offsets is not None:
+                    start = offsets.position
+                block = match.groupdict()
+                block['escfname'] = match.group(0)
+                block['mo_contributions'] = []
+                continue
+
+        if 'Two-photon absorption amplitudes for transition to the' in line:
+            section = 'tpa'
+            if offsets is not None:
+                start = offsets.position
+            block = {}
+            continue
+
+        if 'chosen for optimization' in line:
+            match = _egrad_chosen.search(line)
+            if match:
+                section = 'optimized'
+                block = {'exno' : match.group(1)}
+                continue
+
+        if section == 'excitation':
+            if 'Excitation energy:' in line and 'excitation_energy' not in block:
+                block['excitation_energy'] = _escf_excitation_energy.search(line).group(1)
+            elif 'Oscillator strength:' in line:
+                block['oscillator'] = True
+            elif block.get('oscillator') and 'length representation:' in line:
+                block['oscillator_strength'] = _escf_length_rep.search(line).group(1)
+                block['oscillator'] = False
+            elif 'Dominant contributions:' in line and contributions:
+                section = 'contributions'
+            elif 'Electric transition dipole moment (length rep.):' in line:
+                section = 'transition dipole'
+
+        elif section == 'transition dipole':
+            fields = line.split()
+            if len(fields) > 1 and fields[0] in ('x', 'y', 'z'):
+                block[f'mu_01_{fields[0]}'] = fields[1]
+                if fields[0] == 'z':
+                    block['mu_01_norm'] = _escf_debye_norm.search(line).group(1)
+                    section = None
+                    if offsets is not None:
+                        block['offset'] = start
+                    yield 'excitation', block
+
+        elif section == 'tpa':
+            if 'Component ab has frequencies' in line:
+                if len(block) == 2:
+                    section = 'tensor' if tensors else 'tpa strength'
+            elif 'omega_1' in line:
+                block['photon_1'] = _escf_omega.search(line).group(1)
+            elif 'omega_2' in line:
+                block['photon_2'] = _escf_omega.search(line).group(1)
+
+        elif section == 'tpa strength':
+            if 'transition strength [a.u.]:' in line:
+                block['tpa_strength'] = _escf_tpa_strength.search(line).group(1)
+                section = None
+                if offsets is not None:
+                    block['offset'] = start
+                yield 'tpa', block
+
+        elif section == 'optimized':
+            if 'electrostatic moments' in line:
+                block['moments'] = True
+            elif block.get('moments') and 'dipole moment' in line and '|' not in line:
+                block['dipole'] = True
+            elif block.get('dipole') and '| dipole moment | =' in line:
+                block['mu_11_norm'] = _egrad_debye.search(line).group(1)
+                section = None
+                yield 'optimized', block
+            elif block.get('dipole'):
+                fields = line.split()
+                if fields and fields[0] in ('x', 'y', 'z'):
+                    block[f'mu_11_{fields[0]}'] = fields[-1]
+
+
 def _convert_dipole_axes(
         statedat,
         stringstart,
@@ -235,54 +493,19 @@ def _convert_dipole_axes(
 
 def parse_egrad(
         filepath,
+        buffers = None,
     ):
     filepath = Path(filepath)
-    with filepath.open() as logfile:
-        log = logfile.read()
-
-    pattern_egrad = re.compile(
-        r""" 
-        Ground\sstate.*?
-        Electric\sdipole\smoment:.*?
-        x.*?(?P<mu_00_x>-?\d+\.\d+(?:[eE][+-]?\d+)?)
-        \s+Norm.*?
-        y\s+[\d.-]+\s+[\d.-]+\s+
-        (?P<mu_00_y>-?\d+\.\d+(?:[eE][+-]?\d+)?).*?
-        (?P<mu_00_z>-?\d+\.\d+(?:[eE][+-]?\d+)?)
-        \s+Norm\s/\sdebye:\s+
-        (?P<mu_00_norm>-?\d+\.\d+(?:[eE][+-]?\d+)?).*?
-        Excited\sstate\sno\.\s+
-        (?P<exno>\d+)\s+chosen\s
-        for\soptimization.*?
-        electrostatic\smoments.*?
-        dipole\smoment.*?
-        x.[\s\d.-]+\s+(?P<mu_11_x>-?\d+\.\d+(?:[eE][+-]?\d+)?)\s+
-        y.[\s\d.-]+\s+(?P<mu_11_y>-?\d+\.\d+(?:[eE][+-]?\d+)?)\s+
-        z.[\s\d.-]+\s+(?P<mu_11_z>-?\d+\.\d+(?:[eE][+-]?\d+)?)\s+
-        \|\sdipole\smoment\s\|\s=.*?
-        (?P<mu_11_norm>-?\d+\.\d+)\sdebye
-        """,
-        re.DOTALL | re. X
-    )
-    scan_excitations = re.compile(
-        r""" 
-        (?P<stateno>\d+)\s
-        (?P<multiplicity>[a-z]+)\s
-        (?P<irrep>\S+)\s
-        excitation.*?
-        Electric\stransition\sdipole\s
-        moment\s\(length\srep\.\):\s+
-        x\s+(?P<mu_01_x>-?\d+\.\d+(?:[eE][+-]?\d+)?).*?
-        y\s+(?P<mu_01_y>-?\d+\.\d+(?:[eE][+-]?\d+)?)\s+
-        z\s+(?P<mu_01_z>-?\d+\.\d+(?:[eE][+-]?\d+)?)\s+
-        Norm\s/\sdebye:\s+
-        (?P<mu_01_norm>-?\d+\.\d+(?:[eE][+-]?\d+)?)
-        """,
-        re.DOTALL | re.X
-    )
-    egradata = pattern_egrad.search(log).groupdict()
-    excitation_list = [x.groupdict() for x in scan_excitations.finditer(log)]
-    
+
+    egradata = {}
+    excitation_list = []
+    with _open_log(filepath, buffers) as logfile:
+        for kind, block in _scan_escf(logfile, contributions=False):
+            if kind == 'ground' or kind == 'optimized':
+                egradata.update(block)
+            elif kind == 'excitation':
+                excitation_list.append(block)
+
     chosen_state = int(egradata['exno']) - 1
 
     data = {
@@ -313,23 +536,135 @@ def parse_egrad(
     }
     return data
 
-    
 
+def parse_contributions(
+        filepath,
+    ):
+    """
+        Read only the MO contributions of every excited state in an escf output, in one pass,
+        into a ContributionMatrix (without building any State objects)
+    """
+    filepath = Path(filepath)
+    homo = None
+    contributions = []
+    with filepath.open() as logfile:
+        for kind, statedat in _scan_escf(logfile):
+            if kind == 'ground':
+                homo = int(statedat['homo'])
+            elif kind == 'excitation':
+                contributions.append(statedat['mo_contributions'])
+    return ContributionMatrix.from_lines(contributions, homo=homo)
+
+
+def _add_escf_state(states, statedat, homo, lazy=False):
+    """ Add a state from an 'excitation' block of the escf scanner to states """
+    state = _new_state(
+        states,
+        statedat['escfname'],
+        homo = homo,
+        lazy = lazy,
+    )
+    state.set_excitation_energy(
+        float(statedat['excitation_energy']),
+        degenerateTPA=False,
+    )
+    state.set_osc(
+        float(statedat['oscillator_strength'])
+    )
+    state.set_transition_dipole(
+        float(statedat['mu_01_norm']),
+        *_convert_dipole_axes(statedat, 'mu_01_', as_dict=False)
+    )
+    ## Add TD-DFT transition amplitudes
+    for cont in statedat['mo_contributions']:
+        state.add_contribution(cont)
+    return state
+
+
+def _set_escf_tpa(state, statedat):
+    """ Add the data of a 'tpa' block of the escf scanner to a State """
+    state.set_photon_energies([
+        float(statedat['photon_1']),
+        float(statedat['photon_2']),
+    ])
+    state.set_strength(
+        float(statedat['tpa_strength'])
+    )
+    # not there if the tensors were skipped by the scanner
+    if 'xx' in statedat:
+        state.set_tpa_tensor(
+            *[float(statedat[x]) for x in _tpa_components]
+        )
+
+
+def _read_escf_block(filepath, signature, offset, kind):
+    """ The first block of kind ('excitation' or 'tpa') at offset in an escf output """
+    if _file_signature(filepath) != signature:
+        raise ValueError(f'{filepath} has changed since it was parsed, parse it again')
+    with _open_offsets(filepath) as logfile:
+        logfile.seek(offset)
+        for found, statedat in _scan_escf(logfile):
+            if found == kind:
+                return statedat
+    raise ValueError(f'No {kind} block found at offset {offset} of {filepath}')
+
+
+def _load_escf_state(filepath, signature, excitation_offset, tpa_offset, state, name):
+    """ Loader of the LazyStates of parse_escf(lazy=True), reads only the block holding name """
+    if name == 'tpa_tensor':
+        if tpa_offset is not None:
+            statedat = _read_escf_block(filepath, signature, tpa_offset, 'tpa')
+            state.set_tpa_tensor(
+                *[float(statedat[x]) for x in _tpa_components]
+            )
+    else:
+        statedat = _read_escf_block(filepath, signature, excitation_offset, 'excitation')
+        for cont in statedat['mo_contributions']:
+            state.add_contribution(cont)
+
+
+def _load_escf_table(filepath, signature, table):
+    """ Loader of the StateTable of parse_escf(table=True, lazy=True), one more pass over the file """
+    if _file_signature(filepath) != signature:
+        raise ValueError(f'{filepath} has changed since it was parsed, parse it again')
+    excitations = 0
+    tpas = 0
+    with filepath.open() as logfile:
+        for kind, statedat in _scan_escf(logfile):
+            if kind == 'excitation':
+                table.contributions[excitations] = statedat['mo_contributions']
+                excitations += 1
+            elif kind == 'tpa':
+                table[tpas].tpa_tensor = {x : float(statedat[x]) for x in _tpa_components}
+                tpas += 1
 
 
-        
 def parse_escf(
         filepath,
         search_for_egrad = True,
         states_only = False, # for backwards compatibility to my old version, which just returned a list of State objects
         egradname = 'egrad.out',
         suppress_egrad_notification = False,
+        table = False,
+        lazy = False,
+        buffers = None,
     ):
+    """
+        Parser for escf TD-DFT OPA and TPA calculations (picking up the excited state
+        dipole from an egrad output in the same directory if available).
+        With table=True the states are returned as a StateTable instead of a list of State objects
+
+        With lazy=True the MO contributions and TPA tensors are skipped, and only read
+        from the output when they are first accessed: per state from the recorded file
+        offset of its blocks for a list of LazyStates, for all rows at once for a
+        StateTable. The output must not change in the meantime
+
+        buffers can hold the already read contents of the output and its egrad
+        companion (see _prefetched)
+    """
     filepath = Path(filepath)
-    with filepath.open() as logfile:
-        log = logfile.read()
 
-    if search_for_egrad and (filepath.parent / egradname).is_file():
+    if search_for_egrad and _is_file(filepath.parent / egradname, buffers):
         egradavail = True
         egradpath = filepath.parent / egradname
         if suppress_egrad_notification == False:
@@ -340,156 +675,69 @@ def parse_escf(
     data = {}
     au_debye_convfactor = 2.541746472
 
-    pattern_gs = re.compile(
-        r""" 
-            number\sof\soccupied\s
-            orbitals\s+:\s+
-            (?P<homo>\d+).*?
-            Ground\sstate.*?
-            Electric\sdipole\smoment:.*?
-            x.*?(?P<mu_00_x>-?\d+\.\d+(?:[eE][+-]?\d+)?)
-            \s+Norm.*?
-            y\s+[\d.-]+\s+[\d.-]+\s+
-            (?P<mu_00_y>-?\d+\.\d+(?:[eE][+-]?\d+)?).*?
-            (?P<mu_00_z>-?\d+\.\d+(?:[eE][+-]?\d+)?)
-            \s+Norm\s/\sdebye:\s+
-            (?P<mu_00_norm>-?\d+\.\d+(?:[eE][+-]?\d+)?)
-        """,
-        re.DOTALL | re.X
-    )
-
-    pattern_1PA = re.compile(
-        r""" 
-            (?P<escfname>
-            (?P<stateno>\d+)\s
-            (?P<multiplicity_string>\S+)\s+
-            (?P<irrep>\S+)\s+
-            excitation
-            ).*?
-            Excitation\senergy:\s+?
-            (?P<excitation_energy>-?\d+.\d+(?:[eE][+-]?\d+)?).\s+?
-            Excitation\senergy\s/\seV.*?
-            Oscillator\sstrength:.*?
-            length\srepresentation:\s+
-            (?P<oscillator_strength>\d+\.\d+(?:[eE][+-]?\d+)?).*?
-            Dominant\scontributions:.*?
-            (?P<mo_contributions>(?:\d+\s+\S+\s+-?[\d.]+\s+\d+\s+\S+\s+-?[\d.]+\s+[\d*.]*\s+)+)
-            .*?Electric\stransition\sdipole\smoment\s\(length\srep\.\):\s+
-            x\s+(?P<mu_01_x>-?\d+\.\d+(?:[eE][+-]?\d+)?).*?
-            y\s+(?P<mu_01_y>-?\d+\.\d+(?:[eE][+-]?\d+)?).*?
-            z\s+(?P<mu_01_z>-?\d+\.\d+(?:[eE][+-]?\d+)?)\s+
-            Norm\s/\sdebye:\s+
-            (?P<mu_01_norm>-?\d+\.\d+(?:[eE][+-]?\d+)?)
-        """,
-        re.DOTALL | re.X
-    )
-
-    pattern_2PA = re.compile(
-        r""" 
-            Two-photon\sabsorption\samplitudes\sfor
-            \stransition\sto\sthe\s+
-            (?P<stateno>\d+)[a-z]{2}\s+?
-            .*?in\ssymmetry\s+?
-            (?P<irrep>\S+)\s+
-            Exc\.\senergy:\s+
-            (?P<excitation_energy>-?\d\.\d+(?:[eE][+-]?\d+)?)
-            \s+Hartree.*?
-            omega_1\s+
-            (?P<photon_1>[+-]?[\d.]+(?:[eE][+-]?\d+)?)
-            .*?omega_2\s+
-            (?P<photon_2>[+-]?[\d.]+(?:[eE][+-]?\d+)?).*?
-            Component\sab\shas\sfrequencies.*?
-            \s+xx\s+(?P<xx>[+-]?[\d.]+(?:[eE][+-]?\d+)?)
-            \s+xy\s+(?P<xy>[+-]?[\d.]+(?:[eE][+-]?\d+)?)
-            \s+xz\s+(?P<xz>[+-]?[\d.]+(?:[eE][+-]?\d+)?)
-            \s+yx\s+(?P<yx>[+-]?[\d.]+(?:[eE][+-]?\d+)?)
-            \s+yy\s+(?P<yy>[+-]?[\d.]+(?:[eE][+-]?\d+)?)
-            \s+yz\s+(?P<yz>[+-]?[\d.]+(?:[eE][+-]?\d+)?)
-            \s+zx\s+(?P<zx>[+-]?[\d.]+(?:[eE][+-]?\d+)?)
-            \s+zy\s+(?P<zy>[+-]?[\d.]+(?:[eE][+-]?\d+)?)
-            \s+zz\s+(?P<zz>[+-]?[\d.]+(?:[eE][+-]?\d+)?)
-            .*?transition\sstrength\s\[a\.u\.\]:\s+
-        (?P<tpa_strength>-?\d+\.\d+(?:[eE][-+]?\d+)?)
-        """,
-        re.DOTALL | re.X
-    )
-    gsdat = pattern_gs.search(log).groupdict()
-
-    data['mu_00'] = {}
-    data['mu_00']['norm'] = float(gsdat['mu_00_norm'])
-
-    # convert x,y,z components of mu_00 to debye
-    for vect in ['x', 'y', 'z']:
-        data['mu_00'][vect] = float(gsdat[f'mu_00_{vect}']) * au_debye_convfactor
-
-    data['homo'] = int(gsdat['homo'])
-    data['lumo'] = int(gsdat['homo']) + 1
-
-
-
-    states = []
-
-    for i, match in enumerate(pattern_1PA.finditer(log)):
-        statedat = match.groupdict()
-
-        states.append(
-            State(
-                statedat['escfname'],
-                homo = data['homo']
-            )
-        )
-        states[i].set_excitation_energy(
-            float(statedat['excitation_energy']),
-            degenerateTPA=False,
-        )
-        states[i].set_osc(
-            float(statedat['oscillator_strength'])
-        )
-
-        trandip_axes = []
-        for cart in ['x', 'y', 'z']:
-            trandip_axes.append(
-                float(statedat[f'mu_01_{cart}']) * au_debye_convfactor
-            )
-        states[i].set_transition_dipole(
-            float(statedat['mu_01_norm']),
-            *trandip_axes
-        )
-        ## Add TD-DFT transition amplitudes
-        for cont in [x.strip() for x in statedat['mo_contributions'].split('\n') if x.strip() != '']:
-            states[i].add_contribution(cont)
-
-
-    for i, match in enumerate(pattern_2PA.finditer(log)):
-        statedat = match.groupdict()
+    states = StateTable() if table else []
+    tpa_blocks = []
+    excitation_offsets = []
+    with _open_log(filepath, buffers, offsets=lazy) as logfile:
+        lines = _OffsetLines(logfile) if lazy else logfile
+        for kind, statedat in _scan_escf(
+                lines,
+                contributions = not lazy,
+                tensors = not lazy,
+                offsets = lines if lazy else None,
+            ):
+            if kind == 'ground':
+                data['mu_00'] = {}
+                data['mu_00']['norm'] = float(statedat['mu_00_norm'])
+
+                # convert x,y,z components of mu_00 to debye
+                for vect in ['x', 'y', 'z']:
+                    data['mu_00'][vect] = float(statedat[f'mu_00_{vect}']) * au_debye_convfactor
+
+                data['homo'] = int(statedat['homo'])
+                data['lumo'] = int(statedat['homo']) + 1
+                if table:
+                    states.homo = data['homo']
+
+            elif kind == 'excitation':
+                _add_escf_state(states, statedat, data['homo'], lazy=lazy)
+                excitation_offsets.append(statedat.get('offset'))
+
+            elif kind == 'tpa':
+                tpa_blocks.append(statedat)
+
+    if 'mu_00' not in data:
+        raise ValueError(f'No ground state data found in {filepath}')
+
+    # 2PA blocks are matched to the excitations by order
+    for i, statedat in enumerate(tpa_blocks):
+        _set_escf_tpa(states[i], statedat)
+
+    if lazy:
+        filepath = filepath.resolve()
+        signature = _file_signature(filepath)
+        if table:
+            states.defer(functools.partial(_load_escf_table, filepath, signature))
+        else:
+            for i, state in enumerate(states):
+                state.loader = functools.partial(
+                    _load_escf_state,
+                    filepath,
+                    signature,
+                    excitation_offsets[i],
+                    tpa_blocks[i]['offset'] if i < len(tpa_blocks) else None,
+                )
 
-        states[i].set_photon_energies([
-            float(statedat['photon_1']),
-            float(statedat['photon_2']),
-        ])
-        states[i].set_strength(
-            float(statedat['tpa_strength'])
-        )
-        states[i].set_tpa_tensor(
-            float(statedat['xx']),
-            float(statedat['xy']),
-            float(statedat['xz']),
-            float(statedat['yx']),
-            float(statedat['yy']),
-            float(statedat['yz']),
-            float(statedat['zx']),
-            float(statedat['zy']),
-            float(statedat['zz'])
-        )
+    index = StateIndex(states)
 
     if egradavail:
-        egrad_data = parse_egrad(egradpath)
+        egrad_data = parse_egrad(egradpath, buffers)
         egrad_state = egrad_data['stateno']
         egrad_irrep = egrad_data['irrep']
-        matching_states = [x for x in states if x.number == egrad_state and x.irrep == egrad_irrep]
+        matching_states = index.positions(egrad_state, egrad_irrep)
         if len(matching_states) > 1:
             print('ERROR: Unexpected double state match for egrad, something is funky (I coded it wrong, clearly)')
-        match_index = states.index(matching_states[0])
+        match_index = matching_states[0]
         states[match_index].set_permanent_dipole(
             **egrad_data['mu_11']
         )
@@ -498,41 +746,148 @@ def parse_escf(
         return states
     else:
         data['states'] = states
+        data['index'] = index
         return data
 
 
         
+# bump whenever the parsers change what they return, so cached results are not reused
+_parser_version = 3
+
+_program_banners = [
+    ('escf', re.compile(rb'e s c f')),
+    ('ricc2', re.compile(rb'R I C C 2')),
+    ('egrad', re.compile(rb'e g r a d')),
+]
+
+# the program banner is printed within the first few lines of the output
+_header_bytes = 64 * 1024
+
+def _sniff_program(filepath, buffers=None):
+    """
+        Identify the program (escf, ricc2 or egrad) that wrote an output from its banner.
+
+        Only the header is read; if no banner is found there, the whole file is scanned
+        through a memory map. Returns None for unrecognized files
+    """
+    contents = None if buffers is None else buffers.get(filepath)
+    if contents is not None:
+        for program, banner in _program_banners:
+            if banner.search(contents, 0, _header_bytes) or banner.search(contents):
+                return program
+        return None
+
+    with open(filepath, 'rb') as logfile:
+        header = logfile.read(_header_bytes)
+    for program, banner in _program_banners:
+        if banner.search(header):
+            return program
+
+    if len(header) < _header_bytes:
+        return None
+
+    with mapped(filepath) as log:
+        for program, banner in _program_banners:
+            if banner.search(log):
+                return program
+    return None
+
+
+def _cache_key(cache, filepath, egradoutname, search_for_egrad, table, lazy):
+    """ The key of a parse_results call in cache """
+    return cache.key(
+        filepath,
+        options = (egradoutname, search_for_egrad, table, lazy),
+        companions = [filepath.parent / egradoutname],
+        version = _parser_version,
+    )
+
+
 def parse_results(
         filepath,
         egradoutname='egrad.out', ## for escf parsing, this allows nonstandard checks for the egrad name
         search_for_egrad = True, # passed to escf parser is escf file supplied
         suppress_egrad_notification = False,
+        cache = False,
+        table = False,
+        lazy = False,
+        buffers = None,
     ):
     """
         General parser for escf, egrad, and ricc2 OPA and TPA calculations
+
+        With table=True, escf and ricc2 states are returned as a StateTable. With lazy=True,
+        escf MO contributions and TPA tensors are only read when accessed (see parse_escf).
+        The result also records the program that wrote the output under 'program'
+        ('escf', 'ricc2' or 'egrad')
+
+        With cache=True, parsed results are kept in an on-disk cache (see tpatools.cache) and
+        reused until the output (or its egrad companion) changes; pass a ParseCache to use a
+        different cache. Caching is off by default, the command line scripts turn it on
+
+        buffers is an optional {path : bytes} mapping with the contents of the output and
+        its egrad companion, read ahead of time (see _prefetched)
     """
     filepath = Path(filepath)
-    with filepath.open() as logfile:
-        log = logfile.read()
 
-    if re.search('e s c f', log):
-        return parse_escf(
+    if cache:
+        if cache is True:
+            cache = default_cache()
+        cachekey = _cache_key(cache, filepath, egradoutname, search_for_egrad, table, lazy)
+        data = cache.get(cachekey)
+        if data is not None:
+            return data
+
+    program = _sniff_program(filepath, buffers)
+
+    if program == 'escf':
+        data = parse_escf(
             filepath, 
             egradname=egradoutname, 
             search_for_egrad=search_for_egrad,
             suppress_egrad_notification=suppress_egrad_notification,
+            table=table,
+            lazy=lazy,
+            buffers=buffers,
         )
 
-    elif re.search('R I C C 2', log):
-        return parse_ricc2(filepath)
+    elif program == 'ricc2':
+        data = parse_ricc2(filepath, table=table, buffers=buffers)
         
-    elif re.search('e g r a d', log):
-        return parse_egrad(filepath)
+    elif program == 'egrad':
+        data = parse_egrad(filepath, buffers)
 
     else:
         print(f'ERROR: Output file {filepath.name} unrecognized, does not seem to correspond to any of the accepted calculations (escf, ricc2, or egrad).')
         return None
 
+    # kept with the (cached) result so that callers don't have to read the file again
+    data['program'] = program
+
+    if cache:
+        cache.set(cachekey, data)
+    return data
+
+def lookup_state(
+        data,
+        number,
+        irrep = None,
+        mult = None,
+    ):
+    """
+        Find a state in the output of parse_results (or parse_escf/parse_ricc2) by its number,
+        and if needed its irrep and multiplicity, e.g. lookup_state(data, 3, 'b1u', 'singlet').
+
+        Uses the index stored with the results, so lookups don't scan the list of states.
+        Raises KeyError if there is no such state, ValueError if irrep/mult are needed
+        to tell states apart
+    """
+    index = data.get('index')
+    if index is None:
+        index = data['index'] = StateIndex(data['states'])
+    return index.lookup(number, irrep, mult)
+
+
 def _get_state_label(state, irrep=False, mult=False):
     if irrep and mult:
         mult_letter = state.mult[0].capitalize()
@@ -556,106 +911,397 @@ def tpa_table(
         N = 4,
         linewidth = 0.1,
         lineshape = 'lorentzian',
+        cache = False,
     ):
-    states = parse_results(filepath, search_for_egrad=False)['states']
+    # the table needs neither contributions nor tensors
+    states = parse_results(filepath, search_for_egrad=False, cache=cache, table=True, lazy=True)['states']
+    if not isinstance(states, StateTable):
+        states = StateTable.from_states(states)
+
+    # pandas is only imported when needed, it dominates the start up time of the scripts
+    import pandas as pd
+
+    # missing values are NaN in a table, fail like State.get_cross_section does
+    # so that outputs without 2PA data aren't tabulated (or plotted) as NaN
+    if np.isnan(states.transition_strength).any() or np.isnan(states.photon_energies).any():
+        raise TypeError(f'No 2PA data for some of the states in {filepath}, cannot compute cross sections')
+
+    labels = states.labels(irrep=irrep, mult=mult)
+    cross_sections = states.cross_section(N = N, linewidth=linewidth, lineshape=lineshape)
 
     if compact:
         values = {
-            'State' : [_get_state_label(x, irrep=irrep, mult=mult) for x in states],
-            'delta E /eV' : [x.excitation_energy * 27.2114 for x in states],
-            'delta_2PA /au' : [x.transition_strength for x in states],
-            'sigma_2PA /GM' : [x.get_cross_section(N = N, linewidth=linewidth, lineshape=lineshape) for x in states],
-            'f' : [x.oscillator_strength for x in states],
-            'mu_01 /D' : [x.transition_dipole['norm'] for x in states],
+            'State' : labels,
+            'delta E /eV' : states.excitation_energy * 27.2114,
+            'delta_2PA /au' : states.transition_strength,
+            'sigma_2PA /GM' : cross_sections,
+            'f' : states.oscillator_strength,
+            'mu_01 /D' : states.transition_dipole[:, 0],
         }
 
     else:
         values = {
-            'State' : [_get_state_label(x, irrep=irrep, mult=mult) for x in states],
-            'Excitation Energy /eV' : [x.excitation_energy * 27.2114 for x in states],
-            '2PA Strength /a.u.' : [x.transition_strength for x in states],
-            'Cross Section /GM' : [x.get_cross_section(N = N, linewidth=linewidth, lineshape=lineshape) for x in states],
-            'Oscillator Strength' : [x.oscillator_strength for x in states],
-            'Transition Dipole /D' : [x.transition_dipole['norm'] for x in states],
+            'State' : labels,
+            'Excitation Energy /eV' : states.excitation_energy * 27.2114,
+            '2PA Strength /a.u.' : states.transition_strength,
+            'Cross Section /GM' : cross_sections,
+            'Oscillator Strength' : states.oscillator_strength,
+            'Transition Dipole /D' : states.transition_dipole[:, 0],
         }
     df = pd.DataFrame(values)
     return df
 
         
-def parse_exspec(filepath):
+# (field of the structured array, column in the exspectrum file, key in the dict and DataFrame)
+_exspec_fields = [
+    ('number', 0, 'Excitation numbers'),
+    ('hartree', 2, 'E /hartree'),
+    ('ev', 3, 'E /eV'),
+    ('wavenumber', 4, 'E /cm$^{-1}$'),
+    ('nm', 5, 'E /nm'),
+    ('osc_vel', 6, 'Oscillator (vel)'),
+    ('osc_len', 7, 'Oscillator (len)'),
+]
+
+
+def _scan_exspec(logfile):
+    """
+        The excitations in an exspectrum file as an (n, 7) float array with the columns
+        of _exspec_fields. Every line is split once and the values are written into an
+        array that doubles in size when it is full
+    """
+    rows = np.empty((256, len(_exspec_fields)))
+    n = 0
+    for i, line in enumerate(logfile):
+        if "Excitation spectrum" in line and i != 0:
+            break
+        tokens = line.split()
+        if not tokens or not _is_int(tokens[0]):
+            continue
+        if n == len(rows):
+            rows = np.concatenate([rows, np.empty_like(rows)])
+        # spelled out rather than looped over _exspec_fields, this is the hot loop.
+        # Wavenumbers are written with Fortran D exponents
+        rows[n] = (
+            float(tokens[0]),
+            float(tokens[2]),
+            float(tokens[3]),
+            float(tokens[4].replace('D', 'E')),
+            float(tokens[5]),
+            float(tokens[6]),
+            float(tokens[7]),
+        )
+        n += 1
+    return rows[:n].copy()
+
+
+def _exspec_array(rows, extra=()):
+    """ Structured array of _scan_exspec rows, with extra (name, values) fields in front """
+    dtype = [(name, np.asarray(values).dtype) for name, values in extra]
+    dtype += [(name, np.int64 if name == 'number' else np.float64) for name, column, key in _exspec_fields]
+    array = np.empty(len(rows), dtype=dtype)
+    for name, values in extra:
+        array[name] = values
+    for i, (name, column, key) in enumerate(_exspec_fields):
+        array[name] = rows[:, i]
+    return array
+
+
+def _exspec_output(rows, output):
+    if output == 'dict':
+        data = {key : rows[:, i] for i, (name, column, key) in enumerate(_exspec_fields)}
+        data['Excitation numbers'] = data['Excitation numbers'].astype(np.int64)
+        return data
+    if output == 'array':
+        return _exspec_array(rows)
+    if output == 'dataframe':
+        import pandas as pd
+        return pd.DataFrame(_exspec_output(rows, 'dict'))
+    raise ValueError(f'Unknown output {output}, use dict, array or dataframe')
+
+
+def parse_exspec(filepath, output='dict'):
     """
         For the expspectrum file which provides vertical excitations (UV-Vis)
+
+        output sets what is returned: 'dict' for a dict of NumPy arrays (excitation
+        numbers, energies in hartree, eV, cm-1 and nm, velocity and length gauge oscillator
+        strengths), 'array' for a structured array with the fields number, hartree, ev,
+        wavenumber, nm, osc_vel and osc_len, or 'dataframe' for a DataFrame with the
+        columns of the dict. To read the files of a whole directory tree, see gather_exspec
     """
     filepath = Path(filepath)
-    excno = []
-    hartree = []
-    eV = []
-    ecm = []
-    enm = []
-    oscvel = []
-    osclen = []
     with filepath.open() as log:
-        for i, line in enumerate(log.readlines()):
-            if "Excitation spectrum" in line and i != 0:
-                break
-            if _is_int(line.split()[0]):
-                excno.append(int(line.split()[0]))
-                hartree.append(float(line.split()[2]))
-                eV.append(float(line.split()[3]))
-                ecm.append(
-                    float(
-                        line.split()[4].replace('D','E')
-                    )
-                )
-                enm.append(float(line.split()[5]))
-                oscvel.append(float(line.split()[6]))
-                osclen.append(float(line.split()[7]))
-
-    return {
-        'Excitation numbers' : excno,
-        'E /hartree' : hartree,
-        'E /eV' : eV,
-        'E /cm$^{-1}$' : ecm,
-        'E /nm' : enm,
-        'Oscillator (vel)' : oscvel,
-        'Oscillator (len)' : osclen,
-    }
+        rows = _scan_exspec(log)
+    return _exspec_output(rows, output)
 
 
-def gather_state_data(
-        basedir, 
-        outfilename = None, 
+def gather_exspec(
+        basedir,
+        filename = 'exspectrum',
+        fulldirnames = False,
+        orderedkeys = None,
+        sortfunc = None,
+        output = 'dataframe',
+        index = None,
+    ):
+    """
+        Read the exspectrum files of every directory below basedir into one stacked table,
+        keyed by directory names as in gather_state_data.
+
+        output is 'dataframe' for a DataFrame indexed by (directory, excitation number),
+        'array' for one structured array (see parse_exspec) with a leading 'directory'
+        field, or 'dict' for {directory : parse_exspec dict}. index is an OutputIndex
+        of basedir that tracks filename
+    """
+    if output not in ('dict', 'array', 'dataframe'):
+        raise ValueError(f'Unknown output {output}, use dict, array or dataframe')
+
+    basedir = Path(basedir)
+    filelist = _find_outputs(
+        basedir,
+        outfilename = filename,
+        orderedkeys = orderedkeys,
+        sortfunc = sortfunc,
+        fulldirnames = fulldirnames,
+        index = index,
+    )
+
+    keys = []
+    blocks = []
+    for filepath in filelist:
+        try:
+            with filepath.open() as log:
+                rows = _scan_exspec(log)
+        except:
+            print(f'Error parsing exspectrum file {filepath.resolve()}, check for issues')
+            continue
+        keys.append(str(filepath.relative_to(basedir).parent) if fulldirnames else filepath.parent.name)
+        blocks.append(rows)
+
+    if output == 'dict':
+        return {key : _exspec_output(rows, 'dict') for key, rows in zip(keys, blocks)}
+
+    rows = np.concatenate(blocks) if blocks else np.empty((0, len(_exspec_fields)))
+    directories = np.repeat(np.array(keys, dtype=str), [len(x) for x in blocks])
+    if output == 'array':
+        return _exspec_array(rows, extra=[('directory', directories)])
+
+    import pandas as pd
+    table = pd.DataFrame(_exspec_output(rows, 'dict'))
+    table.index = pd.MultiIndex.from_arrays(
+        [directories, table.pop('Excitation numbers')],
+        names = ['Directory', 'State'],
+    )
+    return table
+
+
+def _cross_sections(states):
+    """
+        2PA cross sections (GM) of a list of states, from a single call of the vectorized
+        cross_section. Raises TypeError like State.get_cross_section if a state has no 2PA data
+    """
+    photons = [x.photon_energies[:2] for x in states]
+    strengths = [x.transition_strength for x in states]
+    if None in strengths or any(None in x for x in photons):
+        raise TypeError('No 2PA data for some of the states, cannot compute cross sections')
+    photons = np.array(photons, dtype=float).reshape(-1, 2)
+    return cross_section(photons[:, 0], photons[:, 1], strengths).tolist()
+
+
+def _state_entry(
+        statedata,
+        mu_00,
+        sigma,
+        latexnames = False,
+        compactnames = False,
+        osc = False,
+    ):
+    """
+        The gather_state_data row for a single state, with its cross section sigma
+        (see _cross_sections)
+    """
+    mu_01 = statedata.transition_dipole['norm']
+    if statedata.permanent_dipole == {}:
+        mu_11 = 'NA'
+    else:
+        mu_11 = statedata.permanent_dipole['norm']
+
+    if latexnames:
+        entry = {
+            '$\\Delta E$ /eV' : statedata.excitation_energy * 27.2114,
+            '$\\delta^{\\textrm{2PA}}$ /a.u.' : statedata.transition_strength,
+            '$\\sigma^{\\textrm{2PA}}$ /GM' : sigma,
+            '$|\\mu_{00}|$ /D' : mu_00,
+            '$|\\mu_{01}|$ /D' : mu_01,
+            '$|\\mu_{11}|$ /D' : mu_11,
+        }
+        if osc:
+            entry['$f$'] = statedata.oscillator_strength
+    elif compactnames:
+        entry = {
+            'ex. E' : statedata.excitation_energy * 27.2114,
+            'delta /a.u.' : statedata.transition_strength,
+            'sigma /GM' : sigma,
+            'mu_00' : mu_00,
+            'mu_01' : mu_01,
+            'mu_11' : mu_11,
+        }
+        if osc:
+            entry['osc'] = statedata.oscillator_strength
+    else:
+        entry = {
+            'Excitation Energy /eV' : statedata.excitation_energy * 27.2114,
+            '2PA Strength /a.u.' : statedata.transition_strength,
+            'Cross Section /GM' : sigma,
+            'Ground State Dipole Moment /D' : mu_00,
+            'Transition Dipole Moment /D' : mu_01,
+            'Excited State Dipole Moment /D' : mu_11,
+        }
+        if osc:
+            entry['Oscillator Strength'] = statedata.oscillator_strength
+
+    return entry
+
+
+def _single_state(state):
+    return isinstance(state, (int, np.integer))
+
+
+def _gather_file(
+        logfile,
+        basedir,
+        state = 1,
         egradoutname = 'egrad.out',
-        state=1, 
-        egradavail=False,
-        orderedkeys=None,
         fulldirnames = False,
         suppress_egrad_notification = False,
-        tabulate = False,
         latexnames = False,
         compactnames = False,
         verbose_output = False,
         osc = False,
         search_for_egrad = True,
-        sortfunc = None,
+        cache = False,
+        buffers = None,
     ):
     """
-        Recursively gather excitation energies, transition dipoles, cross sections, and dipole moments for all output files in a given directory and compile them into a dictionary, with keys provided by the directory names
+        Collect the data for a single output file in gather_state_data.
+        Returns a (key, entry) tuple, or None if the file is skipped.
+        If state is a list of state numbers or 'all', returns (key, {number : entry}, missing)
+        instead, where missing lists the requested states the file does not have
     """
+    if verbose_output:
+        print(f'Analyzing log file {logfile.resolve()}')
+    try:
+        parsed_data = parse_results(logfile, egradoutname=egradoutname, suppress_egrad_notification=suppress_egrad_notification, search_for_egrad=search_for_egrad, cache=cache, buffers=buffers)
+        if _single_state(state):
+            statedata = parsed_data['states'][state - 1]
+        else:
+            nstates = len(parsed_data['states'])
+            if state == 'all':
+                numbers = list(range(1, nstates + 1))
+            else:
+                numbers = list(state)
+            missing = [x for x in numbers if not 1 <= x <= nstates]
+            if missing:
+                print(f'Excited state(s) {", ".join(str(x) for x in missing)} not available for file {logfile.resolve()}')
+    except IndexError:
+        print(f'Excited state {state} not available for file {logfile.resolve()}')
+        #print(parsed_data)
+        return None
+    except:
+        print(f'Error parsing output file {logfile.resolve()}, check for issues')
+        return None
 
-    if state < 1:
-        print("NOTE: Excited state numbering starts at 1 here (for your convenience). Retry with a value over 1")
+    mu_00 = parsed_data['mu_00']['norm']
+
+    if fulldirnames:
+        key = str(logfile.relative_to(basedir).parent)
+    else:
+        key = logfile.parent.name
+
+    try:
+        if _single_state(state):
+            sigma = _cross_sections([statedata])[0]
+            entry = _state_entry(statedata, mu_00, sigma, latexnames, compactnames, osc)
+        else:
+            # all the cross sections of the file in one vectorized call
+            present = [x for x in numbers if x not in missing]
+            states = [parsed_data['states'][x - 1] for x in present]
+            entries = {
+                number : _state_entry(statedata, mu_00, sigma, latexnames, compactnames, osc)
+                for number, statedata, sigma in zip(present, states, _cross_sections(states))
+            }
+    except:
+        print(f'Errors in extracting data in subdir {logfile.parent}, skipping for now')
         return None
 
-    basedir = Path(basedir)
+    if _single_state(state):
+        return key, entry
+    return key, entries, missing
+
+
+def _gather_job(job, **options):
+    """ _gather_file for a (logfile, buffers) pair, for _map_files """
+    logfile, buffers = job
+    return _gather_file(logfile, buffers=buffers, **options)
+
+
+def _captured(func, *args, **kwargs):
+    """
+        Run func, returning its result along with anything it printed
+        (used so that messages from worker processes are reported in order)
+    """
+    with contextlib.redirect_stdout(io.StringIO()) as output:
+        result = func(*args, **kwargs)
+    return result, output.getvalue()
+
+
+def _map_files(func, filelist, workers=1, **kwargs):
+    """
+        Apply func(logfile, **kwargs) to every file in filelist, in order.
+        With more than one worker the files are spread over a process pool,
+        printed messages are replayed in the same order as the serial loop
+    """
+    if workers is None or workers < 1:
+        workers = os.cpu_count()
+
+    if workers == 1 or len(filelist) < 2:
+        for logfile in filelist:
+            yield func(logfile, **kwargs)
+        return
+
+    chunksize = max(1, len(filelist) // (workers * 4))
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        for result, output in executor.map(
+                functools.partial(_captured, func, **kwargs),
+                filelist,
+                chunksize=chunksize,
+            ):
+            print(output, end='')
+            yield result
+
+
+def _find_outputs(
+        basedir,
+        outfilename = None,
+        orderedkeys = None,
+        sortfunc = None,
+        fulldirnames = False,
+        index = None,
+    ):
+    """
+        The output files below basedir, in the order used for the gather_state_data table.
+        index is an OutputIndex of basedir; without one the tree is scanned here
+    """
     if outfilename is None:
         # Search for any files in the fallback list
-        fallbacknames = ['escf.out', 'bse.out', 'tpa.out', 'td-dft.out', 'ricc2.out']
-        filelist = []
-        for name in fallbacknames:
-            filelist.extend(basedir.rglob(name))
+        names = ['escf.out', 'bse.out', 'tpa.out', 'td-dft.out', 'ricc2.out']
     else:
-        filelist = list(basedir.rglob(outfilename))
+        names = [outfilename]
+
+    if index is None:
+        index = OutputIndex(basedir, names=names).scan()
+    filelist = index.outputs(names)
 
     if orderedkeys is not None:
         filelist = sorted(
@@ -672,120 +1318,359 @@ def gather_state_data(
     else:
         filelist = sorted(filelist, key=lambda x: str(x.parent.name))
 
+    return filelist
 
-    collectdata = {}
-    for logfile in filelist:
-        if verbose_output:
-            print(f'Analyzing log file {logfile.resolve()}')
-        try:
-            parsed_data = parse_results(logfile, egradoutname=egradoutname, suppress_egrad_notification=suppress_egrad_notification, search_for_egrad=search_for_egrad)
-            statedata = parsed_data['states'][state - 1]
-        except IndexError:
-            print(f'Excited state {state} not available for file {logfile.resolve()}')
-            #print(parsed_data)
+
+# larger files are not read ahead but streamed from disk by the parsers, so that
+# prefetching never holds more than a few times this in memory
+_prefetch_max_bytes = 16 * 1024**2
+
+
+def _read_outputs(logfile, egradoutname='egrad.out', search_for_egrad=True, cache=False, known=None):
+    """
+        Read an output (and its egrad companion) for parse_results, as a buffers mapping
+        {path : bytes}, with None for files that are missing. Nothing is read if the
+        parsed result is already cached, or for the files already in known. Files over
+        _prefetch_max_bytes are left out, the parsers read those from disk
+    """
+    buffers = dict(known or {})
+    if cache:
+        if cache is True:
+            cache = default_cache()
+        key = _cache_key(cache, logfile, egradoutname, search_for_egrad, False, False)
+        if cache.has(key):
+            return buffers
+
+    paths = [logfile]
+    if search_for_egrad:
+        paths.append(logfile.parent / egradoutname)
+    for path in paths:
+        if path in buffers:
             continue
+        try:
+            with path.open('rb') as outfile:
+                if os.fstat(outfile.fileno()).st_size > _prefetch_max_bytes:
+                    continue
+                buffers[path] = outfile.read()
+        except OSError:
+            buffers[path] = None
+    return buffers
+
+
+def _prefetched(filelist, read, depth=4):
+    """
+        Yield (logfile, read(logfile)) for every file in filelist, in order, with up to
+        depth files being read ahead by a thread pool while the caller works on the
+        current one. Reads that fail give None
+    """
+    def safe_read(logfile):
+        try:
+            return read(logfile)
         except:
-            print(f'Error parsing output file {logfile.resolve()}, check for issues')
-            continue
+            return None
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=depth) as executor:
+        pending = collections.deque()
+        files = iter(filelist)
+        for logfile in itertools.islice(files, depth):
+            pending.append((logfile, executor.submit(safe_read, logfile)))
+        while pending:
+            logfile, future = pending.popleft()
+            for nextfile in itertools.islice(files, 1):
+                pending.append((nextfile, executor.submit(safe_read, nextfile)))
+            yield logfile, future.result()
+
+
+def _file_signature(filepath):
+    """ (size, mtime) of a file, None if it does not exist """
+    try:
+        stat = os.stat(filepath)
+    except OSError:
+        return None
+    return stat.st_size, stat.st_mtime_ns
+
 
+class StateDataWatcher():
+    """
+        Incremental gather_state_data for directory trees that are still being written to,
+        e.g. while a batch of calculations is running.
+
+        The watcher keeps a manifest of the size and modification time of every output
+        (and of the egrad output next to it). Each refresh() updates an OutputIndex of the
+        tree, which only lists the directories that changed, and only new or modified
+        outputs are parsed again, so the cost of a refresh is set by the number of
+        changed files rather than the size of the tree. Outputs that could not be parsed
+        are retried once they change.
+
+        Takes the same arguments as gather_state_data, and update_index=False to use a
+        saved index as it is
+    """
 
-        #try:
-        #    dipdata = parse_egrad(logfile.parent / egradoutname)
-        #    mu_00 = dipdata['mu_00']['norm']
-        #    mu_01 = dipdata['mu_01']['norm']
-        #    mu_11 = dipdata['mu_11']['norm']
-        #except FileNotFoundError:
-        #    if suppress_egrad_warning == False:
-        #        print(f'No egrad outfile in directory {logfile.parent}')
-        #    mu_00 = get_ground_state_dipole(logfile)
-        #    mu_01 = statedata.transition_dipole['norm']
-        #    mu_11 = 'NA'
-
-        mu_00 = parsed_data['mu_00']['norm']
-        mu_01 = statedata.transition_dipole['norm']
-        if statedata.permanent_dipole == {}:
-            mu_11 = 'NA'
+    def __init__(
+            self,
+            basedir,
+            outfilename = None,
+            egradoutname = 'egrad.out',
+            state = 1,
+            orderedkeys = None,
+            fulldirnames = False,
+            sortfunc = None,
+            search_for_egrad = True,
+            workers = 1,
+            prefetch = 0,
+            index = None,
+            update_index = True,
+            **options,
+        ):
+        self.basedir = Path(basedir)
+        self.outfilename = outfilename
+        self.egradoutname = egradoutname
+        self.orderedkeys = orderedkeys
+        self.fulldirnames = fulldirnames
+        self.sortfunc = sortfunc
+        self.search_for_egrad = search_for_egrad
+        self.workers = workers
+        self.prefetch = prefetch
+        self.index = None
+        self.index_path = None
+        self.update_index = update_index
+        if isinstance(index, OutputIndex):
+            self.index = index
+        elif index is not None:
+            self.index_path = Path(index)
+        self.options = dict(
+            state = state,
+            egradoutname = egradoutname,
+            fulldirnames = fulldirnames,
+            search_for_egrad = search_for_egrad,
+            **options,
+        )
+        self.state = state
+        self.filelist = []
+        self.manifest = {}
+        self.results = {}
+
+    def _index_names(self):
+        names = [*output_names, *companion_names]
+        if self.outfilename is not None:
+            names.append(self.outfilename)
+        if self.search_for_egrad:
+            names.append(self.egradoutname)
+        return names
+
+    def _refresh_index(self):
+        """ Load, update or build the index of the tree (saving it if it has a path) """
+        if self.index is None and self.index_path is not None and self.index_path.is_file():
+            self.index = OutputIndex.load(self.index_path, basedir=self.basedir)
+            changed = None
+        elif self.index is None:
+            self.index = OutputIndex(self.basedir, names=self._index_names()).scan()
+            changed = True
         else:
-            mu_11 = statedata.permanent_dipole['norm']
+            changed = None
+
+        missing = [x for x in self._index_names() if x not in self.index.names]
+        if missing:
+            # e.g. a saved index from a run with other output names, scan again for both
+            self.index = OutputIndex(
+                self.basedir,
+                names = [*self.index.names, *missing],
+                recursive = self.index.recursive,
+            ).scan()
+            changed = True
+        elif changed is None:
+            changed = self.update_index and self.index.update()
+
+        if changed and self.index_path is not None:
+            self.index.save(self.index_path)
+
+    def _companion_missing(self, logfile):
+        """ Whether the index knows that there is no egrad output next to logfile """
+        return self.search_for_egrad and self.index.exists(logfile.parent / self.egradoutname) is False
+
+    def _signature(self, logfile):
+        if self.search_for_egrad and not self._companion_missing(logfile):
+            return _file_signature(logfile), _file_signature(logfile.parent / self.egradoutname)
+        return _file_signature(logfile), None
+
+    def refresh(self):
+        """
+            Look for new, modified and removed outputs and parse the new and modified ones.
+            Returns the list of files that were parsed
+        """
+        self._refresh_index()
+        self.filelist = _find_outputs(
+            self.basedir,
+            outfilename = self.outfilename,
+            orderedkeys = self.orderedkeys,
+            sortfunc = self.sortfunc,
+            fulldirnames = self.fulldirnames,
+            index = self.index,
+        )
 
-        if fulldirnames:
-            key = str(logfile.relative_to(basedir).parent)
+        if self.prefetch:
+            # the stats are round trips too on network filesystems
+            with concurrent.futures.ThreadPoolExecutor(max_workers=self.prefetch) as executor:
+                signatures = dict(zip(self.filelist, executor.map(self._signature, self.filelist)))
         else:
-            key = logfile.parent.name
+            signatures = {x : self._signature(x) for x in self.filelist}
+        changed = [x for x in self.filelist if self.manifest.get(x) != signatures[x]]
 
-        try:
-            if osc:
-                if latexnames:
-                    collectdata[key] = {
-                        '$\\Delta E$ /eV' : statedata.excitation_energy * 27.2114,
-                        '$\delta^{\\textrm{2PA}}$ /a.u.' : statedata.transition_strength,
-                        '$\\sigma^{\\textrm{2PA}}$ /GM' : statedata.get_cross_section(),
-                        '$|\\mu_{00}|$ /D' : mu_00,
-                        '$|\\mu_{01}|$ /D' : mu_01,
-                        '$|\\mu_{11}|$ /D' : mu_11,
-                        '$f$' : statedata.oscillator_strength,
-                    }
-                elif compactnames:
-                    collectdata[key] = {
-                        'ex. E' : statedata.excitation_energy * 27.2114,
-                        'delta /a.u.' : statedata.transition_strength,
-                        'sigma /GM' : statedata.get_cross_section(),
-                        'mu_00' : mu_00,
-                        'mu_01' : mu_01,
-                        'mu_11' : mu_11,
-                        'osc' : statedata.oscillator_strength,
-                    }
-
-                else:
-                    collectdata[key] = {
-                        'Excitation Energy /eV' : statedata.excitation_energy * 27.2114,
-                        '2PA Strength /a.u.' : statedata.transition_strength,
-                        'Cross Section /GM' : statedata.get_cross_section(),
-                        'Ground State Dipole Moment /D' : mu_00,
-                        'Transition Dipole Moment /D' : mu_01,
-                        'Excited State Dipole Moment /D' : mu_11,
-                        'Oscillator Strength' : statedata.oscillator_strength,
-                    }
-            else:
-                if latexnames:
-                    collectdata[key] = {
-                        '$\\Delta E$ /eV' : statedata.excitation_energy * 27.2114,
-                        '$\delta^{\\textrm{2PA}}$ /a.u.' : statedata.transition_strength,
-                        '$\\sigma^{\\textrm{2PA}}$ /GM' : statedata.get_cross_section(),
-                        '$|\\mu_{00}|$ /D' : mu_00,
-                        '$|\\mu_{01}|$ /D' : mu_01,
-                        '$|\\mu_{11}|$ /D' : mu_11,
-                    }
-                elif compactnames:
-                    collectdata[key] = {
-                        'ex. E' : statedata.excitation_energy * 27.2114,
-                        'delta /a.u.' : statedata.transition_strength,
-                        'sigma /GM' : statedata.get_cross_section(),
-                        'mu_00' : mu_00,
-                        'mu_01' : mu_01,
-                        'mu_11' : mu_11,
-                    }
-
-                else:
-                    collectdata[key] = {
-                        'Excitation Energy /eV' : statedata.excitation_energy * 27.2114,
-                        '2PA Strength /a.u.' : statedata.transition_strength,
-                        'Cross Section /GM' : statedata.get_cross_section(),
-                        'Ground State Dipole Moment /D' : mu_00,
-                        'Transition Dipole Moment /D' : mu_01,
-                        'Excited State Dipole Moment /D' : mu_11,
-                    }
+        for logfile in set(self.manifest) - set(signatures):
+            del self.manifest[logfile]
+            del self.results[logfile]
 
-        except:
-            print(f'Errors in extracting data in subdir {logfile.parent}, skipping for now')
-            continue
+        for logfile, result in zip(changed, self._gather(changed)):
+            self.results[logfile] = result
+            self.manifest[logfile] = signatures[logfile]
+
+        return changed
+
+    def _known(self, logfile):
+        """ buffers telling parse_results about a companion the index found missing """
+        if self._companion_missing(logfile):
+            return {logfile.parent / self.egradoutname : None}
+        return None
+
+    def _gather(self, filelist):
+        """ _gather_file for every file, in order """
+        workers = os.cpu_count() if self.workers is None or self.workers < 1 else self.workers
+        if not self.prefetch or workers > 1:
+            # worker processes already overlap their reads
+            yield from _map_files(
+                _gather_job,
+                [(x, self._known(x)) for x in filelist],
+                workers = self.workers,
+                basedir = self.basedir,
+                **self.options,
+            )
+            return
+
+        def read(logfile):
+            return _read_outputs(
+                logfile,
+                egradoutname = self.egradoutname,
+                search_for_egrad = self.search_for_egrad,
+                cache = self.options.get('cache', False),
+                known = self._known(logfile),
+            )
+
+        for logfile, buffers in _prefetched(filelist, read, depth=self.prefetch):
+            yield _gather_file(logfile, basedir=self.basedir, buffers=buffers, **self.options)
+
+    def missing(self):
+        """
+            The requested states that are not in each file, {key : [state numbers]}
+            (only when several states are gathered)
+        """
+        missing = {}
+        if _single_state(self.state):
+            return missing
+        for logfile in self.filelist:
+            result = self.results.get(logfile)
+            if result is not None and result[2]:
+                missing[result[0]] = result[2]
+        return missing
+
+    def data(self, tabulate=False):
+        """
+            The gathered data, as returned by gather_state_data
+        """
+        collectdata = {}
+        for logfile in self.filelist:
+            result = self.results.get(logfile)
+            if result is not None:
+                collectdata[result[0]] = result[1]
+
+        if not tabulate:
+            return collectdata
+
+        import pandas as pd
+        if _single_state(self.state):
+            return pd.DataFrame.from_dict(
+                collectdata,
+                orient='index',
+            )
 
-    if tabulate:
-        return pd.DataFrame.from_dict(
-            collectdata,
-            orient='index',
+        # long format, one row per (file key, state)
+        index = [(key, number) for key, entries in collectdata.items() for number in entries]
+        table = pd.DataFrame(
+            [entry for entries in collectdata.values() for entry in entries.values()],
+            index = pd.MultiIndex.from_tuples(index, names=['Directory', 'State']),
         )
-    else:
-        return collectdata
+        table.attrs['missing'] = self.missing()
+        return table
 
 
+def gather_state_data(
+        basedir, 
+        outfilename = None, 
+        egradoutname = 'egrad.out',
+        state=1, 
+        egradavail=False,
+        orderedkeys=None,
+        fulldirnames = False,
+        suppress_egrad_notification = False,
+        tabulate = False,
+        latexnames = False,
+        compactnames = False,
+        verbose_output = False,
+        osc = False,
+        search_for_egrad = True,
+        sortfunc = None,
+        workers = 1,
+        cache = False,
+        prefetch = 0,
+        index = None,
+    ):
+    """
+        Recursively gather excitation energies, transition dipoles, cross sections, and dipole moments for all output files in a given directory and compile them into a dictionary, with keys provided by the directory names
+
+        state can also be a list (or range) of state numbers or 'all', in which case each file is
+        still parsed once and the values are {state number : data} dictionaries, or with
+        tabulate a long table indexed by (directory, state). Requested states missing from a file
+        are reported, and listed in the table's attrs['missing']
+
+        workers sets the number of processes used to parse the files (None or 0 to use every core).
+        The output order does not depend on the number of workers.
+        With a single worker, prefetch > 0 reads that many files ahead in background threads
+        while the current one is parsed, which helps on high latency (network) filesystems.
+        Only files up to 16 MiB are read ahead, larger ones are streamed as usual.
+        cache is passed on to parse_results.
+        index is an OutputIndex of basedir (see tpatools.discovery) or the path of a saved
+        one; a saved index is brought up to date, or created if the file doesn't exist yet.
+        To follow a tree while calculations are still running, see StateDataWatcher
+    """
+
+    if _single_state(state):
+        lowest = state
+    elif state == 'all':
+        lowest = 1
+    else:
+        state = list(state)
+        lowest = min(state, default=1)
+    if lowest < 1:
+        print("NOTE: Excited state numbering starts at 1 here (for your convenience). Retry with a value over 1")
+        return None
+
+    watcher = StateDataWatcher(
+        basedir,
+        outfilename = outfilename,
+        egradoutname = egradoutname,
+        state = state,
+        orderedkeys = orderedkeys,
+        fulldirnames = fulldirnames,
+        sortfunc = sortfunc,
+        search_for_egrad = search_for_egrad,
+        workers = workers,
+        prefetch = prefetch,
+        index = index,
+        suppress_egrad_notification = suppress_egrad_notification,
+        latexnames = latexnames,
+        compactnames = compactnames,
+        verbose_output = verbose_output,
+        osc = osc,
+        cache = cache,
+    )
+    watcher.refresh()
+    return watcher.data(tabulate=tabulate)
@@ -1,8 +1,105 @@
+import warnings
 import numpy as np
-import matplotlib.pyplot as plt
 from tpatools.tools import eV_to_nm
 
-def voight(wavelength, intensity, width=25, shape=0.5, yscale=None, rng=None):
+# number of peaks broadened together, bounds the (peaks x grid) work array
+# to about 10 MB on the default 5000 point grid
+_broaden_chunk = 256
+
+# largest grid an adaptive tol may ask for (beyond it the accuracy bound is given up)
+_max_grid_points = 200000
+
+def _grid(l, r, fwhm=None, tol=None, lineshape='lorentzian'):
+    """
+        Evaluation grid from l to r: the fixed 5000 points, or with tol the coarsest
+        even grid on which straight lines between the points (as matplotlib draws them)
+        stay within tol times the height of each broadened peak.
+
+        Linear interpolation is off by at most h**2/8 * max|f''| for a spacing h, which
+        for a peak of full width at half maximum fwhm is h**2/fwhm**2 (Lorentzian, and any
+        Lorentzian/Gaussian mix) or ln2 * h**2/fwhm**2 (Gaussian).
+        Grids are capped at _max_grid_points, with a warning since tol then no longer holds
+    """
+    if tol is None:
+        return np.linspace(l, r, 5000)
+    if lineshape == 'gaussian':
+        spacing = fwhm * np.sqrt(tol / np.log(2))
+    else:
+        spacing = fwhm * np.sqrt(tol)
+    points = int(np.ceil(abs(r - l) / spacing)) + 1
+    if points > _max_grid_points:
+        warnings.warn(
+            f'tol={tol} needs {points} grid points for a linewidth of {fwhm} over {l} to {r}, '
+            f'using {_max_grid_points} instead: the curve is not within tol of the peak heights',
+            stacklevel = 2,
+        )
+        points = _max_grid_points
+    return np.linspace(l, r, max(points, 2))
+
+def _broadened_sum(x, centres, weights, kernel, chunk=None, reach=None, positions=None):
+    """
+        Sum of weights[i] * kernel(x, centres[i]) over all peaks.
+
+        The kernel is evaluated with NumPy broadcasting on a (peaks x grid) array,
+        chunk peaks at a time so that memory stays bounded for large peak sets.
+
+        With reach, each peak is only evaluated on the grid points within reach of its
+        position on the x axis (positions, by default the centres), see _truncated_sum
+    """
+    centres = np.asarray(centres, dtype=float).ravel()
+    weights = np.asarray(weights, dtype=float).ravel()
+    if chunk is None:
+        chunk = _broaden_chunk
+
+    if reach is not None and len(x) > 1 and x[-1] > x[0]:
+        if positions is None:
+            positions = centres
+        positions = np.asarray(positions, dtype=float).ravel()
+        return _truncated_sum(x, centres, weights, kernel, reach, positions, chunk)
+
+    y = np.zeros_like(x, dtype=float)
+    for start in range(0, len(centres), chunk):
+        y += weights[start:start + chunk] @ kernel(
+            x[np.newaxis, :],
+            centres[start:start + chunk, np.newaxis],
+        )
+    return y
+
+
+def _truncated_sum(x, centres, weights, kernel, reach, positions, chunk):
+    """
+        _broadened_sum with every peak cut off beyond reach of its position: the
+        grid window of each peak is found with a binary search on the (ascending) grid,
+        the kernel is evaluated on the (peak, grid point) pairs of all windows at once
+        and scatter-added into the grid with bincount.
+        The work is the total window size rather than peaks x grid points
+    """
+    y = np.zeros_like(x, dtype=float)
+    lo = np.searchsorted(x, positions - reach, side='left')
+    hi = np.searchsorted(x, positions + reach, side='right')
+    counts = hi - lo
+    if not counts.any():
+        return y
+
+    # as many peaks per pass as keeps the pairs within the dense chunk's work array
+    per_pass = max(1, chunk * len(x) // int(counts.max()))
+    for start in range(0, len(centres), per_pass):
+        window = counts[start:start + per_pass]
+        total = int(window.sum())
+        if total == 0:
+            continue
+        peak = np.repeat(np.arange(start, start + len(window)), window)
+        # grid index of each pair: the start of its peak's window plus its place in the window
+        index = lo[peak] + np.arange(total) - np.repeat(np.cumsum(window) - window, window)
+        y += np.bincount(
+            index,
+            weights = weights[peak] * kernel(x[index], centres[peak]),
+            minlength = len(x),
+        )
+    return y
+
+
+def voight(wavelength, intensity, width=25, shape=0.5, yscale=None, rng=None, tol=None, cutoff=None):
     if rng is None:
         l = np.min(wavelength) - 0.25*(np.max(wavelength) - np.min(wavelength))
         r = np.min(wavelength) + 0.25*(np.max(wavelength) - np.min(wavelength))
@@ -11,33 +108,32 @@ def voight(wavelength, intensity, width=25, shape=0.5, yscale=None, rng=None):
         r = rng[1]
 
     #n = int(r - l + 1)
-    x = np.linspace(l,r,5000)
-
-    yvals=[]
-    for i, wav in enumerate(wavelength):
-        yvals.append(
-             intensity[i] * (
-            (
-                shape * 0.832555/(width*1.772454)
-                * np.exp(-2.772589*((x-wav)/width)**2)
-                + (1-shape)/(3.1415927*width * (1+4*((x-wav)/width)**2) )
-            ) /
-            (
-                shape*0.832555/(width*1.772454)
-                + (1-shape)/(3.1415927*width)
-            )
-        )
-        )
-        y = sum(yvals)
-        if yscale is None:
-            y = y / np.max(y)
-        else:
-            y = y / yscale
+    x = _grid(l, r, width, tol)
+
+    peak_height = (
+        shape*0.832555/(width*1.772454)
+        + (1-shape)/(3.1415927*width)
+    )
+    y = _broadened_sum(
+        x,
+        wavelength,
+        intensity,
+        lambda x, wav: (
+            shape * 0.832555/(width*1.772454)
+            * np.exp(-2.772589*((x-wav)/width)**2)
+            + (1-shape)/(3.1415927*width * (1+4*((x-wav)/width)**2) )
+        ) / peak_height,
+        reach = None if cutoff is None else cutoff * width,
+    )
+    if yscale is None:
+        y = y / np.max(y)
+    else:
+        y = y / yscale
     
     return x, y
 
 
-def lorentzian(wavelength, intensity, width=25, rng=None, yscale=None):
+def lorentzian(wavelength, intensity, width=25, rng=None, yscale=None, tol=None, cutoff=None):
     if rng is None:
         l = np.min(wavelength) - 0.25*(np.max(wavelength) - np.min(wavelength))
         r = np.min(wavelength) + 0.25*(np.max(wavelength) - np.min(wavelength))
@@ -45,93 +141,107 @@ def lorentzian(wavelength, intensity, width=25, rng=None, yscale=None):
         l = rng[0]
         r = rng[1]
 
-    x = np.linspace(l,r,5000)
-    yvals = []
-
-    for i, wav in enumerate(wavelength):
-        sq_term = (x - wav) / (width / 2)
-        yvals.append(
-            intensity[i] / (1 + sq_term**2)
-        )
-   
-    y = sum(yvals)
+    x = _grid(l, r, width, tol)
+    y = _broadened_sum(
+        x,
+        wavelength,
+        intensity,
+        lambda x, wav: 1 / (1 + ((x - wav) / (width / 2))**2),
+        reach = None if cutoff is None else cutoff * width,
+    )
     if yscale is not None:
         y = y / np.max(y)
         y = y / yscale
 
     return x, y
 
-def tpabroaden(energy, cross_section, width=0.1, rng=(3,5), lineshape='lorentzian'):
+def tpabroaden(energy, cross_section, width=0.1, rng=(3,5), lineshape='lorentzian', tol=None, cutoff=None):
     """
         Line-broadening for simulation of a 2PA spectrum
         Provide lifetime broadening parameter in eV (default 0.1)
+
+        By default the spectrum is evaluated on 5000 points over rng. With tol (e.g. 1e-3)
+        the number of points follows from the linewidth instead, so that the plotted
+        curve is within tol times the peak height of each band (see _grid). Grids are
+        capped at 200000 points; when a very narrow width over a wide rng needs more,
+        a warning is issued and the tol bound no longer holds
+
+        With cutoff, every band is only evaluated within cutoff linewidths of its
+        centre, which makes broadening thousands of transitions (e.g. conformer
+        ensembles) linear in the number of bands. The tails left out change the
+        spectrum by at most 1/(1 + 4*cutoff**2) (lorentzian) or exp(-4 ln2 cutoff**2)
+        (gaussian) times the summed peak heights of the bands, so cutoff=5 is exact
+        to double precision for Gaussians while Lorentzians need a larger cutoff
+        (1e-4 of the peak heights at cutoff=50)
     """
     if lineshape == 'gaussian':
-        x,y = tpa_gaussian_broaden(energy, cross_section, width, rng)
+        x,y = tpa_gaussian_broaden(energy, cross_section, width, rng, tol=tol, cutoff=cutoff)
     elif lineshape == 'lorentzian':
-        x, y = tpa_lorentzian_broaden(energy, cross_section, width, rng)
+        x, y = tpa_lorentzian_broaden(energy, cross_section, width, rng, tol=tol, cutoff=cutoff)
     else:
         print(f'Invalid lineshape {lineshape} specified')
         return 0
 
     return x, y
 
-def tpa_lorentzian_broaden(energy, cross_section, width, rng):
-    x = np.linspace(rng[0],rng[1],5000)
-    yvals = []
-    cross_removelineshape = np.array(cross_section) * (np.pi * width)
-
-    for i, en in enumerate(energy):
-        yvals.append(
-            cross_removelineshape[i] * width / (
-                np.pi * (2 * x - en)**2 + np.pi*width**2
-            )
-        )
-    y = sum(yvals)
+def tpa_lorentzian_broaden(energy, cross_section, width, rng, tol=None, cutoff=None):
+    # bands sit at half the excitation energy, with a full width at half maximum of width
+    x = _grid(rng[0], rng[1], width, tol)
+    cross_removelineshape = np.asarray(cross_section, dtype=float) * (np.pi * width)
+
+    y = _broadened_sum(
+        x,
+        energy,
+        cross_removelineshape,
+        lambda x, en: width / (
+            np.pi * (2 * x - en)**2 + np.pi*width**2
+        ),
+        reach = None if cutoff is None else cutoff * width,
+        positions = np.asarray(energy, dtype=float) / 2,
+    )
     return x, y
 
-def tpa_gaussian_broaden(energy, cross_section, width, rng):
-    x = np.linspace(rng[0], rng[1], 5000)
-    yvals = []
-    cross_removelineshape = cross_section * width * np.sqrt(np.pi) / (np.sqrt(np.log(2)))
-
-    for i, en in enumerate(energy):
-        yvals.append(
-            cross_removelineshape[i] * (
-                (np.sqrt(np.log(2)) / (width * np.sqrt(np.pi))) *
-                np.exp(- np.log(2) * (
-                    (2 * x - en) / width
-                )**2 )
-            )
-        )
-
-    y = sum(yvals)
+def tpa_gaussian_broaden(energy, cross_section, width, rng, tol=None, cutoff=None):
+    x = _grid(rng[0], rng[1], width, tol, lineshape='gaussian')
+    cross_removelineshape = np.asarray(cross_section, dtype=float) * width * np.sqrt(np.pi) / (np.sqrt(np.log(2)))
+
+    y = _broadened_sum(
+        x,
+        energy,
+        cross_removelineshape,
+        lambda x, en: (
+            (np.sqrt(np.log(2)) / (width * np.sqrt(np.pi))) *
+            np.exp(- np.log(2) * (
+                (2 * x - en) / width
+            )**2 )
+        ),
+        reach = None if cutoff is None else cutoff * width,
+        positions = np.asarray(energy, dtype=float) / 2,
+    )
     return x,y
 
     
 
 
-def tpaplot(
-        tab, 
-        width=0.1, 
-        xmin=None, 
-        xmax=None, 
+def draw_tpa(
+        ax,
+        tab,
+        width=0.1,
+        xmin=None,
+        xmax=None,
         colour = None,
-        nm=False, 
-        save=None, 
-        figure_size=(6,6),
+        nm=False,
         extraplotparams={},
         default_buffer_x_edge = 1,
         labels = False,
         labelcutoff = None,
         lineshape = 'lorentzian',
+        tol = None,
+        cutoff = None,
     ):
     """
-    Function to plot a simulated 2PA spectrum, given a table containing excitation energies and cross sections, as output by the tpaplot.parse.escf_table function
+    Draw a simulated 2PA spectrum onto the matplotlib axes ax (see tpaplot)
     """
-
-    fig, ax = plt.subplots(figsize=figure_size)
-
     cross_section = tab['Cross Section /GM'].values
     ex_energy = tab['Excitation Energy /eV'].values
 
@@ -151,6 +261,8 @@ def tpaplot(
         rng=rng,
         width=width,
         lineshape = lineshape,
+        tol = tol,
+        cutoff = cutoff,
     )
 
     if nm:
@@ -204,14 +316,57 @@ def tpaplot(
         ax.set_xlabel('$\\lambda$ /nm')
     else:
         ax.set_xlabel('Energy /eV')
-    
+
+
+def tpaplot(
+        tab, 
+        width=0.1, 
+        xmin=None, 
+        xmax=None, 
+        colour = None,
+        nm=False, 
+        save=None, 
+        figure_size=(6,6),
+        extraplotparams={},
+        default_buffer_x_edge = 1,
+        labels = False,
+        labelcutoff = None,
+        lineshape = 'lorentzian',
+        tol = None,
+        cutoff = None,
+    ):
+    """
+    Function to plot a simulated 2PA spectrum, given a table containing excitation energies and cross sections, as output by the tpaplot.parse.escf_table function
+
+    The plot is shown, or only written to save if given
+    """
+    # pyplot is imported here so that importing tpatools.plot doesn't load it (or pick a backend)
+    import matplotlib.pyplot as plt
+
+    fig, ax = plt.subplots(figsize=figure_size)
+    draw_tpa(
+        ax,
+        tab,
+        width = width,
+        xmin = xmin,
+        xmax = xmax,
+        colour = colour,
+        nm = nm,
+        extraplotparams = extraplotparams,
+        default_buffer_x_edge = default_buffer_x_edge,
+        labels = labels,
+        labelcutoff = labelcutoff,
+        lineshape = lineshape,
+        tol = tol,
+        cutoff = cutoff,
+    )
     fig.tight_layout()
 
     if save is None:    
         plt.show()
     else:
-        plt.savefig(save)
-        plt.show()
+        fig.savefig(save)
+        plt.close(fig)
 
 
 
@@ -240,7 +395,10 @@ def tpaplot_multi(
         lineshape = 'lorentzian',
         title = None,
         show_x = True,
+        tol = None,
+        cutoff = None,
     ):
+    import matplotlib.pyplot as plt
 
     fig, ax = plt.subplots(figsize=figure_size)
     rng = (xmin, xmax)
@@ -268,6 +426,8 @@ def tpaplot_multi(
                 rng=rng,
                 width=width,
                 lineshape = lineshape,
+                tol = tol,
+                cutoff = cutoff,
             )
             #print(i - fromentry + 1)
             y = y + y_offset * (i - fromentry + 1)
@@ -329,6 +489,6 @@ def tpaplot_multi(
     if save is None:    
         plt.show()
     else:
-        plt.savefig(save)
-        plt.show()
+        fig.savefig(save)
+        plt.close(fig)
 
@@ -0,0 +1,248 @@
+"""
+Optional long-running server for the command line scripts.
+
+Starting python and importing numpy/pandas for every tpa, tpaplot, recurtpa or gfsm
+call costs more than parsing a typical output. tpaserver keeps one interpreter with
+the scripts imported, listening on a Unix socket; with TPATOOLS_SERVER set (to 1 for
+the default socket, or to a socket path) the scripts send their arguments and working
+directory to it and print the output it sends back.
+
+Every request is run in a fork of the server, so requests don't share working
+directories or output and a crash only takes down its own fork. The server keeps its
+own environment, apart from the variables in _forwarded_environment that the client
+sends along (the cache location); in particular plots are always drawn with the Agg
+backend, whatever MPLBACKEND is set to. Only the standard library is imported here,
+so that the client side stays quick to start
+"""
+import os
+import io
+import sys
+import stat
+import json
+import socket
+import tempfile
+import importlib
+import contextlib
+import socketserver
+import traceback
+from pathlib import Path
+
+# command name -> module with the main() of the script
+_commands = {
+    'tpa' : 'tpatools.Scripts.tpatab',
+    'tpaplot' : 'tpatools.Scripts.tpaplot',
+    'recurtpa' : 'tpatools.Scripts.recurtab',
+    'gfsm' : 'tpatools.Scripts.gfsmscript',
+}
+
+# environment variables of the client that the request is run with
+_forwarded_environment = ('TPATOOLS_CACHE_DIR', 'XDG_CACHE_HOME', 'MPLCONFIGDIR')
+
+
+def default_socket_path():
+    """
+    Server socket: $TPATOOLS_SERVER if set to a path, otherwise tpatools-<uid>.sock in
+    $XDG_RUNTIME_DIR, or server.sock in a private tpatools-<uid> directory in the
+    temporary directory (which every user can write to)
+    """
+    setting = os.environ.get('TPATOOLS_SERVER', '')
+    if setting and setting.lower() not in ('1', 'true', 'yes', 'on'):
+        return Path(setting)
+    if os.environ.get('XDG_RUNTIME_DIR'):
+        return Path(os.environ['XDG_RUNTIME_DIR']) / f'tpatools-{os.getuid()}.sock'
+    return Path(tempfile.gettempdir()) / f'tpatools-{os.getuid()}' / 'server.sock'
+
+
+def _check_directory(directory):
+    """
+    Raise PermissionError if users other than us (and root) could put a file in
+    directory or replace one, i.e. if they own it or can write to it without the
+    sticky bit
+    """
+    info = os.stat(directory)
+    shared = info.st_mode & 0o022 and not info.st_mode & stat.S_ISVTX
+    if info.st_uid not in (os.getuid(), 0) or shared:
+        raise PermissionError(f'{directory} can be written to by other users, not using a tpatools socket there')
+
+
+def _check_socket(path):
+    """
+    Raise PermissionError unless the socket at path was made by a server of this user,
+    so that arguments and working directories are never sent to someone else
+    """
+    if os.stat(path).st_uid != os.getuid():
+        raise PermissionError(f'{path} belongs to another user, not connecting to it')
+    _check_directory(path.parent)
+
+
+def _run_command(request):
+    """
+    Run one script in this process as if called from the command line, returns the
+    reply with its printed output and exit status
+    """
+    stdout = io.StringIO()
+    stderr = io.StringIO()
+    status = 0
+    with contextlib.redirect_stdout(stdout), contextlib.redirect_stderr(stderr):
+        try:
+            command = request['command']
+            if command not in _commands:
+                raise ValueError(f'Unknown command {command}, expected one of {", ".join(_commands)}')
+            os.chdir(request['cwd'])
+            for name in _forwarded_environment:
+                if name in request.get('env', {}):
+                    os.environ[name] = request['env'][name]
+                else:
+                    os.environ.pop(name, None)
+            if 'tpatools.cache' in sys.modules:
+                # picks up the forwarded cache location
+                sys.modules['tpatools.cache']._default_cache = None
+            sys.argv = [command, *request['argv']]
+            importlib.import_module(_commands[command]).main()
+        except SystemExit as exit:
+            if exit.code is None:
+                status = 0
+            elif isinstance(exit.code, int):
+                status = exit.code
+            else:
+                print(exit.code, file=sys.stderr)
+                status = 1
+        except:
+            traceback.print_exc()
+            status = 1
+    return {
+        'stdout' : stdout.getvalue(),
+        'stderr' : stderr.getvalue(),
+        'status' : status,
+    }
+
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        # the client closes its end after sending, so the request is everything up to EOF
+        request = json.loads(self.rfile.read())
+        reply = _run_command(request)
+        self.wfile.write(json.dumps(reply).encode())
+
+
+class _ForkingUnixServer(socketserver.ForkingMixIn, socketserver.UnixStreamServer):
+    pass
+
+
+def _listening(path):
+    """ Whether a server is accepting connections on the socket at path """
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as probe:
+        try:
+            probe.connect(str(path))
+        except OSError:
+            return False
+    return True
+
+
+def serve(socket_path=None, preload=True):
+    """
+    Run the server until interrupted (Ctrl-C or SIGTERM). The socket is only
+    accessible to the current user, and removed again on exit.
+
+    With preload, the scripts and the modules they use (pandas, pyplot with the Agg
+    backend) are imported up front so that every fork starts with them loaded
+    """
+    import signal
+
+    path = Path(socket_path) if socket_path is not None else default_socket_path()
+    if not path.parent.exists():
+        path.parent.mkdir(mode=0o700, parents=True)
+    _check_directory(path.parent)
+    if path.exists():
+        if _listening(path):
+            raise RuntimeError(f'A tpatools server is already listening on {path}')
+        # left over from a server that didn't shut down cleanly
+        path.unlink()
+
+    # there is no display to show plots on, tpaplot has to save them
+    os.environ['MPLBACKEND'] = 'Agg'
+    if preload:
+        import pandas
+        import matplotlib.pyplot
+        for module in _commands.values():
+            importlib.import_module(module)
+
+    umask = os.umask(0o177)
+    try:
+        server = _ForkingUnixServer(str(path), _RequestHandler)
+    finally:
+        os.umask(umask)
+
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    print(f'tpatools server listening on {path}', flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        path.unlink(missing_ok=True)
+
+
+def request(command, argv, cwd=None, socket_path=None):
+    """
+    Run a script (tpa, tpaplot, recurtpa or gfsm) with the arguments argv on the
+    server. Returns the reply, a dict of the printed 'stdout' and 'stderr' and the exit
+    'status'. Raises OSError if no server is listening, and PermissionError if the
+    socket could belong to another user
+    """
+    path = Path(socket_path) if socket_path is not None else default_socket_path()
+    _check_socket(path)
+    message = {
+        'command' : command,
+        'argv' : list(argv),
+        'cwd' : str(cwd if cwd is not None else os.getcwd()),
+        'env' : {x : os.environ[x] for x in _forwarded_environment if x in os.environ},
+    }
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+        client.connect(str(path))
+        client.sendall(json.dumps(message).encode())
+        client.shutdown(socket.SHUT_WR)
+        chunks = []
+        while True:
+            chunk = client.recv(65536)
+            if not chunk:
+                break
+            chunks.append(chunk)
+    return json.loads(b''.join(chunks))
+
+
+def _runs_locally(command, argv):
+    """ Calls that can't go through the server: showing a plot, or watching a tree """
+    if command == 'tpaplot':
+        return not any(
+            x == '--savefile' or x.startswith('--savefile=') or (x.startswith('-s') and not x.startswith('--'))
+            for x in argv
+        )
+    if command == 'recurtpa':
+        return any(x.startswith('--watch') for x in argv)
+    return False
+
+
+def run_client(command):
+    """
+    Entry point of a script: forward the call to the server if TPATOOLS_SERVER is set
+    and a server is listening, otherwise run the script in this process
+    """
+    argv = sys.argv[1:]
+    if os.environ.get('TPATOOLS_SERVER') and not _runs_locally(command, argv):
+        try:
+            reply = request(command, argv)
+        except (FileNotFoundError, ConnectionRefusedError):
+            # no server running, fall back to running here
+            reply = None
+        except PermissionError as error:
+            print(f'NOTE: {error}, running here instead', file=sys.stderr)
+            reply = None
+        if reply is not None:
+            sys.stdout.write(reply['stdout'])
+            sys.stderr.write(reply['stderr'])
+            sys.exit(reply['status'])
+
+    importlib.import_module(_commands[command]).main()
@@ -1,16 +1,130 @@
+import weakref
+import contextlib
 import numpy as np
 
+fine_structure = 0.007297
+bohr_radius = 5.29E-9 # in cm
+light_speed = 2.9979E10 # in cm/s
+
+_lineshape_factors = {
+    'lorentzian' : 1,
+    'gaussian' : np.sqrt(np.pi * np.log(2)),
+}
+
+def cross_section(
+        photon_1,
+        photon_2,
+        transition_strength,
+        lineshape="lorentzian",
+        linewidth=0.1,
+        N=4,
+    ):
+    """
+    Vectorized 2PA cross section (in GM) from photon energies (a.u.) and 2PA
+    transition strengths (a.u.), for any number of states at once.
+
+    photon_1, photon_2 and transition_strength are broadcast against each other,
+    and the states make up the last axis of the result. N, linewidth (eV) and
+    lineshape can each be a single value or a list of values; every list adds a
+    leading axis to the result, in the order lineshape, N, linewidth. For example
+    N=[2, 4], linewidth=[0.1, 0.2, 0.3] on 100 states gives an array of shape
+    (2, 3, 100).
+    """
+    states = (
+        np.asarray(photon_1, dtype=float)
+        * np.asarray(photon_2, dtype=float)
+        * np.asarray(transition_strength, dtype=float)
+    )
+    N = np.asarray(N, dtype=float)
+    linewidth = np.asarray(linewidth, dtype=float)
+
+    # N.shape + linewidth.shape + states.shape
+    scale = (
+        N.reshape(N.shape + (1,) * (linewidth.ndim + states.ndim))
+        / (light_speed * linewidth.reshape(linewidth.shape + (1,) * states.ndim) / 27.2)
+    )
+    sigma = (
+        (np.pi**2) * (bohr_radius**5) * fine_structure
+        * scale * states
+    ) * 10**50
+
+    lineshapes = [lineshape] if isinstance(lineshape, str) else list(lineshape)
+    for shape in lineshapes:
+        if shape not in _lineshape_factors:
+            print(f'Invalid lineshape type {shape} specified, please try again')
+            return 0
+
+    if isinstance(lineshape, str):
+        return sigma * _lineshape_factors[lineshape]
+    return np.stack([sigma * _lineshape_factors[x] for x in lineshapes])
+
+
+def _contribution_entries(line, homo, lumo):
+    """
+    Split a line of the escf 'Dominant contributions' table into the absolute
+    and the HOMO/LUMO-relative contribution dictionaries
+    """
+    fields = line.split()
+    occ = int(fields[0])
+    virt = int(fields[3])
+    symm = {
+        'occ' : fields[1],
+        'virt' : fields[4],
+    }
+    energies = {
+        'occ' : fields[2],
+        'virt' : fields[5],
+    }
+    coeff = float(fields[6])
+
+    dominant = {
+        'occ' : occ,
+        'virt' : virt,
+        'coeff' : coeff,
+        'energies' : energies,
+        'symm' : symm,
+    }
+    
+    if occ == homo:
+        occ_id = 'HOMO'
+    elif occ < homo:
+        occ_id = f'HOMO - {homo - occ}'
+    else:
+        occ_id = f'HOMO + {occ - homo}'
+    
+    if virt == lumo:
+        virt_id = 'LUMO'
+    elif virt > lumo:
+        virt_id = f'LUMO + {virt - lumo}'
+    else:
+        virt_id = f'LUMO - {lumo - virt}'
+
+    fmo = {
+        'occ' : occ_id,
+        'virt' : virt_id,
+        'coeff' : coeff,
+        'energies' : energies,
+        'symm' : symm,
+    }
+    return dominant, fmo
+
+
 class State():
     """ a Class to record the data for a given excitation state"""
 
-    instances = []
-    fine_structure = 0.007297
-    bohr_radius = 5.29E-9 # in cm
-    light_speed = 2.9979E10 # in cm/s
+    # Weak registry of live State objects. Only filled while tracking is switched on
+    # (State.track() or the State.tracking() context manager), so parsing never keeps
+    # states alive on its own
+    instances = weakref.WeakSet()
+    _registries = []
+    fine_structure = fine_structure
+    bohr_radius = bohr_radius
+    light_speed = light_speed
 
     def __init__(self, name, homo=None, overallno = None):
         self.name = name
-        State.instances.append(self)
+        for registry in State._registries:
+            registry.add(self)
 
         pieces = name.split()
         self.number = int(pieces[0])
@@ -30,12 +144,50 @@ class State():
 
         self.dominant_contributions = []
         self.fmo_contributions = []
+        self._coeff_index = {}
         self.transition_dipole = {}
 
         self.permanent_dipole = {}
 
         self.tpa_tensor = {}
 
+    @classmethod
+    def track(cls, enable=True):
+        """
+        Switch recording of new State objects in State.instances on or off
+        """
+        # registries are compared by identity, WeakSet equality compares contents
+        tracked = any(x is cls.instances for x in cls._registries)
+        if enable and not tracked:
+            cls._registries.append(cls.instances)
+        elif not enable and tracked:
+            cls._registries[:] = [x for x in cls._registries if x is not cls.instances]
+
+    @classmethod
+    @contextlib.contextmanager
+    def tracking(cls):
+        """
+        Context manager yielding a weak set of every State created inside the block
+
+            with State.tracking() as live:
+                parse_results('escf.out')
+                print(len(live))
+        """
+        registry = weakref.WeakSet()
+        cls._registries.append(registry)
+        try:
+            yield registry
+        finally:
+            cls._registries[:] = [x for x in cls._registries if x is not registry]
+
+    @classmethod
+    def live_count(cls):
+        """
+        Number of State objects still alive out of those created while tracking
+        was switched on with State.track()
+        """
+        return len(cls.instances)
+
     def set_strength(self, value):
         self.transition_strength = value
 
@@ -91,47 +243,10 @@ class State():
 
 
     def add_contribution(self, line):
-        occ = int(line.split()[0])
-        virt = int(line.split()[3])
-        symm = {
-            'occ' : line.split()[1],
-            'virt' : line.split()[4],
-        }
-        energies = {
-            'occ' : line.split()[2],
-            'virt' : line.split()[5],
-        }
-        coeff = float(line.split()[6])
-
-        self.dominant_contributions.append({
-            'occ' : occ,
-            'virt' : virt,
-            'coeff' : coeff,
-            'energies' : energies,
-            'symm' : symm,
-        })
-        
-        if occ == self.homo:
-            occ_id = 'HOMO'
-        elif occ < self.homo:
-            occ_id = f'HOMO - {self.homo - occ}'
-        else:
-            occ_id = f'HOMO + {occ - self.homo}'
-        
-        if virt == self.lumo:
-            virt_id = 'LUMO'
-        elif virt > self.lumo:
-            virt_id = f'LUMO + {virt - self.lumo}'
-        else:
-            virt_id = f'LUMO - {self.lumo - virt}'
-
-        self.fmo_contributions.append({
-            'occ' : occ_id,
-            'virt' : virt_id,
-            'coeff' : coeff,
-            'energies' : energies,
-            'symm' : symm,
-        })
+        dominant, fmo = _contribution_entries(line, self.homo, self.lumo)
+        self.dominant_contributions.append(dominant)
+        self.fmo_contributions.append(fmo)
+        self.__dict__.setdefault('_coeff_index', {}).clear()
 
 
     def get_contributions(self, fmo_relative = True):
@@ -140,35 +255,36 @@ class State():
         else: 
             return self.dominant_contributions
 
+    def contribution_index(self, fmo_relative = True):
+        """
+        {(occ, virt) : coeff} for the contributions of the state, built on first use.
+        Keys are orbital numbers, or 'HOMO - 1'/'LUMO' style labels with fmo_relative
+        """
+        cache = self.__dict__.setdefault('_coeff_index', {})
+        if fmo_relative not in cache:
+            cache[fmo_relative] = _coeff_index(self.get_contributions(fmo_relative))
+        return cache[fmo_relative]
+
     def get_coeff(self, occ, virt, fmo_relative = True):
-        if fmo_relative:
-            targdat = self.fmo_contributions
-        else:
-            targdat = self.dominant_contributions
-        for cont in targdat:
-            if cont['occ'] == occ and cont['virt'] == virt:
-                return cont['coeff']
-        
-        return 0
+        return self.contribution_index(fmo_relative).get((occ, virt), 0)
 
 
     def get_cross_section(self, lineshape="lorentzian", linewidth=0.1, N=4):
-        cross_section = (
-            N * (np.pi**2) * (State.bohr_radius**5) * State.fine_structure 
-            * self.photon_energies[0] * self.photon_energies[1] 
-            * self.transition_strength
-            / (State.light_speed * linewidth / 27.2)
+        # cross_section() would turn these into NaN; states without 2PA data have to
+        # fail here so that gather_state_data skips their files
+        if None in (self.photon_energies[0], self.photon_energies[1], self.transition_strength):
+            raise TypeError(f'No 2PA data for state {self.name}, cannot compute a cross section')
+        sigma = cross_section(
+            self.photon_energies[0],
+            self.photon_energies[1],
+            self.transition_strength,
+            lineshape = lineshape,
+            linewidth = linewidth,
+            N = N,
         )
-        cross_section = cross_section * 10**50
-
-        if lineshape == 'lorentzian':
-            return cross_section 
-        elif lineshape == 'gaussian':
-            cross_section = cross_section * (np.sqrt(np.pi * np.log(2)))
-            return cross_section
-        
-        print(f'Invalid lineshape type {lineshape} specified, please try again')
-        return 0
+        if np.ndim(sigma) == 0:
+            return float(sigma)
+        return sigma
 
 
     def as_dict(self):
@@ -190,3 +306,561 @@ class State():
                 'Transition Dipole Moment /D' : self.transition_dipole,
             }
 
+
+class LazyState(State):
+    """
+    A State whose MO contributions and TPA tensor are only read when first accessed
+    (see parse_escf(lazy=True)): loader(state, name) fills in the attribute name
+    """
+
+    _lazy_attributes = ('dominant_contributions', 'fmo_contributions', 'tpa_tensor')
+
+    def __init__(self, name, homo=None, overallno = None, loader=None):
+        super().__init__(name, homo=homo, overallno=overallno)
+        for attribute in LazyState._lazy_attributes:
+            del self.__dict__[attribute]
+        self.loader = loader
+
+    def __getattr__(self, name):
+        # only called for attributes that have not been set (or loaded) yet
+        if name not in LazyState._lazy_attributes:
+            raise AttributeError(f"'LazyState' object has no attribute '{name}'")
+        if name == 'tpa_tensor':
+            loaded = ['tpa_tensor']
+            self.tpa_tensor = {}
+        else:
+            loaded = ['dominant_contributions', 'fmo_contributions']
+            self.dominant_contributions = []
+            self.fmo_contributions = []
+
+        loader = self.__dict__.get('loader')
+        if loader is not None:
+            try:
+                loader(self, name)
+            except:
+                for attribute in loaded:
+                    del self.__dict__[attribute]
+                raise
+        return self.__dict__[name]
+
+
+def _coeff_index(contributions):
+    # reversed, so that the first of any repeated (occ, virt) pair wins as in a linear search
+    return {(x['occ'], x['virt']) : x['coeff'] for x in reversed(contributions)}
+
+
+def _as_float(value):
+    """ float value for a table cell, with missing entries ('NA', None) as NaN """
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return np.nan
+
+
+def _dipole_dict(row):
+    if np.all(np.isnan(row)):
+        return {}
+    # components the output doesn't give (ricc2 only has the norm) are 'NA' like in a State
+    return {
+        key : 'NA' if np.isnan(x) else x
+        for key, x in zip(['norm', 'x', 'y', 'z'], row.tolist())
+    }
+
+
+def _table_property(column):
+    """ property reading/writing a scalar column of the parent StateTable """
+    def getter(self):
+        value = self._table._data[column][self._index]
+        if np.isnan(value):
+            return None
+        return value.item()
+
+    def setter(self, value):
+        self._table._data[column][self._index] = _as_float(value)
+
+    return property(getter, setter)
+
+
+class StateTable():
+    """
+    Column-oriented storage for all excited states of an output file.
+
+    Energies, strengths and dipole moments are kept in contiguous NumPy arrays with
+    one row per state (transition_dipole and permanent_dipole as [norm, x, y, z],
+    tpa_tensor as a 3x3 block, photon_energies as [omega_1, omega_2]), so bulk data
+    never goes through per-state Python objects. Missing values are NaN.
+
+    Indexing gives a StateView, which behaves like a State backed by the table row.
+    """
+
+    _columns = {
+        'number' : ((), np.int64),
+        'excitation_energy' : ((), np.float64),
+        'photon_energies' : ((2,), np.float64),
+        'transition_strength' : ((), np.float64),
+        'oscillator_strength' : ((), np.float64),
+        'transition_dipole' : ((4,), np.float64),
+        'permanent_dipole' : ((4,), np.float64),
+        'tpa_tensor' : ((3, 3), np.float64),
+    }
+
+    def __init__(self, homo=None, capacity=16):
+        self.homo = homo
+        self.names = []
+        self.mult = []
+        self.irrep = []
+        self.contributions = []
+        self._coeff_index = {}
+        self._size = 0
+        self._data = {
+            column : np.full((capacity, *shape), np.nan if dtype == np.float64 else 0, dtype=dtype)
+            for column, (shape, dtype) in StateTable._columns.items()
+        }
+
+    def __getattr__(self, name):
+        if name in ('contributions', 'tpa_tensor') and '_loader' in self.__dict__:
+            self._load()
+            return getattr(self, name)
+        if name in StateTable._columns:
+            return self._data[name][:self._size]
+        raise AttributeError(f"'StateTable' object has no attribute '{name}'")
+
+    def __getstate__(self):
+        # trim the spare capacity before pickling
+        state = self.__dict__.copy()
+        state['_data'] = {column : values[:self._size].copy() for column, values in self._data.items()}
+        state['_coeff_index'] = {}
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.__dict__.setdefault('_coeff_index', {})
+
+    def __len__(self):
+        return self._size
+
+    def defer(self, loader):
+        """
+        Drop the MO contributions and TPA tensors of every row; loader(table) fills them
+        in the first time either is accessed (see parse_escf(lazy=True))
+        """
+        self.__dict__.pop('contributions', None)
+        self._data['tpa_tensor'][:] = np.nan
+        self._coeff_index = {}
+        self._loader = loader
+
+    def _load(self):
+        loader = self.__dict__.pop('_loader')
+        self.contributions = [[] for _ in range(self._size)]
+        try:
+            loader(self)
+        except:
+            self.defer(loader)
+            raise
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [StateView(self, i) for i in range(*index.indices(self._size))]
+        if index < 0:
+            index += self._size
+        if not 0 <= index < self._size:
+            raise IndexError('StateTable index out of range')
+        return StateView(self, index)
+
+    def __iter__(self):
+        for i in range(self._size):
+            yield StateView(self, i)
+
+    def append(self, name):
+        """
+        Add an empty row for the state called name (in the '1 singlet a excitation'
+        format used by State) and return a StateView of it to fill in
+        """
+        if self._size == len(self._data['number']):
+            for column, values in self._data.items():
+                extra = np.full_like(values, np.nan if values.dtype == np.float64 else 0)
+                self._data[column] = np.concatenate([values, extra])
+
+        pieces = name.split()
+        self._data['number'][self._size] = int(pieces[0])
+        self.names.append(name)
+        self.mult.append(pieces[1])
+        self.irrep.append(pieces[2])
+        self.contributions.append([])
+        self._size += 1
+        return StateView(self, self._size - 1)
+
+    @classmethod
+    def from_states(cls, states, homo=None):
+        """
+        Build a StateTable from a list of State objects
+        """
+        table = cls(homo=homo, capacity=max(len(states), 1))
+        for state in states:
+            row = table.append(state.name)
+            row.excitation_energy = state.excitation_energy
+            row.photon_energies = state.photon_energies
+            row.transition_strength = state.transition_strength
+            row.oscillator_strength = state.oscillator_strength
+            row.transition_dipole = state.transition_dipole
+            row.permanent_dipole = state.permanent_dipole
+            row.tpa_tensor = state.tpa_tensor
+            table.contributions[-1] = [
+                '{occ} {symm[occ]} {energies[occ]} {virt} {symm[virt]} {energies[virt]} {coeff}'.format(**x)
+                for x in state.dominant_contributions
+            ]
+        return table
+
+    def labels(self, irrep=False, mult=False):
+        """
+        State labels for every row, as produced for single states in tpa_table
+        """
+        numbers = self.number.astype(str)
+        if mult:
+            mult_letters = np.char.upper(np.array(self.mult, dtype=str).astype('U1'))
+            numbers = np.char.add(mult_letters, numbers)
+        if irrep:
+            return np.char.add(numbers, np.array(self.irrep, dtype=str))
+        if mult:
+            return numbers
+        return self.number.copy()
+
+    def contribution_matrix(self):
+        """
+        The MO contributions of every row as a ContributionMatrix
+        """
+        return ContributionMatrix.from_lines(self.contributions, homo=self.homo)
+
+    def cross_section(self, lineshape="lorentzian", linewidth=0.1, N=4):
+        """
+        2PA cross sections (GM) of every row, see cross_section for lists of
+        lineshape, linewidth and N values
+        """
+        return cross_section(
+            self.photon_energies[:, 0],
+            self.photon_energies[:, 1],
+            self.transition_strength,
+            lineshape = lineshape,
+            linewidth = linewidth,
+            N = N,
+        )
+
+
+class StateView(State):
+    """
+    A State whose data lives in a row of a StateTable.
+    Reading or setting its attributes reads or writes the table
+    """
+
+    def __init__(self, table, index):
+        # the data lives in the table, State.__init__ is deliberately not called
+        self._table = table
+        self._index = index
+
+    def __repr__(self):
+        return f'<StateView {self.name!r}>'
+
+    excitation_energy = _table_property('excitation_energy')
+    transition_strength = _table_property('transition_strength')
+    oscillator_strength = _table_property('oscillator_strength')
+
+    @property
+    def name(self):
+        return self._table.names[self._index]
+
+    @property
+    def number(self):
+        return int(self._table._data['number'][self._index])
+
+    @property
+    def mult(self):
+        return self._table.mult[self._index]
+
+    @property
+    def irrep(self):
+        return self._table.irrep[self._index]
+
+    @property
+    def overallno(self):
+        return None
+
+    @property
+    def homo(self):
+        if self._table.homo is None:
+            raise AttributeError('homo is not set for this StateTable')
+        return int(self._table.homo)
+
+    @property
+    def lumo(self):
+        return self.homo + 1
+
+    @property
+    def photon_energies(self):
+        return [None if np.isnan(x) else x for x in self._table._data['photon_energies'][self._index].tolist()]
+
+    @photon_energies.setter
+    def photon_energies(self, value):
+        self._table._data['photon_energies'][self._index] = [_as_float(x) for x in value]
+
+    @property
+    def transition_dipole(self):
+        return _dipole_dict(self._table._data['transition_dipole'][self._index])
+
+    @transition_dipole.setter
+    def transition_dipole(self, value):
+        self._table._data['transition_dipole'][self._index] = [
+            _as_float(value.get(x)) for x in ['norm', 'x', 'y', 'z']
+        ]
+
+    @property
+    def permanent_dipole(self):
+        return _dipole_dict(self._table._data['permanent_dipole'][self._index])
+
+    @permanent_dipole.setter
+    def permanent_dipole(self, value):
+        self._table._data['permanent_dipole'][self._index] = [
+            _as_float(value.get(x)) for x in ['norm', 'x', 'y', 'z']
+        ]
+
+    @property
+    def tpa_tensor(self):
+        tensor = self._table.tpa_tensor[self._index]
+        if np.all(np.isnan(tensor)):
+            return {}
+        return {
+            f'{a}{b}' : tensor[i, j].item()
+            for i, a in enumerate('xyz') for j, b in enumerate('xyz')
+        }
+
+    @tpa_tensor.setter
+    def tpa_tensor(self, value):
+        self._table.tpa_tensor[self._index] = [
+            [_as_float(value.get(f'{a}{b}')) for b in 'xyz'] for a in 'xyz'
+        ]
+
+    @property
+    def dominant_contributions(self):
+        return [
+            _contribution_entries(x, self.homo, self.lumo)[0]
+            for x in self._table.contributions[self._index]
+        ]
+
+    @property
+    def fmo_contributions(self):
+        return [
+            _contribution_entries(x, self.homo, self.lumo)[1]
+            for x in self._table.contributions[self._index]
+        ]
+
+    def add_contribution(self, line):
+        self._table.contributions[self._index].append(line)
+        self._table._coeff_index.pop((self._index, True), None)
+        self._table._coeff_index.pop((self._index, False), None)
+
+    def contribution_index(self, fmo_relative = True):
+        # views are short-lived, so the index is kept by the table
+        key = (self._index, fmo_relative)
+        if key not in self._table._coeff_index:
+            self._table._coeff_index[key] = _coeff_index(self.get_contributions(fmo_relative))
+        return self._table._coeff_index[key]
+
+
+class StateIndex():
+    """
+    Hash index of a list of States (or a StateTable) by (number, irrep, multiplicity),
+    so that states can be looked up without scanning the list.
+
+    Positions refer to the order of the states in the list
+    """
+
+    def __init__(self, states):
+        self.states = states
+        self.keys = {}
+        self.numbers = {}
+        if isinstance(states, StateTable):
+            identifiers = zip(states.number.tolist(), states.irrep, states.mult)
+        else:
+            identifiers = ((x.number, x.irrep, x.mult) for x in states)
+        for position, (number, irrep, mult) in enumerate(identifiers):
+            self.keys.setdefault((number, irrep, mult), position)
+            self.numbers.setdefault(number, []).append(position)
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __contains__(self, key):
+        return key in self.keys
+
+    def positions(self, number, irrep=None, mult=None):
+        """
+        Positions of the states with the given number, optionally restricted to an
+        irrep and/or multiplicity
+        """
+        if irrep is not None and mult is not None:
+            position = self.keys.get((number, irrep, mult))
+            return [] if position is None else [position]
+        positions = self.numbers.get(number, [])
+        if irrep is None and mult is None:
+            return list(positions)
+        return [
+            x for x in positions
+            if (irrep is None or self.states[x].irrep == irrep)
+            and (mult is None or self.states[x].mult == mult)
+        ]
+
+    def lookup(self, number, irrep=None, mult=None):
+        """
+        The state with the given number (and irrep/multiplicity, needed when several
+        states share a number). Raises KeyError if there is no such state and
+        ValueError if the match is ambiguous
+        """
+        positions = self.positions(number, irrep, mult)
+        if not positions:
+            raise KeyError(f'No state {number} {mult or ""} {irrep or ""}'.replace('  ', ' ').strip())
+        if len(positions) > 1:
+            raise ValueError(f'State {number} is ambiguous, specify the irrep and/or multiplicity')
+        return self.states[positions[0]]
+
+
+def _relative_labels(offsets, name):
+    """ 'HOMO', 'HOMO - 2', 'LUMO + 1', ... labels from orbital offsets """
+    offsets = np.asarray(offsets)
+    magnitudes = np.abs(offsets).astype(str)
+    signs = np.where(offsets < 0, ' - ', ' + ')
+    labels = np.char.add(np.char.add(name, signs), magnitudes)
+    return np.where(offsets == 0, name, labels)
+
+
+class ContributionMatrix():
+    """
+    The 'Dominant contributions' of all states of an output, in coordinate (COO) form:
+    parallel arrays state (row of the state in the output), occ, virt (orbital numbers)
+    and coeff (|coeff|^2*100, as printed by escf), one entry per contribution.
+
+    Build it with from_lines (or StateTable.contribution_matrix, parse_contributions),
+    which splits all contribution lines of a file at once instead of making per-line
+    dictionaries. dense() and window() give (states x occ x virt) arrays, top() the
+    largest contributions of each state
+    """
+
+    def __init__(self, state, occ, virt, coeff, nstates=None, homo=None):
+        self.state = np.asarray(state, dtype=np.int64)
+        self.occ = np.asarray(occ, dtype=np.int64)
+        self.virt = np.asarray(virt, dtype=np.int64)
+        self.coeff = np.asarray(coeff, dtype=np.float64)
+        if nstates is None:
+            nstates = int(self.state.max()) + 1 if len(self.state) else 0
+        self.nstates = nstates
+        self.homo = homo
+
+    @classmethod
+    def from_lines(cls, contributions, homo=None):
+        """
+        Build the matrix from the raw contribution table lines, one list per state
+        """
+        counts = np.fromiter((len(x) for x in contributions), dtype=np.int64, count=len(contributions))
+        lines = [line for lines in contributions for line in lines]
+        if not lines:
+            return cls([], [], [], [], nstates=len(contributions), homo=homo)
+
+        # occ, symmetry, energy, virt, symmetry, energy, coeff
+        fields = np.array(' '.join(lines).split())
+        if len(fields) != 7 * len(lines):
+            raise ValueError('Unexpected format of the MO contribution lines, expected 7 fields per line')
+        fields = fields.reshape(-1, 7)
+        return cls(
+            np.repeat(np.arange(len(contributions)), counts),
+            fields[:, 0].astype(np.int64),
+            fields[:, 3].astype(np.int64),
+            fields[:, 6].astype(np.float64),
+            nstates = len(contributions),
+            homo = homo,
+        )
+
+    def __len__(self):
+        return len(self.coeff)
+
+    def _check_homo(self):
+        if self.homo is None:
+            raise ValueError('homo is not set for this ContributionMatrix')
+
+    @property
+    def occ_relative(self):
+        """ occupied orbitals relative to the HOMO (0 for the HOMO, -1 for HOMO - 1, ...) """
+        self._check_homo()
+        return self.occ - self.homo
+
+    @property
+    def virt_relative(self):
+        """ virtual orbitals relative to the LUMO (0 for the LUMO, 1 for LUMO + 1, ...) """
+        self._check_homo()
+        return self.virt - (self.homo + 1)
+
+    def dense(self):
+        """
+        (states x occ x virt) array of the coefficients, over the range of orbitals
+        that appear in any contribution. Returns the array and the occ and virt
+        orbital numbers of its second and third axes
+        """
+        if len(self) == 0:
+            return np.zeros((self.nstates, 0, 0)), np.arange(0), np.arange(0)
+        occ_numbers = np.arange(self.occ.min(), self.occ.max() + 1)
+        virt_numbers = np.arange(self.virt.min(), self.virt.max() + 1)
+        matrix = np.zeros((self.nstates, len(occ_numbers), len(virt_numbers)))
+        matrix[self.state, self.occ - occ_numbers[0], self.virt - virt_numbers[0]] = self.coeff
+        return matrix, occ_numbers, virt_numbers
+
+    def window(self, nocc=None, nvirt=None):
+        """
+        HOMO/LUMO-relative (states x nocc x nvirt) array: element [s, i, j] is the
+        coefficient of the HOMO - i -> LUMO + j excitation in state s. By default the
+        window covers every contribution below the LUMO and above the HOMO
+        """
+        below = -self.occ_relative
+        above = self.virt_relative
+        keep = (below >= 0) & (above >= 0)
+        if nocc is None:
+            nocc = int(below[keep].max()) + 1 if keep.any() else 0
+        if nvirt is None:
+            nvirt = int(above[keep].max()) + 1 if keep.any() else 0
+        keep &= (below < nocc) & (above < nvirt)
+        matrix = np.zeros((self.nstates, nocc, nvirt))
+        matrix[self.state[keep], below[keep], above[keep]] = self.coeff[keep]
+        return matrix
+
+    def top(self, k=1):
+        """
+        The k largest contributions of every state, as a new ContributionMatrix
+        (ordered by state, then by decreasing coefficient)
+        """
+        order = np.lexsort((-self.coeff, self.state))
+        states = self.state[order]
+        # rank of every entry within its state
+        starts = np.searchsorted(states, states, side='left')
+        rank = np.arange(len(states)) - starts
+        selected = order[rank < k]
+        return ContributionMatrix(
+            self.state[selected],
+            self.occ[selected],
+            self.virt[selected],
+            self.coeff[selected],
+            nstates = self.nstates,
+            homo = self.homo,
+        )
+
+    def to_frame(self):
+        """
+        pandas DataFrame with one row per contribution (with 'HOMO - 1' style labels
+        if homo is known)
+        """
+        import pandas as pd
+        frame = pd.DataFrame({
+            'state' : self.state,
+            'occ' : self.occ,
+            'virt' : self.virt,
+            'coeff' : self.coeff,
+        })
+        if self.homo is not None:
+            frame['occ label'] = _relative_labels(self.occ_relative, 'HOMO')
+            frame['virt label'] = _relative_labels(self.virt_relative, 'LUMO')
+        return frame
@@ -1,10 +1,29 @@
 from pathlib import Path
 import sys
+import mmap
+import contextlib
+from tpatools.discovery import OutputIndex
 
 def eV_to_nm(inputarray):
     return 4.135667516E-15 * 2.9979E8 * 1E9 / inputarray
 
-def filepath_searcher(suppliedpath):
+def _first_output(directory, names, index=None):
+    """
+    The first of names that is a file in directory, from a single listing of the
+    directory (or a lookup in index, an OutputIndex that covers it). None if there is none
+    """
+    if index is None:
+        index = OutputIndex(directory, names=names, recursive=False).scan()
+    for name in names:
+        found = index.exists(directory / name)
+        if found is None:
+            found = (directory / name).is_file()
+        if found:
+            return directory / name
+    return None
+
+
+def filepath_searcher(suppliedpath, index=None):
     """
     For integration in the command-line scripts.
     This function processes the filepath input supplied to the script (if any).
@@ -16,15 +35,13 @@ def filepath_searcher(suppliedpath):
 
     If a path to a directory is given instead of a file, the given directory is searched for files matching the the names provided in the fallback list
 
+    index can be an OutputIndex (tpatools.discovery) to look the names up in instead of listing the directory
     """
     fallback_names = ['escf.out', 'bse.out', 'tpa.out', 'ricc2.out', 'tddft.out', 'td-dft.out']
 
     filepath = None
     if suppliedpath is None:
-        for name in fallback_names:
-            if Path(name).is_file():
-                filepath = Path(name)
-                break
+        filepath = _first_output(Path('.'), fallback_names, index)
         
         if filepath is None: 
             print(f'No output filename has been provided. As a fallback, the program has checked and found no files from the following default namelist in the directory:\n\n{"\n".join(fallback_names)}\n\nPlease retry and specify the name of your output file' )
@@ -33,10 +50,7 @@ def filepath_searcher(suppliedpath):
         if Path(suppliedpath).is_file():
             filepath = Path(suppliedpath)
         else:
-            for name in fallback_names:
-                if (Path(suppliedpath) / name).is_file():
-                    filepath = Path(suppliedpath) / name
-                    break
+            filepath = _first_output(Path(suppliedpath), fallback_names, index)
 
             if filepath is None:
                 print('The provided filepath does not exist, please check your input and try again')
@@ -45,4 +59,23 @@ def filepath_searcher(suppliedpath):
     return filepath
 
 
+@contextlib.contextmanager
+def mapped(filepath):
+    """
+    Read-only memory map of a file, for scanning large outputs with bytes regexes
+    without reading them into a str.
+
+    Use as a context manager; the map is closed on exit, so convert any matches
+    before leaving the block. Empty files (which can't be mapped) give b''
+    """
+    with open(filepath, 'rb') as file:
+        try:
+            mapping = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            mapping = None
 
+        if mapping is None:
+            yield b''
+        else:
+            with mapping:
+                yield mapping
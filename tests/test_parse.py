@@ -0,0 +1,91 @@
+"""
+Regression tests for the output parsers
+
+The expected data in test_parse/ was written by the original regex parsers (the
+default options, before tables, lazy parsing and caching existed), so every
+combination of table and lazy has to give the same dicts and State fields
+"""
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+from tpatools.parse import parse_results
+
+datadir = Path(__file__).parent / 'data'
+
+outputs = {
+    'escf' : ('escf/escf.out', 'escf'),
+    'escf_egrad' : ('escf_egrad/escf.out', 'escf'),
+    'ricc2' : ('ricc2/ricc2.out', 'ricc2'),
+    'egrad' : ('egrad/egrad.out', 'egrad'),
+}
+
+state_fields = (
+    'name',
+    'number',
+    'mult',
+    'irrep',
+    'overallno',
+    'homo',
+    'lumo',
+    'excitation_energy',
+    'photon_energies',
+    'transition_strength',
+    'oscillator_strength',
+    'transition_dipole',
+    'permanent_dipole',
+    'tpa_tensor',
+    'dominant_contributions',
+    'fmo_contributions',
+)
+
+# keys added to the parsed data after the regression data was written
+new_keys = ('index', 'program')
+
+
+def _plain(value):
+    """ The parsed data as plain python types, with the states as dicts of their fields """
+    if isinstance(value, dict):
+        return {str(key) : _plain(x) for key, x in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_plain(x) for x in value]
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    if hasattr(value, '__iter__') and not isinstance(value, str):
+        # a StateTable
+        return [_plain(x) for x in value]
+    if hasattr(value, 'photon_energies'):
+        return {field : _plain(getattr(value, field, None)) for field in state_fields}
+    return value
+
+
+@pytest.mark.parametrize('table', [False, True], ids=['list', 'table'])
+@pytest.mark.parametrize('lazy', [False, True], ids=['eager', 'lazy'])
+@pytest.mark.parametrize('output', list(outputs))
+def test_parse_results(output, lazy, table, data_regression):
+    filepath, program = outputs[output]
+    options = {}
+    if table:
+        options['table'] = True
+    if lazy:
+        options['lazy'] = True
+
+    data = parse_results(datadir / filepath, suppress_egrad_notification=True, **options)
+    if 'program' in data:
+        assert data['program'] == program
+    data_regression.check(
+        _plain({key : x for key, x in data.items() if key not in new_keys}),
+        basename = output,
+    )
+
+
+def test_escf_without_egrad(data_regression):
+    """ search_for_egrad=False ignores the egrad output next to the escf output """
+    data = parse_results(datadir / 'escf_egrad/escf.out', search_for_egrad=False)
+    data_regression.check(
+        _plain({key : x for key, x in data.items() if key not in new_keys}),
+        basename = 'escf_egrad_skipped',
+    )